@@ -1,12 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Set, Tuple
 
 import discord
 from redbot.core import Config
 from redbot.core.bot import Red
 
+if TYPE_CHECKING:
+    from .agecheck import AgeVerifier
+    from .bindings import Binding, BindingIndex
+    from .catalog import SelfRoleCatalog
+    from .chunking import GuildChunker
+    from .coalescer import RoleEditCoalescer
+    from .compaction import Compactor
+    from .debounce import ReactionDebouncer
+    from .jobs import JobManager
+    from .kaizo import KaizoGuard
+    from .queues import PerGuildQueue
+    from .reconcile import ReactionReconciler
+    from .searchcache import SearchCache
+    from .sql import SQLiteStore
+    from .sticky import StickyRoleStore
+    from .timed import TimedRoles
+
 
 class MixinMeta(ABC):
     """
@@ -18,6 +36,22 @@ class MixinMeta(ABC):
     def __init__(self, *_args):
         self.config: Config
         self.bot: Red
+        self._ready: asyncio.Event
+        self._jobs: JobManager
+        self._compactor: Compactor
+        self._search_cache: SearchCache
+        self._sticky: StickyRoleStore
+        self._timed: TimedRoles
+        self._kaizo: KaizoGuard
+        self._reconciler: ReactionReconciler
+        self._sql: Optional[SQLiteStore]
+        self._join_queue: PerGuildQueue[discord.Member]
+        self._edits: RoleEditCoalescer
+        self._reactions: ReactionDebouncer
+        self._chunker: GuildChunker
+        self._age: AgeVerifier
+        self._bindings: BindingIndex
+        self._catalog: SelfRoleCatalog
 
     @abstractmethod
     def strip_variations(self, s: str) -> str:
@@ -41,10 +75,46 @@ class MixinMeta(ABC):
     ):
         raise NotImplementedError()
 
+    @abstractmethod
+    async def implied_roles(
+        self, who: discord.Member, give: List[discord.Role], remove: List[discord.Role]
+    ) -> Tuple[List[discord.Role], List[discord.Role]]:
+        raise NotImplementedError()
+
     @abstractmethod
     async def all_are_valid_roles(self, ctx, *roles: discord.Role) -> bool:
         raise NotImplementedError()
 
+    @abstractmethod
+    async def get_exclusive_role_ids(self, role_id: int) -> Set[int]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_reaction_binding(self, message_id: int, eid: str) -> Optional[Binding]:
+        raise NotImplementedError()
+
     @abstractmethod
     async def maybe_update_guilds(self, *guilds: discord.Guild) -> None:
         raise NotImplementedError()
+
+    @abstractmethod
+    async def wait_for_members(self, ctx) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def check_age(self, role: discord.Role, member: discord.Member) -> Optional[bool]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def age_check_passed(
+        self,
+        role: discord.Role,
+        member: discord.Member,
+        kind: str,
+        dest: Optional[discord.abc.Messageable] = None,
+    ) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def handle_birthday_reply(self, message: discord.Message) -> None:
+        raise NotImplementedError()
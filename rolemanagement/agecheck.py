@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from .scheduler import Scheduler
+
+# How long someone has to reply with their date of birth
+AGE_REPLY_TIMEOUT = 60
+
+
+class PendingAgeCheck(NamedTuple):
+    guild_id: int
+    role_id: int
+    # Where the request came from, None for reactions
+    channel_id: Optional[int]
+    # "react", "add" or "buy", what to finish once we have a date of birth
+    kind: str
+
+
+class AgeVerifier:
+    """
+    Tracks who we're waiting on a date of birth from, and for which roles.
+
+    Rather than each request waiting on its own reply, replies are looked up
+    by author id from a single DM listener, and everything waiting on that
+    person is finished at once. Requests nobody answers expire on a Scheduler.
+    """
+
+    def __init__(self, on_timeout: Callable[[int, List[PendingAgeCheck]], Awaitable[None]]):
+        self.on_timeout = on_timeout
+        self._pending: Dict[int, List[PendingAgeCheck]] = {}
+        self._expiry: Scheduler[int] = Scheduler(self._expire, name="age verification")
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._pending
+
+    def add(self, user_id: int, check: PendingAgeCheck):
+        checks = self._pending.setdefault(user_id, [])
+        # Asking for the same role twice replaces the earlier request
+        checks[:] = [
+            c for c in checks if (c.guild_id, c.role_id) != (check.guild_id, check.role_id)
+        ]
+        checks.append(check)
+        self._expiry.schedule(user_id, time.time() + AGE_REPLY_TIMEOUT)
+
+    def pop(self, user_id: int) -> List[PendingAgeCheck]:
+        self._expiry.cancel(user_id)
+        return self._pending.pop(user_id, [])
+
+    def start(self):
+        self._expiry.start()
+
+    def stop(self):
+        self._expiry.stop()
+        self._pending.clear()
+
+    async def _expire(self, user_ids: List[int]):
+        for user_id in user_ids:
+            checks = self._pending.pop(user_id, None)
+            if checks:
+                await self.on_timeout(user_id, checks)
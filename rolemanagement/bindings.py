@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .future_sql import ActionType
+
+BindingKey = Tuple[int, str]  # message id, emoji id or unicode codepoint
+
+
+class Binding(NamedTuple):
+    message_id: int
+    eid: str
+    role_id: int
+    channel_id: Optional[int]
+    guild_id: Optional[int]
+    action_type: ActionType = ActionType.TOGGLE
+
+    def to_config(self) -> Dict[str, Optional[int]]:
+        return {
+            "roleid": self.role_id,
+            "channelid": self.channel_id,
+            "guildid": self.guild_id,
+            "action_type": int(self.action_type),
+        }
+
+
+class BindingIndex:
+    """
+    Reaction role bindings, indexed by role and by guild.
+
+    This is also what reaction events look bindings up in, so they never
+    wait on Config or SQLite.
+
+    Config stores these by message and emoji, which is what reactions need,
+    but listing them for a role or a guild would otherwise mean scanning
+    every binding the bot has. Kept in step with Config by whatever changes it.
+    """
+
+    def __init__(self):
+        self._bindings: Dict[BindingKey, Binding] = {}
+        self._by_role: Dict[int, Set[BindingKey]] = {}
+        self._by_guild: Dict[int, Set[BindingKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self._bindings)
+
+    def load(
+        self,
+        data: Dict[str, Dict[str, Any]],
+        guild_of_channel: Callable[[int], Optional[int]] = lambda _: None,
+    ):
+        """
+        Loads from the REACTROLE custom group, replacing whatever was indexed.
+
+        Older bindings may not have a guild id stored, ``guild_of_channel``
+        is used to fill those in.
+        """
+        self._bindings.clear()
+        self._by_role.clear()
+        self._by_guild.clear()
+        for mid, emojis in data.items():
+            if not emojis or not isinstance(emojis, dict):
+                continue
+            try:
+                message_id = int(mid)
+            except ValueError:
+                continue
+            for eid, rdata in emojis.items():
+                if not rdata or rdata.get("roleid") is None:
+                    continue
+                channel_id = rdata.get("channelid")
+                guild_id = rdata.get("guildid")
+                if guild_id is None and channel_id is not None:
+                    guild_id = guild_of_channel(channel_id)
+                try:
+                    action_type = ActionType(rdata.get("action_type", ActionType.TOGGLE))
+                except ValueError:
+                    action_type = ActionType.TOGGLE
+                self.add(
+                    Binding(message_id, eid, rdata["roleid"], channel_id, guild_id, action_type)
+                )
+
+    def add(self, binding: Binding):
+        key = (binding.message_id, binding.eid)
+        self.remove(*key)
+        self._bindings[key] = binding
+        self._by_role.setdefault(binding.role_id, set()).add(key)
+        if binding.guild_id is not None:
+            self._by_guild.setdefault(binding.guild_id, set()).add(key)
+
+    def remove(self, message_id: int, eid: str) -> Optional[Binding]:
+        key = (message_id, eid)
+        binding = self._bindings.pop(key, None)
+        if binding is None:
+            return None
+        self._discard(self._by_role, binding.role_id, key)
+        if binding.guild_id is not None:
+            self._discard(self._by_guild, binding.guild_id, key)
+        return binding
+
+    def remove_many(self, keys: Iterable[BindingKey]):
+        for message_id, eid in keys:
+            self.remove(message_id, eid)
+
+    def get(self, message_id: int, eid: str) -> Optional[Binding]:
+        return self._bindings.get((message_id, eid))
+
+    def for_role(self, role_id: int) -> List[Binding]:
+        return sorted(self._bindings[k] for k in self._by_role.get(role_id, ()))
+
+    def for_guild(self, guild_id: int) -> List[Binding]:
+        return sorted(self._bindings[k] for k in self._by_guild.get(guild_id, ()))
+
+    @staticmethod
+    def _discard(index: Dict[int, Set[BindingKey]], key: int, value: BindingKey):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import discord
+from redbot.core.utils.chat_formatting import humanize_list
+
+from .utils import parse_seconds
+
+MAX_EMBED = 25
+
+
+class CatalogEntry(NamedTuple):
+    role_id: int
+    name: str
+    cost: int
+    subscription: int
+    groups: Tuple[str, ...]
+
+
+class SelfRoleCatalog:
+    """
+    What ``selfrole list`` shows for each guild, built once and reused.
+
+    Pages are dropped whenever something they show changes (role settings,
+    or a self role being renamed or deleted) and rebuilt on next use.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, List[CatalogEntry]] = {}
+        self._pages: Dict[int, List[discord.Embed]] = {}
+
+    def pages(self, guild_id: int) -> Optional[List[discord.Embed]]:
+        return self._pages.get(guild_id)
+
+    def lists_role(self, guild_id: int, role_id: int) -> bool:
+        return any(e.role_id == role_id for e in self._entries.get(guild_id, ()))
+
+    def invalidate(self, guild_id: int):
+        self._entries.pop(guild_id, None)
+        self._pages.pop(guild_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._pages.clear()
+
+    def build(
+        self, guild: discord.Guild, role_data: Dict[discord.Role, dict]
+    ) -> List[discord.Embed]:
+        """
+        Builds and caches the pages for a guild from its roles' settings
+        """
+        entries = sorted(
+            (
+                CatalogEntry(
+                    role.id,
+                    role.name,
+                    vals["cost"],
+                    vals["subscription"],
+                    tuple(vals["exclusive_to"]),
+                )
+                for role, vals in role_data.items()
+                if vals["self_role"]
+            ),
+            key=lambda e: (e.cost, e.name.casefold()),
+        )
+        self._entries[guild.id] = entries
+        pages = self._pages[guild.id] = self.render(entries, guild.me.colour)
+        return pages
+
+    @staticmethod
+    def render(entries: List[CatalogEntry], colour: discord.Colour) -> List[discord.Embed]:
+        pages: List[discord.Embed] = []
+        for start in range(0, len(entries), MAX_EMBED):
+            embed = discord.Embed(title="Roles", colour=colour)
+            embed.set_footer(text="You can only have one role in the same unique group!")
+            for i, entry in enumerate(entries[start : start + MAX_EMBED], start + 1):
+                groups = humanize_list(list(entry.groups)) if entry.groups else None
+                embed.add_field(
+                    name=f"__**{i}. {entry.name}**__",
+                    value="%s%s%s"
+                    % (
+                        (f"Cost: {entry.cost}" if entry.cost else "Free"),
+                        (f", every {parse_seconds(entry.subscription)}" if entry.subscription else ""),
+                        (f"\nunique groups: `{groups}`" if groups else ""),
+                    ),
+                )
+            pages.append(embed)
+        return pages
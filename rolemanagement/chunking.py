@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import discord
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.chunking")
+
+
+class GuildChunker:
+    """
+    Makes sure a guild's member list is only requested once at a time.
+
+    Everyone who needs a guild's members while it's being chunked waits on
+    the same request, rather than each starting their own.
+    """
+
+    def __init__(self, bot: discord.Client):
+        self.bot = bot
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._started: Dict[int, float] = {}
+
+    def needs_chunk(self, guild: discord.Guild) -> bool:
+        return (
+            not guild.unavailable
+            and not guild.chunked
+            and self.bot.intents.members
+        )
+
+    def in_progress(self, guild: discord.Guild) -> bool:
+        return guild.id in self._inflight
+
+    @staticmethod
+    def progress(guild: discord.Guild) -> Tuple[int, Optional[int]]:
+        return len(guild.members), guild.member_count
+
+    def elapsed(self, guild: discord.Guild) -> float:
+        started = self._started.get(guild.id)
+        return time.perf_counter() - started if started else 0.0
+
+    def start(self, guild: discord.Guild) -> Optional[asyncio.Task]:
+        """
+        The chunk request for a guild, started if needed and not already running
+        """
+        task = self._inflight.get(guild.id)
+        if task is None and self.needs_chunk(guild):
+            task = self._inflight[guild.id] = asyncio.create_task(self._chunk(guild))
+        return task
+
+    async def ensure(self, *guilds: discord.Guild):
+        tasks = [t for t in map(self.start, guilds) if t]
+        if tasks:
+            # shielded so a cancelled caller doesn't cancel it for everyone else
+            await asyncio.gather(*map(asyncio.shield, tasks))
+
+    def stop(self):
+        for task in self._inflight.values():
+            task.cancel()
+        self._inflight.clear()
+        self._started.clear()
+
+    async def _chunk(self, guild: discord.Guild):
+        self._started[guild.id] = start = time.perf_counter()
+        try:
+            await guild.chunk(cache=True)
+        finally:
+            self._inflight.pop(guild.id, None)
+            self._started.pop(guild.id, None)
+        log.info(
+            "Fetched %d members of guild %d in %.2fs",
+            len(guild.members),
+            guild.id,
+            time.perf_counter() - start,
+        )
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import weakref
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+
+# How long to wait for more changes to the same member before editing
+COALESCE_WINDOW = 0.05
+
+MemberKey = Tuple[int, int]  # guild id, member id
+
+
+class _PendingEdit:
+    __slots__ = ("give", "remove", "reasons", "future")
+
+    def __init__(self):
+        self.give: Set[discord.Role] = set()
+        self.remove: Set[discord.Role] = set()
+        self.reasons: List[str] = []
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class RoleEditCoalescer:
+    """
+    Merges role changes for the same member into a single ``member.edit``
+
+    Changes submitted within ``COALESCE_WINDOW`` of each other are merged,
+    with the latest change to any given role winning, and applied together.
+    Edits to the same member never overlap; each is computed from the result
+    of the last one rather than from a cache the gateway hasn't updated yet.
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW):
+        self.window = window
+        self._pending: Dict[MemberKey, _PendingEdit] = {}
+        # Only ever holds locks someone is using, so this can't grow unbounded
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # Roles as of our last edit, until the gateway tells us about them
+        self._last_sent: Dict[MemberKey, List[int]] = {}
+
+    def has_pending(self, member: discord.Member) -> bool:
+        return (member.guild.id, member.id) in self._pending
+
+    def current_role_ids(self, member: discord.Member) -> Set[int]:
+        """
+        A member's roles as of our last edit to them, which the gateway
+        may not have told us about yet, or as cached if it has
+        """
+        sent = self._last_sent.get((member.guild.id, member.id))
+        return set(sent) if sent is not None else {r.id for r in member.roles}
+
+    def forget(self, member: discord.Member):
+        """
+        Called once the gateway has caught up on a member (or they left)
+        """
+        self._last_sent.pop((member.guild.id, member.id), None)
+
+    async def edit(
+        self,
+        member: discord.Member,
+        *,
+        give: Iterable[discord.Role] = (),
+        remove: Iterable[discord.Role] = (),
+        reason: Optional[str] = None,
+    ):
+        key = (member.guild.id, member.id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingEdit()
+            asyncio.create_task(self._apply_after_window(key, member.guild))
+
+        for role in remove:
+            pending.give.discard(role)
+            pending.remove.add(role)
+        for role in give:
+            pending.remove.discard(role)
+            pending.give.add(role)
+        if reason and reason not in pending.reasons:
+            pending.reasons.append(reason)
+
+        # shielded so one caller being cancelled doesn't cancel the edit for the rest
+        await asyncio.shield(pending.future)
+
+    def _lock(self, key: MemberKey) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    async def _apply_after_window(self, key: MemberKey, guild: discord.Guild):
+        await asyncio.sleep(self.window)
+        lock = self._lock(key)
+        async with lock:
+            pending = self._pending.pop(key)
+            try:
+                await self._apply(key, guild, pending)
+            except Exception as exc:
+                pending.future.set_exception(exc)
+                # Nobody may be waiting on it anymore, don't warn about that
+                pending.future.exception()
+            else:
+                pending.future.set_result(None)
+
+    async def _apply(self, key: MemberKey, guild: discord.Guild, pending: _PendingEdit):
+        member = guild.get_member(key[1])
+        if member is None:
+            return
+
+        current = self._last_sent.get(key)
+        if current is None:
+            current_roles = [r for r in member.roles if not r.is_default()]
+        else:
+            current_roles = [r for r in map(guild.get_role, current) if r]
+
+        roles = [r for r in current_roles if r not in pending.remove]
+        roles.extend(r for r in pending.give if r not in roles)
+        if sorted(roles) == sorted(current_roles):
+            return
+
+        await member.edit(roles=roles, reason=", ".join(pending.reasons) or None)
+        self._last_sent[key] = [r.id for r in roles]
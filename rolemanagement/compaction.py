@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import discord
+from redbot.core import Config
+
+from .scheduler import Scheduler
+
+if TYPE_CHECKING:
+    from .core import RoleManagement
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.compaction")
+
+COMPACT_INTERVAL = 24 * 3600
+
+ROLE_LIST_FIELDS = ("requires_any", "requires_all", "add_with")
+GUILD_ROLE_FIELDS = ("join_roles", "free_roles", "s_roles")
+MEMBER_ROLE_FIELDS = ("roles", "forbidden")
+# When we first noticed someone with stored data wasn't in the guild anymore
+ABSENT_FIELD = "absent_since"
+
+
+def size_of(data: Any) -> int:
+    """
+    Roughly what something costs to store, for reporting
+    """
+    return len(json.dumps(data, separators=(",", ":")))
+
+
+class CompactionReport:
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.size_before = 0
+        self.size_after = 0
+
+    def add(self, what: str, n: int = 1):
+        if n:
+            self.counts[what] = self.counts.get(what, 0) + n
+
+    def measure(self, before: int, after: Any):
+        self.size_before += before
+        self.size_after += size_of(after)
+
+    @property
+    def reclaimed(self) -> int:
+        return self.size_before - self.size_after
+
+    def summary(self) -> str:
+        lines = [f"{what}: {n}" for what, n in sorted(self.counts.items())]
+        lines.append(f"reclaimed: {self.reclaimed / 1024:.1f} KiB of {self.size_before / 1024:.1f} KiB")
+        return "\n".join(lines)
+
+
+def _live(ids: List[int], existing: Set[int]) -> List[int]:
+    return [i for i in ids if i in existing]
+
+
+async def _write_changes(
+    group, before: Dict[str, dict], after: Dict[str, dict], *, skip: Collection[str] = ()
+):
+    """
+    Writes back the entries and fields which differ between two copies of
+    a group's raw data, in one write.
+
+    The differences are applied to a fresh read, so anything else written
+    meanwhile (a rolebind, a setting changed) isn't lost.
+    """
+    removed = before.keys() - after.keys()
+    changed: Dict[str, Dict[str, Any]] = {}
+    cleared: Dict[str, Set[str]] = {}
+    for key, data in after.items():
+        old = before.get(key) or {}
+        for field in old.keys() | data.keys():
+            if field in skip:
+                continue
+            if field not in data:
+                cleared.setdefault(key, set()).add(field)
+            elif data[field] != old.get(field):
+                changed.setdefault(key, {})[field] = data[field]
+    if not (removed or changed or cleared):
+        return
+
+    async with group.get_lock():
+        current = await group.get_raw(default={})
+        for key in removed:
+            current.pop(key, None)
+        for key, fields in cleared.items():
+            entry = current.get(key)
+            if entry is not None:
+                for field in fields:
+                    entry.pop(field, None)
+        for key, values in changed.items():
+            current.setdefault(key, {}).update(values)
+        await group.set(current)
+
+
+def compact_role_rules(
+    raw: Dict[str, dict], existing: Set[int], report: CompactionReport
+) -> Tuple[Set[int], Set[int]]:
+    """
+    Drops settings for deleted roles, and deleted roles from other roles' settings.
+
+    ``existing`` must be every role the bot can see, in every guild.
+    Returns the ids of roles which were changed, and of those removed.
+    """
+    changed: Set[int] = set()
+    deleted: Set[int] = set()
+    for rid in list(raw):
+        if not rid.isdigit() or int(rid) not in existing:
+            del raw[rid]
+            report.add("deleted role settings")
+            if rid.isdigit():
+                deleted.add(int(rid))
+            continue
+        data = raw[rid]
+        for field in ROLE_LIST_FIELDS:
+            if field in data:
+                live = _live(data[field], existing)
+                if len(live) != len(data[field]):
+                    report.add("deleted role references", len(data[field]) - len(live))
+                    data[field] = live
+                    changed.add(int(rid))
+        groups = data.get("exclusive_to")
+        if groups:
+            for group, ids in list(groups.items()):
+                live = _live(ids, existing)
+                if len(live) != len(ids):
+                    report.add("deleted role references", len(ids) - len(live))
+                    changed.add(int(rid))
+                    if live:
+                        groups[group] = live
+                    else:
+                        del groups[group]
+    return changed, deleted
+
+
+def compact_bindings(
+    raw: Dict[str, Dict[str, dict]],
+    role_exists: Callable[[int], Optional[bool]],
+    channel_exists: Callable[[Optional[int]], Optional[bool]],
+    report: CompactionReport,
+) -> List[Tuple[int, str]]:
+    """
+    Drops reaction roles for deleted roles or channels, returns the removed keys.
+
+    The callables return None when they can't tell (e.g. the guild is unavailable),
+    which keeps the binding.
+    """
+    removed: List[Tuple[int, str]] = []
+    for mid in list(raw):
+        emojis = raw[mid]
+        for eid in list(emojis or {}):
+            rdata = emojis[eid] or {}
+            role_id = rdata.get("roleid")
+            if role_id is None or role_exists(role_id) is False:
+                report.add("reaction roles for deleted roles")
+            elif channel_exists(rdata.get("channelid")) is False:
+                report.add("reaction roles in deleted channels")
+            else:
+                continue
+            del emojis[eid]
+            if mid.isdigit():
+                removed.append((int(mid), eid))
+        if not emojis:
+            del raw[mid]
+    return removed
+
+
+def compact_guild_settings(data: dict, existing: Set[int], report: CompactionReport) -> bool:
+    """
+    Drops deleted roles from one guild's settings
+    """
+    changed = False
+    for field in GUILD_ROLE_FIELDS:
+        if field in data:
+            live = _live(data[field], existing)
+            if len(live) != len(data[field]):
+                report.add("deleted role references", len(data[field]) - len(live))
+                data[field] = live
+                changed = True
+    return changed
+
+
+def compact_members(
+    raw: Dict[str, dict],
+    existing: Set[int],
+    present: Optional[Set[int]],
+    retention: Optional[float],
+    now: float,
+    report: CompactionReport,
+) -> Tuple[bool, Set[int]]:
+    """
+    Compacts one guild's member data.
+
+    Deleted roles are dropped from sticky and forbidden roles, and entries
+    left with nothing in them are removed. With ``present`` (the guild's
+    member ids, only known once chunked) and ``retention`` (seconds), people
+    who've been gone longer than that are forgotten entirely.
+
+    Returns whether anything changed, and whose entries were removed.
+    """
+    changed = False
+    removed: Set[int] = set()
+    for mid in list(raw):
+        data = raw[mid]
+        member_id = int(mid) if mid.isdigit() else None
+        for field in MEMBER_ROLE_FIELDS:
+            if data.get(field):
+                live = _live(data[field], existing)
+                if len(live) != len(data[field]):
+                    report.add("deleted role references", len(data[field]) - len(live))
+                    data[field] = live
+                    changed = True
+
+        forget = False
+        if present is not None and retention is not None and member_id is not None:
+            if member_id in present:
+                if data.pop(ABSENT_FIELD, None) is not None:
+                    changed = True
+            elif ABSENT_FIELD not in data:
+                data[ABSENT_FIELD] = now
+                changed = True
+            elif now - data[ABSENT_FIELD] > retention:
+                forget = True
+                report.add("departed members forgotten")
+
+        if forget or not any(v for k, v in data.items() if k != ABSENT_FIELD):
+            del raw[mid]
+            if member_id is not None:
+                removed.add(member_id)
+            if not forget:
+                report.add("empty member entries")
+            changed = True
+    return changed, removed
+
+
+class Compactor:
+    """
+    Prunes stored data for roles, channels and members which are gone.
+
+    Runs on a schedule and on demand. Role settings and reaction roles are
+    only pruned while every guild is available, since neither reliably says
+    which guild it belongs to; this includes guilds the bot has left.
+    Each store touched is read once, and only what changed is written back.
+    """
+
+    def __init__(self, cog: RoleManagement):
+        self.cog = cog
+        self._lock = asyncio.Lock()
+        self._schedule: Scheduler[str] = Scheduler(self._scheduled, name="compaction")
+
+    async def start(self):
+        last = await self.cog.config.compaction_last_run()
+        self._schedule.schedule("compact", last + COMPACT_INTERVAL)
+        self._schedule.start()
+
+    def stop(self):
+        self._schedule.stop()
+
+    async def _scheduled(self, _keys: List[str]):
+        try:
+            report = await self.run()
+            log.info("Scheduled compaction finished\n%s", report.summary())
+        finally:
+            self._schedule.schedule("compact", time.time() + COMPACT_INTERVAL)
+
+    async def run(self, *, dry_run: bool = False) -> CompactionReport:
+        async with self._lock:
+            report = CompactionReport()
+            await self._compact(report, dry_run)
+            if not dry_run:
+                await self.cog.config.compaction_last_run.set(time.time())
+            return report
+
+    async def _channel_states(
+        self, channel_ids: Iterable[Optional[int]]
+    ) -> Dict[int, Optional[bool]]:
+        """
+        Whether each channel not in the cache still exists.
+
+        Archived threads aren't cached, so those are asked for. Only Discord
+        saying it doesn't exist counts as gone, anything else is unknown.
+        """
+        states: Dict[int, Optional[bool]] = {}
+        for channel_id in set(channel_ids):
+            if channel_id is None or self.cog.bot.get_channel(channel_id) is not None:
+                continue
+            try:
+                await self.cog.bot.fetch_channel(channel_id)
+            except discord.NotFound:
+                states[channel_id] = False
+            except discord.HTTPException:
+                states[channel_id] = None
+            else:
+                states[channel_id] = True
+        return states
+
+    async def _compact(self, report: CompactionReport, dry_run: bool):
+        cog = self.cog
+        config = cog.config
+        sql = cog._sql
+        guilds = [g for g in cog.bot.guilds if not g.unavailable]
+        all_available = len(guilds) == len(cog.bot.guilds)
+        guild_roles = {g.id: {r.id for r in g.roles} for g in guilds}
+        existing: Set[int] = set().union(*guild_roles.values())
+
+        def role_exists(role_id: int) -> Optional[bool]:
+            return True if role_id in existing else (False if all_available else None)
+
+        def channel_exists(channel_id: Optional[int]) -> Optional[bool]:
+            if channel_id is None:
+                return False if all_available else None
+            return channel_states.get(channel_id, True)
+
+        # DEP-WARN, see update_raw_entries for why these are base groups
+        if all_available:
+            group = config._get_base_group(Config.ROLE)
+            raw = await group.get_raw(default={})
+            stored = copy.deepcopy(raw)
+            before = size_of(raw)
+            changed, deleted = compact_role_rules(raw, existing, report)
+            report.measure(before, raw)
+            if (changed or deleted) and not dry_run:
+                await _write_changes(group, stored, raw)
+                if sql is not None:
+                    sql.delete_roles(deleted)
+                    role_guilds = {r: g for g, roles in guild_roles.items() for r in roles}
+                    sql.sync_roles({r: (role_guilds.get(r), raw[str(r)]) for r in changed})
+                cog._catalog.clear()
+
+        group = config.custom("REACTROLE")
+        raw = await group.all()
+        stored = copy.deepcopy(raw)
+        channel_states = await self._channel_states(
+            rdata.get("channelid")
+            for emojis in raw.values()
+            for rdata in (emojis or {}).values()
+            if rdata
+        )
+        before = size_of(raw)
+        removed_bindings = compact_bindings(raw, role_exists, channel_exists, report)
+        report.measure(before, raw)
+        if removed_bindings and not dry_run:
+            await _write_changes(group, stored, raw)
+            cog._bindings.remove_many(removed_bindings)
+            if sql is not None:
+                sql.delete_actions(removed_bindings)
+
+        group = config._get_base_group(Config.GUILD)
+        raw = await group.get_raw(default={})
+        stored = copy.deepcopy(raw)
+        before = size_of(raw)
+        changed_guilds = [
+            gid
+            for gid, data in raw.items()
+            if gid.isdigit()
+            and int(gid) in guild_roles
+            and compact_guild_settings(data, guild_roles[int(gid)], report)
+        ]
+        report.measure(before, raw)
+        if changed_guilds and not dry_run:
+            await _write_changes(group, stored, raw)
+
+        retention_days = await config.compaction_member_retention()
+        retention = retention_days * 86400 if retention_days is not None else None
+        now = time.time()
+        # Nothing can write sticky roles underneath us while we do this
+        async with cog._sticky.exclusive():
+            for guild in guilds:
+                group = config._get_base_group(Config.MEMBER, str(guild.id))
+                raw = await group.get_raw(default={})
+                stored = copy.deepcopy(raw)
+                if sql is not None:
+                    # Sticky roles live in SQLite then, what Config has is stale
+                    sticky = sql.get_guild_sticky(guild.id)
+                    for mid, data in raw.items():
+                        data["roles"] = sticky.pop(int(mid), []) if mid.isdigit() else []
+                    for member_id, rids in sticky.items():
+                        raw[str(member_id)] = {"roles": rids}
+                before = size_of(raw)
+                present = {m.id for m in guild.members} if guild.chunked else None
+                members_changed, removed = compact_members(
+                    raw, guild_roles[guild.id], present, retention, now, report
+                )
+                report.measure(before, raw)
+                if members_changed and not dry_run:
+                    # With SQLite, sticky roles are written there and not to Config
+                    await _write_changes(
+                        group, stored, raw, skip=("roles",) if sql is not None else ()
+                    )
+                    if sql is not None:
+                        updates: Dict[int, List[int]] = {m: [] for m in removed}
+                        updates.update(
+                            (int(mid), data.get("roles", []))
+                            for mid, data in raw.items()
+                            if mid.isdigit()
+                        )
+                        await sql.write_sticky(guild.id, updates)
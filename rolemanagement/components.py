@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from typing import Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import discord
+from redbot.core.utils.chat_formatting import humanize_list
+
+from .exceptions import (
+    ConflictingRoleException,
+    MissingRequirementsException,
+    PermissionOrHierarchyException,
+    RoleManagementException,
+)
+
+# Everything about what a component does is in its custom_id, so handling
+# one never needs to look anything up:
+#   rm:b:<role id>   a button toggling that role
+#   rm:s:<n>         a select menu, its options' values are role ids
+COMPONENT_PREFIX = "rm:"
+BUTTON = "b"
+SELECT = "s"
+
+# Discord's limits, per message
+MAX_BUTTONS = 25
+MAX_OPTIONS = 25
+
+
+def button_id(role_id: int) -> str:
+    return f"{COMPONENT_PREFIX}{BUTTON}:{role_id}"
+
+
+def select_id(n: int = 0) -> str:
+    return f"{COMPONENT_PREFIX}{SELECT}:{n}"
+
+
+def parse_custom_id(custom_id: str) -> Optional[Tuple[str, int]]:
+    """
+    (kind, role id or select number), or None for anything not ours
+    """
+    if not custom_id.startswith(COMPONENT_PREFIX):
+        return None
+    kind, _, value = custom_id[len(COMPONENT_PREFIX) :].partition(":")
+    if kind not in (BUTTON, SELECT) or not value.isdigit():
+        return None
+    return kind, int(value)
+
+
+def button_view(roles: Sequence[discord.Role]) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    for role in roles:
+        view.add_item(
+            discord.ui.Button(
+                label=role.name[:80],
+                style=discord.ButtonStyle.secondary,
+                custom_id=button_id(role.id),
+            )
+        )
+    return view
+
+
+def select_view(roles: Sequence[discord.Role], placeholder: str = "Pick your roles") -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    view.add_item(
+        discord.ui.Select(
+            custom_id=select_id(),
+            placeholder=placeholder,
+            min_values=0,
+            max_values=len(roles),
+            options=[discord.SelectOption(label=r.name[:100], value=str(r.id)) for r in roles],
+        )
+    )
+    return view
+
+
+def _components(message: discord.Message) -> Iterator[discord.Component]:
+    for row in message.components:
+        yield from getattr(row, "children", (row,))
+
+
+def has_component(message: discord.Message, custom_id: str) -> bool:
+    return any(getattr(c, "custom_id", None) == custom_id for c in _components(message))
+
+
+def select_role_ids(message: discord.Message, custom_id: str) -> Set[int]:
+    """
+    Every role a select menu on the message offers
+    """
+    for component in _components(message):
+        if isinstance(component, discord.SelectMenu) and component.custom_id == custom_id:
+            return {int(o.value) for o in component.options if o.value.isdigit()}
+    return set()
+
+
+def refusal(
+    role: discord.Role, exc: Union[RoleManagementException, PermissionOrHierarchyException]
+) -> str:
+    """
+    Why someone can't have a role, from what is_self_assign_eligible raised
+    """
+    guild = role.guild
+    if isinstance(exc, MissingRequirementsException):
+        parts: List[str] = []
+        if exc.miss_all:
+            names = [r.name for r in guild.roles if r.id in exc.miss_all]
+            parts.append(f"all of {humanize_list(names)}")
+        if exc.miss_any:
+            names = [r.name for r in guild.roles if r.id in exc.miss_any]
+            parts.append(f"one of {humanize_list(names)}")
+        return f"**{role.name}** needs {' and '.join(parts)}."
+    if isinstance(exc, ConflictingRoleException):
+        names = [r.name for r in exc.conflicts]
+        return f"**{role.name}** can't be had alongside {humanize_list(names)}, which you can't remove."
+    return f"**{role.name}** isn't a role I can give you."
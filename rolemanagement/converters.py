@@ -1,10 +1,13 @@
 import argparse
 import shlex
+from datetime import timedelta
 from typing import Optional, List, NamedTuple, Dict
 
 from redbot.core.commands import RoleConverter, Context, BadArgument
 import discord
 
+from .future_sql import ActionType
+from .utils import parse_timedelta
 
 _RoleConverter = RoleConverter()
 
@@ -14,6 +17,42 @@ class NoExitParser(argparse.ArgumentParser):
         raise BadArgument()
 
 
+def _parse_duration(vals: dict) -> Optional[timedelta]:
+    if vals["duration"] is None:
+        return None
+    if not vals["add"]:
+        raise BadArgument("A duration only makes sense for roles being added")
+    duration = parse_timedelta(" ".join(vals["duration"]))
+    if duration is None or duration.total_seconds() < 1:
+        raise BadArgument("I couldn't understand that duration")
+    return duration
+
+
+# What rolebind accepts for each reaction behaviour
+REACTION_ACTIONS: Dict[str, ActionType] = {
+    "toggle": ActionType.TOGGLE,
+    "add": ActionType.ADD,
+    "add-only": ActionType.ADD,
+    "remove": ActionType.REMOVE,
+    "remove-only": ActionType.REMOVE,
+    "inverted": ActionType.INVERTED_TOGGLE,
+    "inverted-toggle": ActionType.INVERTED_TOGGLE,
+    "honeypot-lock": ActionType.KAIZO_LOCK,
+    "honeypot-kick": ActionType.KAIZO_KICK,
+    "honeypot-ban": ActionType.KAIZO_BAN,
+}
+
+
+def reaction_action(argument: str) -> ActionType:
+    try:
+        return REACTION_ACTIONS[argument.casefold()]
+    except KeyError:
+        raise BadArgument(
+            "Reaction behaviour must be one of: toggle, add-only, remove-only, inverted, "
+            "honeypot-lock, honeypot-kick, honeypot-ban"
+        )
+
+
 class RoleSyntaxConverter(NamedTuple):
     parsed: Dict[str, List[discord.Role]]
 
@@ -22,6 +61,7 @@ class RoleSyntaxConverter(NamedTuple):
         parser = NoExitParser(description="Role management syntax help", add_help=False, allow_abbrev=True)
         parser.add_argument("--add", nargs="*", dest="add", default=[])
         parser.add_argument("--remove", nargs="*", dest="remove", default=[])
+        parser.add_argument("--duration", nargs="+", dest="duration", default=None)
         try:
             vals = vars(parser.parse_args(shlex.split(argument)))
         except Exception:
@@ -29,6 +69,7 @@ class RoleSyntaxConverter(NamedTuple):
 
         if not vals["add"] and not vals["remove"]:
             raise BadArgument("Must provide at least one action")
+        vals["duration"] = _parse_duration(vals)
 
         for attr in ("add", "remove"):
             vals[attr] = [await _RoleConverter.convert(ctx, r) for r in vals[attr]]
@@ -52,9 +93,11 @@ class ComplexActionConverter(NamedTuple):
     --below role
     --add roles
     --remove roles
+    --duration time
     --only-humans
     --only-bots
     --everyone
+    --explain
     """
 
     parsed: dict
@@ -72,11 +115,13 @@ class ComplexActionConverter(NamedTuple):
         parser.add_argument("--not-perm", nargs="*", dest="notperm", default=[])
         parser.add_argument("--add", nargs="*", dest="add", default=[])
         parser.add_argument("--remove", nargs="*", dest="remove", default=[])
+        parser.add_argument("--duration", nargs="+", dest="duration", default=None)
         parser.add_argument("--has-exactly-nroles", dest="quantity", type=int)
         parser.add_argument("--has-more-than-nroles", dest="gt", type=int, default=None)
         parser.add_argument("--has-less-than-nroles", dest="lt", type=int, default=None)
         parser.add_argument("--above", dest="above", type=str, default=None)
         parser.add_argument("--below", dest="below", type=str, default=None)
+        parser.add_argument("--explain", action="store_true", default=False)
         hum_or_bot = parser.add_mutually_exclusive_group()
         hum_or_bot.add_argument("--only-humans", action="store_true", default=False, dest="humans")
         hum_or_bot.add_argument("--only-bots", action="store_true", default=False, dest="bots")
@@ -89,6 +134,7 @@ class ComplexActionConverter(NamedTuple):
 
         if not vals["add"] and not vals["remove"]:
             raise BadArgument("Must provide at least one action")
+        vals["duration"] = _parse_duration(vals)
 
         if not any(
             (
@@ -146,6 +192,10 @@ class ComplexSearchConverter(NamedTuple):
     --not-perm permissions
     --everyone
     --csv
+    --jsonl
+    --gzip
+    --zip
+    --explain
     """
 
     parsed: dict
@@ -161,11 +211,16 @@ class ComplexSearchConverter(NamedTuple):
         parser.add_argument("--any-perm", nargs="*", dest="anyperm", default=[])
         parser.add_argument("--not-perm", nargs="*", dest="notperm", default=[])
         parser.add_argument("--csv", action="store_true", default=False)
+        parser.add_argument("--jsonl", action="store_true", default=False)
+        compression = parser.add_mutually_exclusive_group()
+        compression.add_argument("--gzip", action="store_const", const="gzip", dest="compression", default=None)
+        compression.add_argument("--zip", action="store_const", const="zip", dest="compression")
         parser.add_argument("--has-exactly-nroles", dest="quantity", type=int, default=None)
         parser.add_argument("--has-more-than-nroles", dest="gt", type=int, default=None)
         parser.add_argument("--has-less-than-nroles", dest="lt", type=int, default=None)
         parser.add_argument("--above", dest="above", type=str, default=None)
         parser.add_argument("--below", dest="below", type=str, default=None)
+        parser.add_argument("--explain", action="store_true", default=False)
         hum_or_bot = parser.add_mutually_exclusive_group()
         hum_or_bot.add_argument("--only-humans", action="store_true", default=False, dest="humans")
         hum_or_bot.add_argument("--only-bots", action="store_true", default=False, dest="bots")
@@ -1,16 +1,31 @@
 from __future__ import annotations
 
 import contextlib
+import io
+import logging
 import asyncio
 import re
 import time
 from abc import ABCMeta
-from typing import AsyncIterator, Tuple, Optional, Union, List, Dict, Literal
+from typing import (
+    AsyncIterator,
+    Callable,
+    Tuple,
+    Optional,
+    Union,
+    List,
+    Dict,
+    Literal,
+    Sequence,
+    Set,
+    FrozenSet,
+)
 
 import discord
 from discord.ext.commands import CogMeta as DPYCogMeta
 from redbot.core import checks, commands, bank, modlog
 from redbot.core.config import Config
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.chat_formatting import (
     box,
     pagify,
@@ -19,19 +34,55 @@ from redbot.core.utils.chat_formatting import (
     error,
     info,
 )
-from redbot.core.utils.predicates import MessagePredicate
 from dateutil import parser
+from typing_extensions import Annotated
 from datetime import datetime
 
+from .agecheck import AgeVerifier, PendingAgeCheck
+from .bindings import Binding, BindingIndex
+from .catalog import SelfRoleCatalog
+from .chunking import GuildChunker
+from .components import MAX_BUTTONS, MAX_OPTIONS, button_view, select_view
+from .coalescer import RoleEditCoalescer
+from .compaction import Compactor
+from .converters import reaction_action
+from .debounce import ReactionDebouncer
 from .events import EventMixin
+from .jobs import JobManager
+from .kaizo import BURST_ACTIONS, BURST_WINDOW, KaizoGuard
+from .searchcache import SearchCache
+from .notifications import DMQueue, fallback_channel
+from .queues import PerGuildQueue
+from .reconcile import ReactionReconciler
+from .rules import (
+    YAML_AVAILABLE,
+    diff_rules,
+    export_rules,
+    format_diff,
+    load_rules,
+    validate_rules,
+)
+from .scheduler import Scheduler
+from .sql import SQLiteStore
+from .sticky import StickyRoleStore
+from .timed import TimedRoles
+from .future_sql import ActionType
 from .exceptions import (
     RoleManagementException,
     PermissionOrHierarchyException,
     MissingRequirementsException,
     ConflictingRoleException,
+    RuleImportError,
 )
 from .massmanager import MassManagementMixin
-from .utils import UtilMixin, variation_stripper_re, parse_timedelta, parse_seconds
+from .utils import (
+    UtilMixin,
+    variation_stripper_re,
+    parse_timedelta,
+    age_from_dob,
+    parse_seconds,
+    update_raw_entries,
+)
 
 try:
     from redbot.core.commands import GuildContext
@@ -54,9 +105,19 @@ class CompositeMetaClass(DPYCogMeta, ABCMeta):
     # no need to manually ensure both get handled here.
 
 
+log = logging.getLogger("red.sinbadcogs.rolemanagement")
+
+SubKey = Tuple[int, int, int]  # guild id, role id, user id
+
 MIN_SUB_TIME = 3600
-SLEEP_TIME = 300
-MAX_EMBED = 25
+SUB_RETRY_TIME = 300
+BANK_CONCURRENCY = 16
+CLEANUP_CONCURRENCY = 8
+MAX_RULES_FILE = 1024 * 1024
+MAX_HACKROLE_FILE = 8 * 1024 * 1024
+ID_SPLIT_RE = re.compile(r"[\s,;\"']+")
+# <:name:id>, <a:name:id> or name:id, the id is group 3
+CUSTOM_EMOJI_RE = re.compile(r"^(<?a?:)?([A-Za-z0-9_]+):([0-9]+)(\:?>?)$")
 
 
 class RoleManagement(
@@ -83,7 +144,13 @@ class RoleManagement(
             self, identifier=78631113035100160, force_registration=True
         )
         self.config.register_global(
-            handled_variation=False, handled_full_str_emoji=False
+            handled_variation=False,
+            handled_full_str_emoji=False,
+            storage_backend="config",
+            handled_member_birthdays=False,
+            compaction_last_run=0.0,
+            compaction_member_retention=None,
+            reconcile_state={},
         )
         self.config.register_role(
             exclusive_to={},
@@ -99,29 +166,73 @@ class RoleManagement(
             subscribed_users={},
             dm_msg=None,
             age_verification=None,
+            timed=0,
         )  # subscribed_users maps str(user.id)-> end time in unix timestamp
-        self.config.register_member(roles=[], forbidden=[], birthday=None)
+        self.config.register_member(roles=[], forbidden=[], birthday=None, absent_since=None)
         self.config.register_user(birthday=None)
         self.config.init_custom("REACTROLE", 2)
         self.config.register_custom(
-            "REACTROLE", roleid=None, channelid=None, guildid=None
+            "REACTROLE", roleid=None, channelid=None, guildid=None, action_type=1
         )  # ID : Message.id, str(React)
         self.config.register_guild(
-            notify_channel=None, s_roles=[], free_roles=[], join_roles=[], age_log=False
+            notify_channel=None,
+            s_roles=[],
+            free_roles=[],
+            join_roles=[],
+            age_log=False,
+            mrole_jobs={},
+            reaction_debounce=1.0,
+            timed_roles={},
+            kaizo_action=None,
+            kaizo_threshold=5,
+            kaizo_lock_role=None,
+            reconcile_removals=False,
         )
         self._ready = asyncio.Event()
         self._start_task: Optional[asyncio.Task] = None
         self.loop = asyncio.get_event_loop()
-        self._sub_task = self.loop.create_task(self.sub_checker())
+        self._subs: Scheduler[SubKey] = Scheduler(
+            self.process_due_subscriptions, name="subscriptions"
+        )
+        self._dms = DMQueue()
+        self._join_queue: PerGuildQueue[discord.Member] = PerGuildQueue(
+            self.apply_join_roles, name="join roles"
+        )
+        self._age = AgeVerifier(self.expire_age_checks)
+        self._bindings = BindingIndex()
+        self._catalog = SelfRoleCatalog()
+        self._chunker = GuildChunker(self.bot)
+        self._edits = RoleEditCoalescer()
+        self._reactions = ReactionDebouncer(self.handle_reaction)
+        self._jobs = JobManager(self)
+        self._compactor = Compactor(self)
+        self._timed = TimedRoles(self)
+        self._kaizo = KaizoGuard(self)
+        self._reconciler = ReactionReconciler(self)
+        self._search_cache = SearchCache()
+        self._sticky = StickyRoleStore(self.config)
+        self._sql: Optional[SQLiteStore] = None
         # remove selfrole commands since we are going to override them
         self.bot.remove_command("selfrole")
         super().__init__()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         if self._start_task:
             self._start_task.cancel()
-        if self._sub_task:
-            self._sub_task.cancel()
+        self._subs.stop()
+        self._dms.stop()
+        self._join_queue.stop()
+        self._reactions.stop()
+        self._chunker.stop()
+        self._age.stop()
+        self._jobs.unload()
+        self._compactor.stop()
+        await self._timed.stop()
+        self._kaizo.stop()
+        self._reconciler.stop()
+        await self._sticky.stop()
+        if self._sql:
+            self._sql.close()
 
     def init(self):
         self._start_task = asyncio.create_task(self.initialization())
@@ -149,7 +260,7 @@ class RoleManagement(
         if not await self.config.handled_full_str_emoji():
             data = await self.config.custom("REACTROLE").all()
             to_adjust = {}
-            pattern = re.compile(r"^(<?a?:)?([A-Za-z0-9_]+):([0-9]+)(\:?>?)$")
+            pattern = CUSTOM_EMOJI_RE
             # Am not a fan....
             for message_id, emojis_to_data in data.items():
                 for emoji_key in emojis_to_data:
@@ -164,6 +275,18 @@ class RoleManagement(
             await self.config.custom("REACTROLE").set(data)
             await self.config.handled_full_str_emoji.set(True)
 
+        def guild_of_channel(channel_id: int) -> Optional[int]:
+            channel = self.bot.get_channel(channel_id)
+            return channel.guild.id if isinstance(channel, discord.abc.GuildChannel) else None
+
+        self._bindings.load(await self.config.custom("REACTROLE").all(), guild_of_channel)
+
+        if await self.config.storage_backend() == "sqlite":
+            self._sql = SQLiteStore(cog_data_path(self) / "rolemanagement.db")
+            await self._sticky.set_backend(self._sql)
+        await self._sticky.load()
+        self._sticky.start()
+
         # register casetype for age
         age_case = {
             "name": "Date of Birth Added",
@@ -177,100 +300,234 @@ class RoleManagement(
         except RuntimeError:
             pass
 
-        # fix moving birthdays to user config from member config
-        for guild in self.bot.guilds:
-            for member in guild.members:
-                m_age = await self.config.member(member).birthday()
-                u_age = await self.config.user(member).birthday()
-
-                if m_age and u_age is None:
-                    await self.config.user(member).birthday.set(m_age)
-                    await self.config.member(member).birthday.set(None)
+        if not await self.config.handled_member_birthdays():
+            await self.migrate_member_birthdays()
+            await self.config.handled_member_birthdays.set(True)
 
+        await self._kaizo.load()
+        # Durations are needed as soon as role changes are handled
+        await self._timed.load()
         self._ready.set()
+        self._dms.start()
+        self._age.start()
+        await self.load_subscriptions()
+        self._subs.start()
+        await self._jobs.resume_all()
+        await self._compactor.start()
+        self._reconciler.start()
+
+    async def migrate_member_birthdays(self):
+        """
+        fix moving birthdays to user config from member config
+
+        One read of all member and user data, then one write of user
+        data and one per guild with anything to move (update_raw_entries
+        writes each group with a single set), instead of two reads and
+        two writes per member.
+        """
+        users = await self.config.all_users()
+        moved: Dict[int, Dict[str, Optional[str]]] = {}
+        cleared: Dict[int, Dict[int, Dict[str, Optional[str]]]] = {}
+
+        for guild_id, members in (await self.config.all_members()).items():
+            for member_id, data in members.items():
+                m_age = data.get("birthday")
+                if not m_age or member_id in moved:
+                    continue
+                if users.get(member_id, {}).get("birthday") is None:
+                    moved[member_id] = {"birthday": m_age}
+                    cleared.setdefault(guild_id, {})[member_id] = {"birthday": None}
+
+        if moved:
+            await update_raw_entries(
+                self.config._get_base_group(Config.USER), moved
+            )
+        for guild_id, updates in cleared.items():
+            await update_raw_entries(
+                self.config._get_base_group(Config.MEMBER, str(guild_id)), updates
+            )
 
     async def wait_for_ready(self):
         await self._ready.wait()
 
+    async def _role_settings_changed(self, *roles: discord.Role):
+        """
+        Anything derived from role settings which needs to know they changed
+        """
+        for guild_id in {r.guild.id for r in roles}:
+            self._catalog.invalidate(guild_id)
+        if self._sql is not None:
+            self._sql.sync_roles(
+                {r.id: (r.guild.id, await self.config.role(r).all()) for r in roles}
+            )
+
+    async def _sticky_changed(self, role: discord.Role, sticky: bool):
+        """
+        Starts or stops remembering a role, for those who have it if starting
+        """
+        self._sticky.set_sticky(role.id, sticky)
+        if sticky:
+            await self._sticky.preload(role.guild.id)
+            for m in role.members:
+                await self._sticky.update(role.guild.id, m.id, add=[role.id])
+
     async def cog_before_invoke(self, ctx):
         await self.wait_for_ready()
         if ctx.guild:
-            await self.maybe_update_guilds(ctx.guild)
+            await self.wait_for_members(ctx)
+
+    async def load_subscriptions(self):
+        """
+        Schedules every active subscription, in one pass over stored data
+        """
+        entries = []
+        all_roles = await self.config.all_roles()
+        for guild_id, guild_data in (await self.config.all_guilds()).items():
+            for role_id in guild_data.get("s_roles", []):
+                subs = all_roles.get(role_id, {}).get("subscribed_users", {})
+                for user_id, end_time in subs.items():
+                    entries.append(((guild_id, role_id, int(user_id)), end_time))
+        self._subs.load(entries)
+
+    async def process_due_subscriptions(self, due: List[SubKey]):
+        by_role: Dict[Tuple[int, int], List[int]] = {}
+        for guild_id, role_id, user_id in due:
+            by_role.setdefault((guild_id, role_id), []).append(user_id)
+
+        for (guild_id, role_id), user_ids in by_role.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild.unavailable:
+                # try again later rather than dropping anything
+                retry = time.time() + SUB_RETRY_TIME
+                for user_id in user_ids:
+                    self._subs.schedule((guild_id, role_id, user_id), retry)
+                continue
 
-    # makes it a bit more readable
-    async def sub_helper(self, guild, role, role_data):
-        for user_id in list(role_data["subscribed_users"].keys()):
-            end_time = role_data["subscribed_users"][user_id]
-            now_time = time.time()
-            if end_time <= now_time:
-                member = guild.get_member(int(user_id))
-                if not member:  # clean absent members
-                    del role_data["subscribed_users"][user_id]
-                    continue
-                # make sure they still have the role
-                if role not in member.roles:
-                    del role_data["subscribed_users"][user_id]
-                    continue
-                # charge user
-                raw_cost = await self.config.role(role).cost()
-                cost = await self.get_cost(member, role)
-                currency_name = await bank.get_currency_name(guild)
-                curr_sub = await self.config.role(role).subscription()
-                if raw_cost == 0 or curr_sub == 0:
-                    # role is free now or sub is removed, remove stale sub
-                    del role_data["subscribed_users"][user_id]
+            role = guild.get_role(role_id)
+            if not role:  # clean stale subs if role is deleted
+                async with self.config.guild(guild).s_roles() as s_roles:
+                    if role_id in s_roles:
+                        s_roles.remove(role_id)
+                continue
+
+            subs = await self.config.role(role).subscribed_users()
+            now = time.time()
+            due_ids = []
+            for user_id in user_ids:
+                end_time = subs.get(str(user_id))
+                if end_time is None:
                     continue
-                if cost == 0:
+                if end_time > now:  # renewed some other way since scheduling
+                    self._subs.schedule((guild_id, role_id, user_id), end_time)
                     continue
+                due_ids.append(user_id)
 
-                msg = f"Hello! You are being charged {cost} {currency_name} for your subscription to the {role.name} role in {guild.name}."
-                try:
-                    await bank.withdraw_credits(member, cost)
-                    msg += f"\n\nNo further action is required! You'll be charged again in {parse_seconds(curr_sub)}."
-                    role_data["subscribed_users"][user_id] = now_time + curr_sub
-                except ValueError:  # user is poor
-                    msg += f"\n\nHowever, you do not have enough {currency_name} to cover the subscription. The role will be removed."
-                    await self.update_roles_atomically(who=member, remove=[role])
-                    del role_data["subscribed_users"][user_id]
+            results = await self.sub_helper(guild, role, due_ids)
 
-                try:
-                    await member.send(msg)
-                except:
-                    # trys to send in system channel, if that fails then
-                    # send message in first channel bot can speak in
-                    channel = guild.system_channel
-                    msg += f"\n\n{member.mention} make sure to allow receiving DM's from server members so I can DM you this message!"
-                    if channel.permissions_for(channel.guild.me).send_messages:
-                        await channel.send(msg)
+            # Only held for the write, not across bank calls and DMs
+            async with self.config.role(role).subscribed_users() as subs:
+                for user_id, end_time in results.items():
+                    if end_time is None:
+                        subs.pop(str(user_id), None)
                     else:
-                        for channel in guild.text_channels:
-                            if channel.permissions_for(channel.guild.me).send_messages:
-                                await channel.send(msg)
-                                break
-
-        return role_data
+                        subs[str(user_id)] = end_time
+                        self._subs.schedule((guild_id, role_id, user_id), end_time)
+                no_subs = not subs
 
-    async def sub_checker(self):
-        await self.wait_for_ready()
-        while True:
-            await asyncio.sleep(SLEEP_TIME)
-            for guild in self.bot.guilds:
+            if no_subs:
                 async with self.config.guild(guild).s_roles() as s_roles:
-                    for role_id in reversed(s_roles):
-                        role = guild.get_role(role_id)
-                        if not role:  # clean stale subs if role is deleted
-                            s_roles.remove(role_id)
-                            continue
+                    if role_id in s_roles:
+                        s_roles.remove(role_id)
 
-                        role_data = await self.config.role(role).all()
+    # makes it a bit more readable
+    async def sub_helper(
+        self, guild: discord.Guild, role: discord.Role, user_ids: List[int]
+    ) -> Dict[int, Optional[float]]:
+        """
+        Charges due subscriptions to a role
+
+        Everything which is the same for every user (cost, currency,
+        free roles, where to send messages) is looked up once,
+        charges are made concurrently, and messages are queued.
+
+        Returns the new end time per user id, None for subscriptions to remove
+        """
+        ret: Dict[int, Optional[float]] = {}
+        role_data = await self.config.role(role).all()
+        raw_cost, curr_sub = role_data["cost"], role_data["subscription"]
+
+        if raw_cost == 0 or curr_sub == 0:
+            # role is free now or sub is removed, remove stale subs
+            return {user_id: None for user_id in user_ids}
+
+        free_roles = set(await self.config.guild(guild).free_roles())
+        currency_name = await bank.get_currency_name(guild)
+        now_time = time.time()
+
+        to_charge: List[discord.Member] = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if not member:  # clean absent members
+                ret[user_id] = None
+            elif role not in member.roles:  # make sure they still have the role
+                ret[user_id] = None
+            elif any(r.id in free_roles for r in member.roles):
+                # free for them for now, check again next period
+                ret[user_id] = now_time + curr_sub
+            else:
+                to_charge.append(member)
 
-                        role_data = await self.sub_helper(guild, role, role_data)
+        if not to_charge:
+            return ret
 
-                        await self.config.role(role).subscribed_users.set(
-                            role_data["subscribed_users"]
-                        )
-                        if len(role_data["subscribed_users"]) == 0:
-                            s_roles.remove(role_id)
+        semaphore = asyncio.Semaphore(BANK_CONCURRENCY)
+
+        async def charge(member: discord.Member) -> bool:
+            async with semaphore:
+                try:
+                    await bank.withdraw_credits(member, raw_cost)
+                except ValueError:  # user is poor
+                    return False
+                return True
+
+        charged = await asyncio.gather(*(charge(m) for m in to_charge), return_exceptions=True)
+
+        channel = fallback_channel(guild)
+        poor: List[discord.Member] = []
+        for member, paid in zip(to_charge, charged):
+            if isinstance(paid, BaseException):
+                # Not charged, and not their fault; keep the role and try again soon
+                log.error(
+                    "Couldn't charge %d for their subscription to %d", member.id, role.id, exc_info=paid
+                )
+                ret[member.id] = now_time + SUB_RETRY_TIME
+                continue
+            msg = f"Hello! You are being charged {raw_cost} {currency_name} for your subscription to the {role.name} role in {guild.name}."
+            if paid:
+                msg += f"\n\nNo further action is required! You'll be charged again in {parse_seconds(curr_sub)}."
+                ret[member.id] = now_time + curr_sub
+            else:
+                msg += f"\n\nHowever, you do not have enough {currency_name} to cover the subscription. The role will be removed."
+                ret[member.id] = None
+                poor.append(member)
+
+            self._dms.send(
+                member,
+                msg,
+                fallback=channel,
+                fallback_suffix=f"\n\n{member.mention} make sure to allow receiving DM's from server members so I can DM you this message!",
+            )
+
+        async def remove_role(member: discord.Member):
+            async with semaphore:
+                try:
+                    await self.update_roles_atomically(who=member, remove=[role])
+                except (PermissionOrHierarchyException, discord.HTTPException):
+                    pass
+
+        await asyncio.gather(*(remove_role(m) for m in poor))
+
+        return ret
 
     async def get_cost(self, member: discord.Member, role: discord.Role):
         """Gets cost of a role for a user"""
@@ -312,7 +569,7 @@ class RoleManagement(
     @commands.guild_only()
     @commands.bot_has_permissions(manage_roles=True)
     @checks.admin_or_permissions(manage_roles=True)
-    @commands.command(name="hackrole")
+    @commands.group(name="hackrole", invoke_without_command=True)
     async def hackrole(self, ctx: GuildContext, user_id: int, *, role: discord.Role):
         """
         Puts a stickyrole on someone not in the server.
@@ -337,53 +594,294 @@ class RoleManagement(
                 await ctx.maybe_send_embed("They are in the guild...assigned anyway.")
         else:
 
-            async with self.config.member_from_ids(
-                ctx.guild.id, user_id
-            ).roles() as sticky:
-                if role.id not in sticky:
-                    sticky.append(role.id)
+            await self._sticky.update(ctx.guild.id, user_id, add=[role.id])
 
             await ctx.tick()
 
+    @hackrole.command(name="bulk")
+    async def hackrole_bulk(self, ctx: GuildContext, *roles: discord.Role):
+        """
+        Puts stickyroles on every user id in an attached CSV or text file.
+
+        Each line should start with a user id, optionally followed by
+        the ids of more sticky roles for just that user.
+        Roles given here are put on everyone in the file.
+
+        Anyone already in the server gets their roles now,
+        everyone else gets them if they join.
+        """
+        start = time.perf_counter()
+        guild = ctx.guild
+        if not ctx.message.attachments:
+            return await ctx.send("Attach a file of user ids to your message.")
+        attachment = ctx.message.attachments[0]
+        if attachment.size > MAX_HACKROLE_FILE:
+            return await ctx.send("That file is too large.")
+
+        if not await self.all_are_valid_roles(ctx, *roles):
+            return await ctx.maybe_send_embed(
+                "Can't do that. Discord role heirarchy applies here."
+            )
+        if len(self._sticky.filter_sticky(r.id for r in roles)) != len(set(roles)):
+            return await ctx.send("This only works on sticky roles.")
+
+        text = (await attachment.read()).decode("utf-8", errors="replace")
+        wanted: Dict[int, Set[int]] = {}
+        bad_lines = 0
+        for line in text.splitlines():
+            ids = [int(t) for t in ID_SPLIT_RE.split(line.strip()) if t.isdigit()]
+            if not ids:
+                # headers, blank lines, anything else that isn't an id
+                bad_lines += bool(line.strip())
+                continue
+            wanted.setdefault(ids[0], set()).update(ids[1:], (r.id for r in roles))
+
+        # Roles from the file get the same checks as the ones given to the command
+        allowed = {r.id for r in roles}
+        refused: Set[int] = set()
+        for rid in set().union(*wanted.values()) - allowed:
+            role = guild.get_role(rid)
+            if role and self._sticky.filter_sticky([rid]) and await self.all_are_valid_roles(ctx, role):
+                allowed.add(rid)
+            else:
+                refused.add(rid)
+
+        present: Dict[FrozenSet[int], List[discord.Member]] = {}
+        absent = 0
+        await self._sticky.preload(guild.id)
+        for user_id, rids in wanted.items():
+            rids &= allowed
+            if not rids:
+                continue
+            member = guild.get_member(user_id)
+            if member:
+                present.setdefault(frozenset(rids), []).append(member)
+            else:
+                await self._sticky.update(guild.id, user_id, add=rids)
+                absent += 1
+        # One write for everyone not here, rather than waiting on the next flush
+        await self._sticky.flush(guild.id)
+
+        jobs = []
+        for n, (role_ids, members) in enumerate(present.items()):
+            jobs.append(
+                await self._jobs.submit(
+                    ctx,
+                    members,
+                    add=[r for r in map(guild.get_role, role_ids) if r],
+                    remove=[],
+                    job_id=f"{ctx.message.id}-{n}" if n else None,
+                )
+            )
+
+        msg = (
+            f"Read {len(wanted)} user ids in {time.perf_counter() - start:.1f} seconds. "
+            f"Stored sticky roles for {absent} users not in the server."
+        )
+        if jobs:
+            msg += (
+                f"\nGiving roles to {sum(j.total for j in jobs)} members already here, "
+                f"see `{ctx.clean_prefix}massrole jobs` for job"
+                f"{'s' if len(jobs) > 1 else ''} {humanize_list([f'`{j.job_id}`' for j in jobs])}."
+            )
+        if refused:
+            msg += f"\nSkipped {len(refused)} role ids which aren't sticky roles I can give out here."
+        if bad_lines:
+            msg += f"\nSkipped {bad_lines} lines without a user id."
+        await ctx.send(msg)
+
     @checks.is_owner()
     @commands.command(name="rrcleanup", hidden=True)
     async def rolemanagementcleanup(self, ctx: GuildContext):
         """:eyes:"""
+        start = time.perf_counter()
         data = await self.config.custom("REACTROLE").all()
 
-        key_data = {}
-
+        by_channel: Dict[Optional[int], List[str]] = {}
         for maybe_message_id, maybe_data in data.items():
             try:
-                message_id = int(maybe_message_id)
+                int(maybe_message_id)
             except ValueError:
                 continue
-
-            ex_keys = list(maybe_data.keys())
-            if not ex_keys:
+            if not maybe_data:
                 continue
+            channel_id = next(iter(maybe_data.values())).get("channelid")
+            by_channel.setdefault(channel_id, []).append(maybe_message_id)
+
+        dead: List[str] = []
+        dead_channels = 0
+        to_check: List[Tuple[discord.abc.Messageable, str]] = []
+        for channel_id, message_ids in by_channel.items():
+            channel = ctx.bot.get_channel(channel_id) if channel_id else None
+            if not isinstance(channel, (discord.TextChannel, discord.Thread, discord.VoiceChannel)):
+                channel = None
+            perms = channel.permissions_for(channel.guild.me) if channel else None
+            # Everything in a channel we can't see is gone as far as we're concerned
+            if not (channel and perms and perms.view_channel and perms.read_message_history):
+                dead_channels += 1
+                dead.extend(message_ids)
+            else:
+                to_check.extend((channel, mid) for mid in message_ids)
 
-            message = None
-            channel_id = maybe_data[ex_keys[0]]["channelid"]
-            channel = ctx.bot.get_channel(channel_id)
-            if channel:
-                with contextlib.suppress(discord.HTTPException):
-                    assert isinstance(channel, discord.TextChannel)  # nosec
-                    message = await channel.fetch_message(message_id)
+        sem = asyncio.Semaphore(CLEANUP_CONCURRENCY)
 
-            if not message:
-                key_data.update({maybe_message_id: ex_keys})
+        async def exists(channel: discord.abc.Messageable, message_id: str) -> bool:
+            async with sem:
+                try:
+                    await channel.fetch_message(int(message_id))
+                except (discord.NotFound, discord.Forbidden):
+                    return False
+                except discord.HTTPException:
+                    # Can't tell, so leave it for next time
+                    return True
+                return True
+
+        found = await asyncio.gather(*(exists(c, mid) for c, mid in to_check))
+        dead.extend(mid for (_c, mid), ok in zip(to_check, found) if not ok)
+
+        removed: List[Tuple[int, str]] = []
+        if dead:
+            async with self.config.custom("REACTROLE").all() as current:
+                for mid in dead:
+                    removed.extend((int(mid), k) for k in current.pop(mid, ()))
+            self._bindings.remove_many(removed)
+            if self._sql is not None:
+                self._sql.delete_actions(removed)
 
-        for mid, keys in key_data.items():
-            for k in keys:
-                await self.config.custom("REACTROLE", mid, k).clear()
+        await ctx.send(
+            f"Checked {len(to_check)} messages in {len(by_channel) - dead_channels} channels "
+            f"({dead_channels} channels missing or unreadable). "
+            f"Removed {len(removed)} reaction roles from {len(dead)} messages "
+            f"in {time.perf_counter() - start:.1f} seconds."
+        )
 
-        await ctx.tick()
+    @checks.is_owner()
+    @commands.group(name="rrcompact", hidden=True, invoke_without_command=True)
+    async def rolemanagement_compact(
+        self, ctx: commands.Context, dry_run: Optional[Literal["dry-run"]] = None
+    ):
+        """
+        Removes stored data for deleted roles, channels and departed members.
+
+        This also runs once a day on its own.
+        Use `dry-run` to see what would be removed without removing it.
+        """
+        start = time.perf_counter()
+        async with ctx.typing():
+            report = await self._compactor.run(dry_run=bool(dry_run))
+        await ctx.send(
+            box(report.summary())
+            + f"{'Dry run, nothing was removed. ' if dry_run else ''}"
+            f"Took {time.perf_counter() - start:.1f} seconds."
+        )
+
+    @rolemanagement_compact.command(name="retention")
+    async def rolemanagement_compact_retention(
+        self, ctx: commands.Context, days: Optional[int] = None
+    ):
+        """
+        How long to keep sticky roles and other data for people who have left.
+
+        Leave out days to keep it until they come back, however long that is.
+        """
+        if days is not None and days < 1:
+            return await ctx.send(error("Days must be at least 1."))
+        await self.config.compaction_member_retention.set(days)
+        if days is None:
+            await ctx.send("Data for people who have left will be kept.")
+        else:
+            await ctx.send(f"Data for people who have left will be removed after {days} days.")
+
+    @checks.is_owner()
+    @commands.command(name="rrreconcile", hidden=True)
+    async def rolemanagement_reconcile(self, ctx: commands.Context):
+        """
+        Catches up on reactions to reaction roles the bot may have missed.
+
+        This runs on its own at startup and after reconnecting.
+        """
+        start = time.perf_counter()
+        async with ctx.typing():
+            await asyncio.shield(self._reconciler.start())
+        await ctx.send(
+            f"Gave {self._reconciler.given} missing roles and removed {self._reconciler.removed} "
+            f"in {time.perf_counter() - start:.1f} seconds."
+        )
+
+    @checks.is_owner()
+    @commands.command(name="rrstorage", hidden=True)
+    async def rolemanagement_storage(
+        self, ctx: commands.Context, backend: Optional[Literal["config", "sqlite"]] = None
+    ):
+        """
+        Where sticky roles, reaction roles, and role rules are read from.
+
+        `sqlite` keeps this data in a database in the cog's data folder,
+        existing data is copied over the first time it is enabled.
+        `config` switches back, copying sticky roles back to Config.
+
+        Use without a setting to view the current one.
+        """
+        current = await self.config.storage_backend()
+        if backend is None:
+            return await ctx.send(f"Currently using `{current}`.")
+        if backend == current:
+            return await ctx.send(f"Already using `{current}`.")
+
+        start = time.perf_counter()
+        if backend == "sqlite":
+            sql = SQLiteStore(cog_data_path(self) / "rolemanagement.db")
+            await self._sticky.flush()
+            await self.migrate_to_sql(sql)
+            await self._sticky.set_backend(sql)
+            self._sql = sql
+        else:
+            old_sql = self._sql
+            assert old_sql is not None  # nosec
+            await self._sticky.set_backend(None)
+            self._sql = None
+            # What Config has is from before SQLite was enabled, so everyone's
+            # roles are replaced, including those with none left in SQLite
+            sticky = await old_sql.all_sticky()
+            for guild_id, members in (await self.config.all_members()).items():
+                updates = sticky.setdefault(guild_id, {})
+                for member_id, data in members.items():
+                    if data.get("roles"):
+                        updates.setdefault(member_id, [])
+            for guild_id, members in sticky.items():
+                if members:
+                    await self._sticky.write_guild(guild_id, members)
+            old_sql.close()
+
+        await self.config.storage_backend.set(backend)
+        await ctx.send(
+            f"Now using `{backend}` (took {time.perf_counter() - start:.2f}s)."
+        )
+
+    async def migrate_to_sql(self, sql: SQLiteStore):
+        """
+        Copies role rules, reaction roles, and sticky roles from Config
+        """
+        role_guilds = {r.id: g.id for g in self.bot.guilds for r in g.roles}
+        roles = {
+            role_id: (role_guilds.get(role_id), data)
+            for role_id, data in (await self.config.all_roles()).items()
+        }
+        reactroles = await self.config.custom("REACTROLE").all()
+        sticky = {
+            guild_id: {
+                member_id: data["roles"]
+                for member_id, data in members.items()
+                if data.get("roles")
+            }
+            for guild_id, members in (await self.config.all_members()).items()
+        }
+        await sql.import_config(roles=roles, reactroles=reactroles, sticky=sticky)
 
     @commands.guild_only()
     @commands.bot_has_permissions(manage_roles=True)
     @checks.admin_or_permissions(manage_guild=True)
-    @commands.command(name="rolebind")
+    @commands.group(name="rolebind", invoke_without_command=True)
     async def bind_role_to_reactions(
         self,
         ctx: GuildContext,
@@ -391,12 +889,25 @@ class RoleManagement(
         channel: discord.TextChannel,
         msgid: int,
         emoji: str,
+        behaviour: Annotated[ActionType, reaction_action] = ActionType.TOGGLE,
     ):
         """
         Binds a role to a reaction on a message...
 
+        For buttons or a menu on a new message instead, see the subcommands.
         The role is only given if the criteria for it are met.
         Make sure you configure the other settings for a role in [p]roleset
+
+        behaviour is one of:
+            toggle: reacting gives the role, unreacting removes it (default)
+            add-only: reacting gives the role, unreacting does nothing
+            remove-only: reacting removes the role, unreacting does nothing
+            inverted: reacting removes the role, unreacting gives it
+
+        or, for baiting bots which react to anything in a verification channel:
+            honeypot-lock: reacting gives the role, and can't be undone by unreacting
+            honeypot-kick: reacting kicks (the role isn't used)
+            honeypot-ban: reacting bans (the role isn't used)
         """
 
         if not await self.all_are_valid_roles(ctx, role):
@@ -411,7 +922,8 @@ class RoleManagement(
 
         _emoji: Optional[Union[discord.Emoji, str]]
 
-        _emoji = discord.utils.find(lambda e: str(e) == emoji, self.bot.emojis)
+        custom = CUSTOM_EMOJI_RE.match(emoji)
+        _emoji = self.bot.get_emoji(int(custom.group(3))) if custom else None
         if _emoji is None:
             try:
                 await ctx.message.add_reaction(emoji)
@@ -431,20 +943,82 @@ class RoleManagement(
                     "Hmm, that message couldn't be reacted to"
                 )
 
+        binding = Binding(message.id, eid, role.id, message.channel.id, role.guild.id, behaviour)
         cfg = self.config.custom("REACTROLE", str(message.id), eid)
-        await cfg.set(
-            {
-                "roleid": role.id,
-                "channelid": message.channel.id,
-                "guildid": role.guild.id,
-            }
-        )
+        await cfg.set(binding.to_config())
+        self._bindings.add(binding)
+        if self._sql is not None:
+            self._sql.set_action(
+                message_id=message.id,
+                reaction=eid,
+                channel_id=message.channel.id,
+                guild_id=role.guild.id,
+                role_id=role.id,
+                action_type=behaviour,
+            )
         await ctx.send(
             f"Remember, the reactions only function according to "
             f"the rules set for the roles using `{ctx.prefix}roleset`",
             delete_after=30,
         )
 
+    @bind_role_to_reactions.command(name="buttons")
+    async def rolebind_buttons(
+        self, ctx: GuildContext, channel: discord.TextChannel, *roles: discord.Role
+    ):
+        """
+        Posts a message with a button for each role, clicking one toggles it
+
+        Up to 25 roles. Unlike reactions, nothing is stored for these;
+        delete the message to get rid of them.
+        """
+        await self.post_role_components(
+            ctx, channel, roles, MAX_BUTTONS, button_view, "Click a button to add or remove that role."
+        )
+
+    @bind_role_to_reactions.command(name="select")
+    async def rolebind_select(
+        self, ctx: GuildContext, channel: discord.TextChannel, *roles: discord.Role
+    ):
+        """
+        Posts a message with a menu to pick any of these roles from
+
+        Up to 25 roles. Whatever is picked is given, and whatever isn't is removed,
+        all at once. Unlike reactions, nothing is stored for these;
+        delete the message to get rid of them.
+        """
+        await self.post_role_components(
+            ctx, channel, roles, MAX_OPTIONS, select_view, "Pick the roles you want from the menu."
+        )
+
+    async def post_role_components(
+        self,
+        ctx: GuildContext,
+        channel: discord.TextChannel,
+        roles: Sequence[discord.Role],
+        limit: int,
+        make_view: Callable[[Sequence[discord.Role]], discord.ui.View],
+        content: str,
+    ):
+        roles = list(dict.fromkeys(roles))
+        if not roles:
+            return await ctx.send_help()
+        if len(roles) > limit:
+            return await ctx.send(error(f"At most {limit} roles fit on one message."))
+        if not await self.all_are_valid_roles(ctx, *roles):
+            return await ctx.maybe_send_embed(
+                "Can't do that. Discord role heirarchy applies here."
+            )
+        try:
+            await channel.send(content, view=make_view(roles))
+        except discord.HTTPException:
+            return await ctx.send(error(f"I couldn't post in {channel.mention}."))
+        await ctx.send(
+            f"Remember, these only function according to "
+            f"the rules set for the roles using `{ctx.prefix}roleset`",
+            delete_after=30,
+        )
+
     @commands.guild_only()
     @commands.bot_has_permissions(manage_roles=True)
     @checks.admin_or_permissions(manage_guild=True)
@@ -461,9 +1035,11 @@ class RoleManagement(
                 "Can't do that. Discord role heirarchy applies here."
             )
 
-        await self.config.custom(
-            "REACTROLE", f"{msgid}", self.strip_variations(emoji)
-        ).clear()
+        eid = self.strip_variations(emoji)
+        await self.config.custom("REACTROLE", f"{msgid}", eid).clear()
+        self._bindings.remove(msgid, eid)
+        if self._sql is not None:
+            self._sql.delete_actions([(msgid, eid)])
         await ctx.tick()
 
     @commands.guild_only()
@@ -493,6 +1069,7 @@ class RoleManagement(
         else:
             await self.config.role(role).age_verification.set(age)
 
+        await self._role_settings_changed(role)
         await ctx.tick()
 
     @rgroup.command(name="agelog")
@@ -503,6 +1080,87 @@ class RoleManagement(
         await self.config.guild(ctx.guild).age_log.set(log)
         await ctx.tick()
 
+    @rgroup.command(name="reactiondebounce")
+    async def rg_reaction_debounce(self, ctx: GuildContext, seconds: float):
+        """
+        Set how long to wait for someone to stop toggling a reaction role
+
+        Reactions added and removed within this many seconds of each other
+        are handled once, based on whether the reaction ended up added.
+
+        0 handles every reaction as it happens. The default is 1 second.
+        """
+        if not 0 <= seconds <= 10:
+            await ctx.send(error("Seconds must be between 0 and 10."))
+            return
+        await self.config.guild(ctx.guild).reaction_debounce.set(seconds)
+        await ctx.tick()
+
+    @rgroup.command(name="burstguard")
+    async def rg_burst_guard(
+        self,
+        ctx: GuildContext,
+        action: str,
+        threshold: int = 5,
+        lock_role: Optional[discord.Role] = None,
+    ):
+        """
+        Deal with bursts of reactions from brand new accounts
+
+        Once `threshold` reactions to reaction role messages within 10 seconds
+        come from accounts under 3 days old, or from people who joined seconds
+        before reacting, those accounts are all dealt with at once.
+
+        action is one of lock, kick, ban or off; lock gives them lock_role.
+        For a single bait reaction instead, see the honeypot behaviours of rolebind.
+        """
+        action = action.casefold()
+        if action == "off":
+            await self.config.guild(ctx.guild).kaizo_action.clear()
+            self._kaizo.configure(ctx.guild.id, None)
+            await ctx.tick()
+            return
+        if action not in BURST_ACTIONS:
+            await ctx.send_help()
+            return
+        if threshold < 2:
+            await ctx.send(error("The threshold must be at least 2."))
+            return
+        kaizo_action = BURST_ACTIONS[action]
+        if kaizo_action == ActionType.KAIZO_LOCK:
+            if lock_role is None:
+                await ctx.send(error("Locking needs a role to give."))
+                return
+            if not await self.all_are_valid_roles(ctx, lock_role):
+                await ctx.send(error("Can't do that. Discord role heirarchy applies here."))
+                return
+
+        lock_role_id = lock_role.id if lock_role else None
+        async with self.config.guild(ctx.guild).all() as guild_data:
+            guild_data.update(
+                kaizo_action=int(kaizo_action),
+                kaizo_threshold=threshold,
+                kaizo_lock_role=lock_role_id,
+            )
+        self._kaizo.configure(ctx.guild.id, kaizo_action, threshold, lock_role_id)
+        await ctx.send(
+            f"Will {action} accounts once {threshold} suspicious reactions "
+            f"happen within {BURST_WINDOW} seconds."
+        )
+
+    @rgroup.command(name="reconcileremovals")
+    async def rg_reconcile_removals(self, ctx: GuildContext, remove: bool):
+        """
+        Whether catching up on missed reactions also takes roles away
+
+        After time offline, reaction roles are given to anyone who reacted
+        while the bot wasn't watching. With this on, toggle reaction roles are
+        also taken from anyone who has one without having reacted for it,
+        including people given it some other way.
+        """
+        await self.config.guild(ctx.guild).reconcile_removals.set(remove)
+        await ctx.tick()
+
     @rgroup.command(name="addwith")
     async def rg_addwith(
         self, ctx: GuildContext, add_role: discord.Role, *roles: discord.Role
@@ -519,6 +1177,7 @@ class RoleManagement(
         current = [discord.utils.get(ctx.guild.roles, id=r) for r in current]
 
         await self.config.role(add_role).add_with.set([r.id for r in roles])
+        await self._role_settings_changed(add_role)
 
         if not roles and current:
             await ctx.send(f"Add with roles cleared from: `{humanize_list(current)}`")
@@ -529,6 +1188,93 @@ class RoleManagement(
                 f"Add with roles set to `{humanize_list([r.name for r in roles])}` from `{humanize_list(current) if current else None}`"
             )
 
+    @rgroup.command(name="export")
+    async def rg_export(self, ctx: GuildContext, fmt: Literal["json", "yaml"] = "json"):
+        """
+        Export the role rules for this server
+
+        This covers everything set with `[p]roleset` for each role,
+        and can be loaded back here or elsewhere with `[p]roleset import`.
+        """
+        if fmt == "yaml" and not YAML_AVAILABLE:
+            return await ctx.send("YAML isn't available here, use json instead.")
+        role_data = {role: await self.config.role(role).all() for role in ctx.guild.roles}
+        text = export_rules(ctx.guild, role_data, fmt)
+        await ctx.send(
+            file=discord.File(io.BytesIO(text.encode("utf-8")), filename=f"roles-{ctx.guild.id}.{fmt}")
+        )
+
+    @rgroup.command(name="import")
+    async def rg_import(
+        self, ctx: GuildContext, dry_run: Optional[Literal["dry-run"]] = None
+    ):
+        """
+        Import role rules from an attached JSON or YAML file
+
+        The file should look like what `[p]roleset export` gives you.
+        Roles are matched by id, or by name if there's no role with that id.
+        Only the settings in the file are changed, everything else is left alone.
+
+        Use `[p]roleset import dry-run` to see what would change without changing it.
+        """
+        if not ctx.message.attachments:
+            return await ctx.send("Attach the file to import to your message.")
+        attachment = ctx.message.attachments[0]
+        if attachment.size > MAX_RULES_FILE:
+            return await ctx.send("That file is too large to be a rule set.")
+
+        text = (await attachment.read()).decode("utf-8", errors="replace")
+        try:
+            incoming = validate_rules(ctx.guild, load_rules(text), min_sub_time=MIN_SUB_TIME)
+        except RuleImportError as e:
+            await ctx.send("Nothing was changed, the file has problems:")
+            for page in pagify("\n".join(e.problems)):
+                await ctx.send(box(page))
+            return
+
+        if not await self.all_are_valid_roles(ctx, *incoming):
+            return await ctx.maybe_send_embed(
+                "Can't do that. Discord role heirarchy applies here."
+            )
+
+        current = {role: await self.config.role(role).all() for role in incoming}
+        diff = diff_rules(current, incoming)
+        if not diff:
+            return await ctx.send("Those rules are already in place, nothing to change.")
+
+        for page in pagify(format_diff(diff), page_length=1900):
+            await ctx.send(box(page))
+        if dry_run:
+            return await ctx.send(f"Dry run, {len(diff)} roles would be changed.")
+
+        # Every role's settings in one write of the ROLE group, instead of one (or more) per role
+        await update_raw_entries(
+            self.config._get_base_group(Config.ROLE),
+            {
+                role.id: {field: new for field, (_old, new) in changes.items()}
+                for role, changes in diff.items()
+            },
+        )
+        sub_changes = {
+            role.id: changes["subscription"][1]
+            for role, changes in diff.items()
+            if "subscription" in changes
+        }
+        if sub_changes:
+            async with self.config.guild(ctx.guild).s_roles() as s_roles:
+                for role_id, subscription in sub_changes.items():
+                    if subscription and role_id not in s_roles:
+                        s_roles.append(role_id)
+                    elif not subscription and role_id in s_roles:
+                        s_roles.remove(role_id)
+        await self._role_settings_changed(*diff)
+        for role, changes in diff.items():
+            if "sticky" in changes:
+                await self._sticky_changed(role, changes["sticky"][1])
+            if "timed" in changes:
+                self._timed.set_duration(role.id, changes["timed"][1])
+        await ctx.send(f"Updated {len(diff)} roles.")
+
     @rgroup.command(name="viewreactions")
     async def rg_view_reactions(self, ctx: GuildContext):
         """
@@ -536,12 +1282,14 @@ class RoleManagement(
         """
         # This design is intentional for later extention to view this per role
 
+        bound = {b.role_id for b in self._bindings.for_guild(ctx.guild.id)}
+        roles = sorted(filter(None, map(ctx.guild.get_role, bound)))
         use_embeds = await ctx.embed_requested()
         react_roles = "\n".join(
             [
                 msg
                 async for msg in self.build_messages_for_react_roles(
-                    *ctx.guild.roles, use_embeds=use_embeds
+                    *roles, use_embeds=use_embeds
                 )
             ]
         )
@@ -583,10 +1331,12 @@ class RoleManagement(
             return
         elif msg.lower() == "message_clear":
             await self.config.role(role).dm_msg.set(None)
+            await self._role_settings_changed(role)
             await ctx.tick()
             return
 
         await self.config.role(role).dm_msg.set(msg)
+        await self._role_settings_changed(role)
         await ctx.tick()
 
     @rgroup.group(name="join")
@@ -722,6 +1472,7 @@ class RoleManagement(
             return await ctx.send_help()
 
         await self.config.role(role).cost.set(cost)
+        await self._role_settings_changed(role)
         if cost == 0:
             await ctx.send(f"{role.name} is no longer purchasable.")
         else:
@@ -758,6 +1509,7 @@ class RoleManagement(
             await ctx.send("Subscription removed.")
             async with self.config.guild(ctx.guild).s_roles() as s:
                 s.remove(role.id)
+            await self._role_settings_changed(role)
             return
         elif int(time.total_seconds()) < MIN_SUB_TIME:
             await ctx.send("Subscriptions must be 1 hour or longer.")
@@ -766,8 +1518,44 @@ class RoleManagement(
         await self.config.role(role).subscription.set(int(time.total_seconds()))
         async with self.config.guild(ctx.guild).s_roles() as s:
             s.append(role.id)
+        await self._role_settings_changed(role)
         await ctx.send(f"Subscription set to {parse_seconds(time.total_seconds())}.")
 
+    @rgroup.command(name="timed")
+    async def rg_timed(self, ctx: GuildContext, role: discord.Role, *, duration: str):
+        """
+        Sets a role to be removed a while after someone gets it
+
+        However they got the role, it will be taken away after this long.
+        Set to 0 to disable.
+        Durations look like:
+           30 minutes
+           1 hour
+           2 days
+           1w
+           (etc)
+        """
+        if not await self.all_are_valid_roles(ctx, role):
+            return await ctx.maybe_send_embed(
+                "Can't do that. Discord role heirarchy applies here."
+            )
+
+        if duration.strip() == "0":
+            seconds = 0
+        else:
+            delta = parse_timedelta(duration)
+            if delta is None or delta.total_seconds() < 1:
+                return await ctx.send(error("I couldn't understand that duration."))
+            seconds = int(delta.total_seconds())
+
+        await self.config.role(role).timed.set(seconds)
+        await self._role_settings_changed(role)
+        self._timed.set_duration(role.id, seconds)
+        if seconds:
+            await ctx.send(f"`{role}` will be removed {parse_seconds(seconds)} after someone gets it.")
+        else:
+            await ctx.send(f"`{role}` is no longer timed.")
+
     @rgroup.command(name="forbid")
     async def forbid_role(
         self, ctx: GuildContext, role: discord.Role, *, user: discord.Member
@@ -821,6 +1609,8 @@ class RoleManagement(
                     [r.id for r in _roles if r != role and r.id not in ex_list[group]]
                 )
 
+        await self._role_settings_changed(*_roles)
+
         await ctx.tick()
 
     @rgroup.command(name="unexclusive")
@@ -850,6 +1640,7 @@ class RoleManagement(
             if not ex_list[group]:
                 del ex_list[group]
             await self.config.role(role).exclusive_to.set(ex_list)
+            await self._role_settings_changed(role)
         await ctx.tick()
 
     @rgroup.command(name="sticky")
@@ -869,11 +1660,8 @@ class RoleManagement(
             )
 
         await self.config.role(role).sticky.set(sticky)
-        if sticky:
-            for m in role.members:
-                async with self.config.member(m).roles() as rids:
-                    if role.id not in rids:
-                        rids.append(role.id)
+        await self._role_settings_changed(role)
+        await self._sticky_changed(role, sticky)
 
         await ctx.tick()
 
@@ -887,6 +1675,7 @@ class RoleManagement(
 
         rids = [r.id for r in roles]
         await self.config.role(role).requires_all.set(rids)
+        await self._role_settings_changed(role)
         await ctx.tick()
 
     @rgroup.command(name="requireany")
@@ -899,6 +1688,7 @@ class RoleManagement(
 
         rids = [r.id for r in (roles or [])]
         await self.config.role(role).requires_any.set(rids)
+        await self._role_settings_changed(role)
         await ctx.tick()
 
     @rgroup.command(name="selfrem")
@@ -920,6 +1710,8 @@ class RoleManagement(
             )
 
         await self.config.role(role).self_removable.set(removable)
+        await self._role_settings_changed(role)
+
         await ctx.tick()
 
     @rgroup.command(name="selfadd")
@@ -943,6 +1735,8 @@ class RoleManagement(
             )
 
         await self.config.role(role).self_role.set(assignable)
+        await self._role_settings_changed(role)
+
         await ctx.tick()
 
     @rgroup.group(name="freerole")
@@ -1011,52 +1805,15 @@ class RoleManagement(
         """
         Lists the selfroles and any associated costs.
         """
+        pages = self._catalog.pages(ctx.guild.id)
+        if pages is None:
+            role_data = {role: await self.config.role(role).all() for role in ctx.guild.roles}
+            pages = self._catalog.build(ctx.guild, role_data)
 
-        MYPY = False
-        if MYPY:
-            # remove this when mypy supports type narrowing from :=
-            # It's less efficient, so not removing the actual
-            # implementation below
-            data: Dict[discord.Role, tuple] = {}
-            for role_id, vals in (await self.config.all_roles()).items():
-                role = ctx.guild.get_role(role_id)
-                if role and vals["self_role"]:
-                    data[role] = vals["cost"]
-        else:
-            data = {
-                role: (vals["cost"], vals["subscription"], vals["exclusive_to"])
-                for role_id, vals in (await self.config.all_roles()).items()
-                if (role := ctx.guild.get_role(role_id)) and vals["self_role"]
-            }
-
-        if not data:
+        if not pages:
             return await ctx.send("There aren't any self roles here.")
 
-        embed = discord.Embed(title="Roles", colour=ctx.guild.me.colour)
-        embed.set_footer(text="You can only have one role in the same unique group!")
-        i = 0
-        for role, (cost, sub, ex_groups) in sorted(
-            data.items(), key=lambda kv: kv[1][0]
-        ):
-            if ex_groups:
-                groups = humanize_list(list(ex_groups.keys()))
-            else:
-                groups = None
-            embed.add_field(
-                name=f"__**{i+1}. {role.name}**__",
-                value="%s%s%s"
-                % (
-                    (f"Cost: {cost}" if cost else "Free"),
-                    (f", every {parse_seconds(sub)}" if sub else ""),
-                    (f"\nunique groups: `{groups}`" if groups else ""),
-                ),
-            )
-            i += 1
-            if i % MAX_EMBED == 0:
-                await ctx.send(embed=embed)
-                embed.clear_fields()
-
-        if i % MAX_EMBED != 0:
+        for embed in pages:
             await ctx.send(embed=embed)
 
     @selfrole.command(name="buy")
@@ -1064,149 +1821,171 @@ class RoleManagement(
         """
         Purchase a role
         """
-        if role in ctx.author.roles:
-            await ctx.send("You already have that role.")
-            return
+        if await self.self_buy(ctx.author, role, ctx.channel):
+            await ctx.tick()
+
+    async def self_buy(
+        self, member: discord.Member, role: discord.Role, dest: discord.abc.Messageable
+    ) -> bool:
+        """
+        Does the work of selfrole buy, returns True if the role was given.
+        """
+        guild = member.guild
+        if role in member.roles:
+            await dest.send("You already have that role.")
+            return False
         try:
-            remove = await self.is_self_assign_eligible(ctx.author, role)
+            remove = await self.is_self_assign_eligible(member, role)
             eligible = await self.config.role(role).self_role()
             cost = await self.config.role(role).cost()
             subscription = await self.config.role(role).subscription()
         except PermissionOrHierarchyException:
-            await ctx.send(
+            await dest.send(
                 "I cannot assign roles which I can not manage. (Discord Hierarchy)"
             )
         except MissingRequirementsException as e:
             msg = ""
             if e.miss_all:
-                roles = [r.name for r in ctx.guild.roles if r.id in e.miss_all]
+                roles = [r.name for r in guild.roles if r.id in e.miss_all]
                 msg += f"You need all of these roles in order to get this role: {humanize_list(roles)}\n"
             if e.miss_any:
-                roles = [r.name for r in ctx.guild.roles if r.id in e.miss_any]
+                roles = [r.name for r in guild.roles if r.id in e.miss_any]
                 msg += f"You need one of these roles in order to get this role: {humanize_list(roles)}\n"
-            await ctx.send(msg)
+            await dest.send(msg)
         except ConflictingRoleException as e:
-            roles = [r.name for r in ctx.guild.roles if r.id in e.conflicts]
+            roles = [r.name for r in guild.roles if r.id in e.conflicts]
             plural = "are" if len(roles) > 1 else "is"
-            await ctx.send(
+            await dest.send(
                 f"You have {humanize_list(roles)}, which you are not allowed to remove and {plural} exclusive to: {role.name}"
             )
         else:
             if not eligible:
-                return await ctx.send(
-                    f"You aren't allowed to add `{role}` to yourself {ctx.author.mention}!"
+                await dest.send(
+                    f"You aren't allowed to add `{role}` to yourself {member.mention}!"
                 )
+                return False
 
             if not cost:
-                return await ctx.send(
+                await dest.send(
                     "This role doesn't have a cost. Please try again using `[p]selfrole add`."
                 )
+                return False
 
-            if not await self.verify_age(role, ctx=ctx):
-                return await ctx.send(
-                    "You do not meet the minimum age requiremnt for this role, if you think this is an error please contact a staff member."
-                )
+            if not await self.age_check_passed(role, member, "buy", dest):
+                return False
 
-            free_roles = await self.config.guild(ctx.guild).free_roles()
-            currency_name = await bank.get_currency_name(ctx.guild)
-            for m_role in ctx.author.roles:
+            free_roles = await self.config.guild(guild).free_roles()
+            currency_name = await bank.get_currency_name(guild)
+            for m_role in member.roles:
                 if m_role.id in free_roles:
-                    await ctx.send(
+                    await dest.send(
                         f"You're special, no {currency_name} will be deducted from your account."
                     )
                     cost = 0
-                    # await self.update_roles_atomically(who=ctx.author, give=[role], remove=remove)
+                    # await self.update_roles_atomically(who=member, give=[role], remove=remove)
                     # await ctx.tick()
                     # return
 
             try:
                 if cost > 0:
-                    await bank.withdraw_credits(ctx.author, cost)
+                    await bank.withdraw_credits(member, cost)
             except ValueError:
-                return await ctx.send(
+                await dest.send(
                     f"You don't have enough {currency_name} (Cost: {cost} {currency_name})"
                 )
             else:
                 if subscription > 0:
                     if cost > 0:
-                        await ctx.send(
+                        await dest.send(
                             f"{role.name} will be renewed every {parse_seconds(subscription)}"
                         )
+                    end_time = time.time() + subscription
                     async with self.config.role(role).subscribed_users() as s:
-                        s[str(ctx.author.id)] = time.time() + subscription
-                    async with self.config.guild(ctx.guild).s_roles() as s:
+                        s[str(member.id)] = end_time
+                    self._subs.schedule((guild.id, role.id, member.id), end_time)
+                    async with self.config.guild(guild).s_roles() as s:
                         if role.id not in s:
                             s.append(role.id)
 
                 if remove:
                     plural = "s" if len(remove) > 1 else ""
-                    await ctx.send(
+                    await dest.send(
                         f"Removed `{humanize_list([r.name for r in remove])}` role{plural} since they are exclusive to the role you added."
                     )
                 await self.update_roles_atomically(
-                    who=ctx.author, give=[role], remove=remove
+                    who=member, give=[role], remove=remove
                 )
-                await self.dm_user(ctx, role)
-                await ctx.tick()
+                await self.dm_user(member, role, dest)
+                return True
+        return False
 
     @selfrole.command(name="add")
     async def sadd(self, ctx: GuildContext, *, role: discord.Role):
         """
         Join a role
         """
-        if role in ctx.author.roles:
-            await ctx.send("You already have that role.")
-            return
+        if await self.self_add(ctx.author, role, ctx.channel):
+            await ctx.tick()
+
+    async def self_add(
+        self, member: discord.Member, role: discord.Role, dest: discord.abc.Messageable
+    ) -> bool:
+        """
+        Does the work of selfrole add, returns True if the role was given.
+        """
+        guild = member.guild
+        if role in member.roles:
+            await dest.send("You already have that role.")
+            return False
         try:
-            remove = await self.is_self_assign_eligible(ctx.author, role)
+            remove = await self.is_self_assign_eligible(member, role)
             eligible = await self.config.role(role).self_role()
             cost = await self.config.role(role).cost()
         except PermissionOrHierarchyException:
-            await ctx.send(
+            await dest.send(
                 "I cannot assign roles which I can not manage. (Discord Hierarchy)"
             )
         except MissingRequirementsException as e:
             msg = ""
             if e.miss_all:
-                roles = [r.name for r in ctx.guild.roles if r.id in e.miss_all]
+                roles = [r.name for r in guild.roles if r.id in e.miss_all]
                 msg += f"You need all of these roles in order to get this role: {humanize_list(roles)}\n"
             if e.miss_any:
-                roles = [r.name for r in ctx.guild.roles if r.id in e.miss_any]
+                roles = [r.name for r in guild.roles if r.id in e.miss_any]
                 msg += f"You need one of these roles in order to get this role: {humanize_list(roles)}\n"
-            await ctx.send(msg)
+            await dest.send(msg)
         except ConflictingRoleException as e:
-            roles = [r.name for r in ctx.guild.roles if r in e.conflicts]
+            roles = [r.name for r in guild.roles if r in e.conflicts]
             plural = "are" if len(roles) > 1 else "is"
-            await ctx.send(
+            await dest.send(
                 f"You have {humanize_list(roles)}, which you are not allowed to remove and {plural} exclusive to: {role.name}"
             )
         else:
             if not eligible:
-                await ctx.send(
-                    f"You aren't allowed to add `{role}` to yourself {ctx.author.mention}!"
+                await dest.send(
+                    f"You aren't allowed to add `{role}` to yourself {member.mention}!"
                 )
 
-            elif not await self.verify_age(role, ctx=ctx):
-                return await ctx.send(
-                    "You do not meet the minimum age requiremnt for this role, if you think this is an error please contact a staff member."
-                )
+            elif not await self.age_check_passed(role, member, "add", dest):
+                return False
 
             elif cost:
-                await ctx.send(
+                await dest.send(
                     "This role is not free. "
                     "Please use `[p]selfrole buy` if you would like to purchase it."
                 )
             else:
                 if remove:
                     plural = "s" if len(remove) > 1 else ""
-                    await ctx.send(
+                    await dest.send(
                         f"Removed `{humanize_list([r.name for r in remove])}` role{plural} since they are exclusive to the role you added."
                     )
                 await self.update_roles_atomically(
-                    who=ctx.author, give=[role], remove=remove
+                    who=member, give=[role], remove=remove
                 )
-                await self.dm_user(ctx, role)
-                await ctx.tick()
+                await self.dm_user(member, role, dest)
+                return True
+        return False
 
     @selfrole.command(name="remove")
     async def srem(self, ctx: GuildContext, *, role: discord.Role):
@@ -1223,6 +2002,7 @@ class RoleManagement(
                     del s[str(ctx.author.id)]
             except:
                 pass
+            self._subs.cancel((ctx.guild.id, role.id, ctx.author.id))
             await ctx.tick()
         else:
             await ctx.send(
@@ -1266,128 +2046,202 @@ class RoleManagement(
                 emoji: Union[discord.Emoji, str]
                 if emoji_info.isdigit():
                     emoji = (
-                        discord.utils.get(self.bot.emojis, id=int(emoji_info))
+                        self.bot.get_emoji(int(emoji_info))
                         or f"A custom enoji with id {emoji_info}"
                     )
                 else:
                     emoji = emoji_info
 
                 react_m = f"{role.name} is bound to {emoji} on {link}"
+                action = data.get("action_type", ActionType.TOGGLE)
+                if action != ActionType.TOGGLE:
+                    react_m += f" ({ActionType(action).name.lower().replace('_', ' ')})"
                 yield react_m
 
-    async def verify_age(
-        self,
-        role: discord.Role,
-        ctx: GuildContext = None,
-        member: discord.Member = None,
-    ) -> bool:
+    async def check_age(self, role: discord.Role, member: discord.Member) -> Optional[bool]:
         """
-        Verify age of a user.
+        Whether a member is old enough for a role.
 
-        Returns True if age is successfully verified, false otherwise.
+        Returns None if the role has a minimum age and we don't have their birthday.
         """
-        if ctx is not None:
-            member = ctx.author
-
-        guild = member.guild
-        dob = await self.config.user(member).birthday()
         min_age = await self.config.role(role).age_verification()
-        age_log = await self.config.guild(guild).age_log()
-        today = datetime.utcnow().date()
-
         if min_age is None:
             return True
 
-        if dob is not None:
-            dob = parser.parse(dob).date()
-            age = today.year - dob.year
+        dob = await self.config.user(member).birthday()
+        if dob is None:
+            return None
+        return bool(age_from_dob(parser.parse(dob).date()) >= min_age)
 
-            # check to see if their birthday has passed
-            dob = dob.replace(year=today.year)
-            if dob > today:
-                # birthday hasn't passed, subtract one from age
-                age -= 1
+    async def age_check_passed(
+        self,
+        role: discord.Role,
+        member: discord.Member,
+        kind: str,
+        dest: Optional[discord.abc.Messageable] = None,
+    ) -> bool:
+        """
+        Checks a member's age for a role, telling them why if they can't have it.
 
-            return age >= min_age
+        If we need their birthday, asks for it and returns False; ``kind`` is
+        finished for them in the background once they reply.
+        """
+        ok = await self.check_age(role, member)
+        if ok:
+            return True
 
-        if ctx is not None:
-            await ctx.send(
-                info(
-                    "Please check your DMs with me in order to continue getting this role!"
-                ),
-                delete_after=30,
+        if ok is False:
+            msg = "You do not meet the minimum age requiremnt for this role, if you think this is an error please contact a staff member."
+        elif await self.request_birthday(role, member, kind, dest):
+            msg = info("Please check your DMs with me in order to continue getting this role!")
+        else:
+            msg = error(
+                "I need to DM you to verify your age for this role, "
+                "please allow server members to DM you and try again."
             )
 
-        # get dob of user
+        if dest is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await dest.send(msg, delete_after=30)
+        elif ok is False:
+            with contextlib.suppress(discord.HTTPException):
+                await member.send(
+                    f"You do not meet the minimum age requiremnt for `{role}`, if you think this is an error please contact a staff member."
+                )
+        return False
+
+    async def request_birthday(
+        self,
+        role: discord.Role,
+        member: discord.Member,
+        kind: str,
+        dest: Optional[discord.abc.Messageable] = None,
+    ) -> bool:
+        """
+        DMs a member for their date of birth, returns False if they can't be DMed.
+        """
+        guild = member.guild
         try:
             age_msg = f"Hello! In order to get the `{role}` role in `{guild}`, you must provide your **full date of birth** in order to verify your age. Please send it here. (Avoid the format dd/mm/yyyy as I may get confused!)"
             await member.send(age_msg)
-            pred = MessagePredicate.same_context(user=member)
-            msg = await self.bot.wait_for("message", check=pred, timeout=60)
-        except discord.Forbidden:  # TODO: send message in guild telling user to allow dms?
-            return False
-        except discord.HTTPException:
-            return False
-        except asyncio.TimeoutError:
-            await member.send(
-                error(
-                    f"Took too long, the {role} role has not been added to you in {guild}!\nPlease try again."
-                ),
-                delete_after=30,
-            )
+        except discord.HTTPException:  # TODO: send message in guild telling user to allow dms?
             return False
 
+        channel_id = dest.id if isinstance(dest, discord.abc.GuildChannel) else None
+        self._age.add(member.id, PendingAgeCheck(guild.id, role.id, channel_id, kind))
+        return True
+
+    async def handle_birthday_reply(self, message: discord.Message):
+        """
+        Finishes everything waiting on someone's date of birth
+        """
+        user = message.author
+        checks = self._age.pop(user.id)
+        if not checks:
+            return
+
+        role_names = self.pending_role_names(checks)
+        today = datetime.utcnow().date()
         try:
-            dob = parser.parse(msg.content.strip())
-        except:
-            await member.send(
+            dob = parser.parse(message.content.strip()).date()
+        except (ValueError, OverflowError):
+            await user.send(
                 error(
-                    f"Invalid date format, the {role} role has not been added to you in {guild}!\nPlease try again."
+                    f"Invalid date format, the {role_names} role has not been added to you!\nPlease try again."
                 ),
                 delete_after=30,
             )
-            return False
+            return
 
-        dob = dob.date()
         if dob.year == today.year:
-            await member.send(
+            await user.send(
                 error(
-                    f"Invalid date format, please make sure to include your birth year, the {role} role has not been added to you in {guild}!\nPlease try again."
+                    f"Invalid date format, please make sure to include your birth year, the {role_names} role has not been added to you!\nPlease try again."
                 ),
                 delete_after=30,
             )
-            return False
+            return
 
         dob_str = dob.strftime("%m/%d/%Y")
-        await member.send(
-            f"Thank you! Please check back in `{guild}` to confirm you obtained the role. If not, you may not meet the age requirement for the role."
+        await user.send(
+            "Thank you! Please check back in the server to confirm you obtained the role. If not, you may not meet the age requirement for the role."
         )
-        await self.config.user(member).birthday.set(dob_str)
-        if age_log:
+        await self.config.user(user).birthday.set(dob_str)
+
+        for check in checks:
+            guild = self.bot.get_guild(check.guild_id)
+            if guild is None:
+                continue
+            member = guild.get_member(user.id)
+            role = guild.get_role(check.role_id)
+            if not (member and role):
+                continue
+            if await self.config.guild(guild).age_log():
+                try:
+                    await modlog.create_case(
+                        self.bot,
+                        guild,
+                        datetime.now(),
+                        "Date of Birth Added",
+                        member,
+                        moderator=member,
+                        reason=f"Date of birth added for `{member}`: `{dob_str}`\n\nRole: `{role}`",
+                    )
+                except:  # TODO: warn staff
+                    pass
             try:
-                await modlog.create_case(
-                    self.bot,
-                    guild,
-                    datetime.now(),
-                    "Date of Birth Added",
-                    member,
-                    moderator=member,
-                    reason=f"Date of birth added for `{member}`: `{dob_str}`\n\nRole: `{role}`",
-                )
-            except:  # TODO: warn staff
+                await self.resume_age_check(member, role, check)
+            except (discord.HTTPException, PermissionOrHierarchyException):
                 pass
 
-        age = today.year - dob.year
+    async def resume_age_check(
+        self, member: discord.Member, role: discord.Role, check: PendingAgeCheck
+    ):
+        if check.kind == "react":
+            await self.grant_reaction_role(member, role)
+            return
 
-        # check to see if their birthday has passed
-        dob = dob.replace(year=today.year)
-        if dob > today:
-            # birthday hasn't passed, subtract one from age
-            age -= 1
+        channel = None
+        if check.channel_id is not None:
+            channel = member.guild.get_channel_or_thread(check.channel_id)
+        dest: discord.abc.Messageable = member
+        # The channel may be gone or closed to us by now, telling them directly is fine
+        if (
+            isinstance(channel, (discord.TextChannel, discord.Thread, discord.VoiceChannel))
+            and channel.permissions_for(member.guild.me).send_messages
+        ):
+            dest = channel
+        if check.kind == "add":
+            done = await self.self_add(member, role, dest)
+        else:
+            done = await self.self_buy(member, role, dest)
+        if done:
+            await dest.send(f"{member.mention} you now have the `{role}` role.")
 
-        return age >= min_age
+    async def expire_age_checks(self, user_id: int, checks: List[PendingAgeCheck]):
+        user = self.bot.get_user(user_id)
+        if user is None:
+            return
+        with contextlib.suppress(discord.HTTPException):
+            await user.send(
+                error(
+                    f"Took too long, the {self.pending_role_names(checks)} role has not been added to you!\nPlease try again."
+                ),
+                delete_after=30,
+            )
 
-    async def dm_user(self, ctx: GuildContext, role: discord.Role):
+    def pending_role_names(self, checks: List[PendingAgeCheck]) -> str:
+        names = []
+        for check in checks:
+            guild = self.bot.get_guild(check.guild_id)
+            role = guild and guild.get_role(check.role_id)
+            if role:
+                names.append(f"`{role}` ({guild})")
+        return humanize_list(names) if names else "requested"
+
+    async def dm_user(
+        self, member: discord.Member, role: discord.Role, dest: discord.abc.Messageable
+    ):
         """
         DM user if dm_msg set for role.
         """
@@ -1396,12 +2250,12 @@ class RoleManagement(
             return
 
         try:
-            await ctx.author.send(dm_msg)
+            await member.send(dm_msg)
         except:
-            await ctx.send(
-                f"Hey {ctx.author.mention}, please allow server members to DM you so I can send you messages! Here is the message for this role:"
+            await dest.send(
+                f"Hey {member.mention}, please allow server members to DM you so I can send you messages! Here is the message for this role:"
             )
-            await ctx.send(dm_msg)
+            await dest.send(dm_msg)
 
     async def get_react_role_entries(
         self, role: discord.Role
@@ -1416,18 +2270,8 @@ class RoleManagement(
                 config.custom("REACTROLE", messageid, emojiid)
         """
 
-        # self.config.register_custom(
-        #    "REACTROLE", roleid=None, channelid=None, guildid=None
-        # )  # ID : Message.id, str(React)
-
-        data = await self.config.custom("REACTROLE").all()
-
-        for mid, _outer in data.items():
-            if not _outer or not isinstance(_outer, dict):
-                continue
-            for em, rdata in _outer.items():
-                if rdata and rdata["roleid"] == role.id:
-                    yield (mid, em, rdata)
+        for binding in self._bindings.for_role(role.id):
+            yield (str(binding.message_id), binding.eid, binding.to_config())
 
     async def red_delete_data_for_user(
         self,
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Tuple
+
+import discord
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.debounce")
+
+# guild id, member id, message id, emoji id or string
+ReactionKey = Tuple[int, int, int, str]
+Payload = discord.raw_models.RawReactionActionEvent
+
+
+class _Burst:
+    __slots__ = ("first", "last", "payload", "handle")
+
+    def __init__(self, added: bool, payload: Payload):
+        self.first = added
+        self.last = added
+        self.payload = payload
+        self.handle: asyncio.TimerHandle
+
+
+class ReactionDebouncer:
+    """
+    Collapses bursts of reaction adds/removes into their net result.
+
+    The first event for a (member, message, emoji) starts a window; anything
+    for the same key inside it only updates the final state. When the window
+    closes, ``callback`` is called once with the last payload and whether the
+    reaction ended up added, unless the burst cancelled itself out
+    (e.g. add, remove) in which case nothing happens at all.
+    """
+
+    def __init__(self, callback: Callable[[Payload, bool], Awaitable[None]]):
+        self.callback = callback
+        self._bursts: Dict[ReactionKey, _Burst] = {}
+
+    def push(self, key: ReactionKey, payload: Payload, added: bool, window: float):
+        burst = self._bursts.get(key)
+        if burst is not None:
+            burst.last = added
+            burst.payload = payload
+            return
+
+        burst = self._bursts[key] = _Burst(added, payload)
+        burst.handle = asyncio.get_running_loop().call_later(window, self._close, key)
+
+    def stop(self):
+        for burst in self._bursts.values():
+            burst.handle.cancel()
+        self._bursts.clear()
+
+    def _close(self, key: ReactionKey):
+        burst = self._bursts.pop(key)
+        # An add followed by a remove (or vice versa) leaves things as they were
+        if burst.first != burst.last:
+            return
+        asyncio.create_task(self._run(burst.payload, burst.last))
+
+    async def _run(self, payload: Payload, added: bool):
+        try:
+            await self.callback(payload, added)
+        except Exception:
+            log.exception("Error handling reaction on message %d", payload.message_id)
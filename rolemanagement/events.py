@@ -1,13 +1,37 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
-from typing import List
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Set, Tuple, cast
 
 import discord
 from redbot.core import commands
 
 from .abc import MixinMeta
-from .exceptions import RoleManagementException, PermissionOrHierarchyException
+from .components import BUTTON, has_component, parse_custom_id, refusal, select_role_ids
+from .exceptions import (
+    ConflictingRoleException,
+    PermissionOrHierarchyException,
+    RoleManagementException,
+)
+from .future_sql import ActionType
+from .kaizo import KAIZO_ACTIONS
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.events")
+
+# (action type, reaction added) -> handler, anything missing is ignored
+REACTION_HANDLERS: Dict[Tuple[ActionType, bool], str] = {
+    (ActionType.TOGGLE, True): "reaction_give",
+    (ActionType.TOGGLE, False): "reaction_take",
+    (ActionType.ADD, True): "reaction_give",
+    (ActionType.REMOVE, True): "reaction_take",
+    (ActionType.INVERTED_TOGGLE, True): "reaction_take",
+    (ActionType.INVERTED_TOGGLE, False): "reaction_give",
+    (ActionType.KAIZO_LOCK, True): "reaction_honeypot",
+    (ActionType.KAIZO_KICK, True): "reaction_honeypot",
+    (ActionType.KAIZO_BAN, True): "reaction_honeypot",
+}
 
 
 class EventMixin(MixinMeta):
@@ -24,7 +48,7 @@ class EventMixin(MixinMeta):
         Can't check the email/2FA, blame discord for allowing people to react with above.
         """
         guild: discord.Guild = member.guild
-        now = datetime.utcnow()
+        now = discord.utils.utcnow()
         level: int = guild.verification_level.value
 
         if level >= 3 and member.created_at + timedelta(minutes=5) > now:  # medium
@@ -43,107 +67,223 @@ class EventMixin(MixinMeta):
         Section has been optimized assuming member._roles
         remains an iterable containing snowflakes
         """
-        if await self.bot.cog_disabled_in_guild(self, after.guild):
-            return
-        await self.wait_for_ready()
         if before._roles == after._roles:
             return
 
         lost, gained = set(before._roles), set(after._roles)
         lost, gained = lost - gained, gained - lost
         sym_diff = lost | gained
+        self._search_cache.member_updated(after, sym_diff)
+        self._edits.forget(after)
+
+        if await self.bot.cog_disabled_in_guild(cast(commands.Cog, self), after.guild):
+            return
+        await self.wait_for_ready()
 
         # check if new member roles are exclusive to others.
-        ex = []
+        ex: Set[int] = set()
         for r in gained:
-            ex_groups = (await self.config.role_from_id(r).exclusive_to()).values()
-            for ex_roles in ex_groups:
-                ex.extend(ex_roles)
-
+            ex.update(await self.get_exclusive_role_ids(r))
         to_remove = [r for r in after.roles if r.id in ex]
-        if to_remove:
-            await after.remove_roles(*to_remove, reason="conflict with exclusive roles")
 
         # add with roles for roles gained
+        reasons = ["conflict with exclusive roles"] if to_remove else []
+        to_add: List[discord.Role] = []
         for r in gained:
             add_with = await self.config.role_from_id(r).add_with()
             if add_with:
-                to_add = [
-                    discord.utils.get(after.guild.roles, id=add) for add in add_with
-                ]
-                await after.add_roles(*to_add, reason=f"add with role {r}")
-
-        for r in sym_diff:
-            if not await self.config.role_from_id(r).sticky():
-                lost.discard(r)
-                gained.discard(r)
-
-        async with self.config.member(after).roles() as rids:
-            for r in lost:
-                while r in rids:
-                    rids.remove(r)
-            for r in gained:
-                if r not in rids:
-                    rids.append(r)
+                to_add.extend(role for role in map(after.guild.get_role, add_with) if role)
+                reasons.append(f"add with role {after.guild.get_role(r)}")
+
+        # one edit for both, rather than one for the removals and one per role gained
+        me = after.guild.me
+        # Edits made through the cog already included these, leaving nothing to do here
+        to_add = [
+            r
+            for r in to_add
+            if r < me.top_role and r not in to_remove and r not in after.roles
+        ]
+        to_remove = [r for r in to_remove if r < me.top_role]
+        if (to_add or to_remove) and me.guild_permissions.manage_roles:
+            try:
+                await self._edits.edit(
+                    after, give=to_add, remove=to_remove, reason=", ".join(reasons)
+                )
+            except discord.HTTPException:
+                pass
+
+        if self._sticky.filter_sticky(sym_diff):
+            await self._sticky.update(
+                after.guild.id,
+                after.id,
+                add=self._sticky.filter_sticky(gained),
+                remove=self._sticky.filter_sticky(lost),
+            )
+
+        # timed roles count down however they were given, unless already counting
+        for r in gained:
+            if (after.guild.id, r, after.id) in self._timed:
+                continue
+            duration = self._timed.duration(r)
+            if duration:
+                self._timed.add(after.guild, [r], [after.id], time.time() + duration)
+        for r in lost:
+            self._timed.cancel((after.guild.id, r, after.id))
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Member and role events from before this session may have been missed
+        self._search_cache.clear()
+        # Only a new session after a disconnect, the first one is handled at startup.
+        # Resumed sessions get replayed whatever was missed, so need no reconciling.
+        if self._ready.is_set():
+            self._reconciler.start()
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        self._search_cache.clear()
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        # The owner has every permission, so permission searches change with them
+        if before.owner_id != after.owner_id:
+            self._search_cache.clear(after)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        self._jobs.guild_available(guild)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        # Only DMs from people we've asked for a birthday, a dict lookup for anything else
+        if message.guild is None and message.author.id in self._age:
+            await self.handle_birthday_reply(message)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self._search_cache.member_left(member)
+        self._edits.forget(member)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions != after.permissions or before.position != after.position:
+            self._search_cache.role_changed(after)
+        if before.name != after.name and self._catalog.lists_role(after.guild.id, after.id):
+            self._catalog.invalidate(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self._search_cache.role_changed(role)
+        if self._catalog.lists_role(role.guild.id, role.id):
+            self._catalog.invalidate(role.guild.id)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
+        self._search_cache.member_joined(member)
         await self.wait_for_ready()
-        if await self.bot.cog_disabled_in_guild(self, member.guild):
+        if await self.bot.cog_disabled_in_guild(cast(commands.Cog, self), member.guild):
+            return
+        if not member.guild.me.guild_permissions.manage_roles:
             return
+        self._join_queue.put(member.guild.id, member)
+
+    async def apply_join_roles(self, member: discord.Member):
+        """
+        Restores sticky roles and gives join roles, as a single role edit
+        """
         guild = member.guild
+        # They may have left while waiting in the queue
+        current = guild.get_member(member.id)
+        if current is None:
+            return
+        member = current
         if not guild.me.guild_permissions.manage_roles:
             return
 
-        async with self.config.member(member).roles() as rids:
-            to_add: List[discord.Role] = []
-            for _id in rids:
-                role = discord.utils.get(guild.roles, id=_id)
-                if not role:
-                    continue
-                if await self.config.role(role).sticky():
-                    to_add.append(role)
-            if to_add:
-                to_add = [r for r in to_add if r < guild.me.top_role]
-                await member.add_roles(*to_add)
-
-        # join roles
-        async with self.config.guild(guild).join_roles() as join_roles:
-            to_add: List[discord.Role] = []
-            for role_id in join_roles:
-                role = discord.utils.get(guild.roles, id=role_id)
-                if role:
-                    to_add.append(role)
-            if to_add:
-                to_add = [r for r in to_add if r < guild.me.top_role]
-                await member.add_roles(*to_add)
+        role_ids = self._sticky.filter_sticky(await self._sticky.get(guild.id, member.id))
+        role_ids.update(await self.config.guild(guild).join_roles())
+
+        to_add: List[discord.Role] = [
+            role for role in map(guild.get_role, role_ids) if role and role < guild.me.top_role
+        ]
+        if to_add:
+            try:
+                await self.update_roles_atomically(who=member, give=to_add)
+            except (PermissionOrHierarchyException, discord.HTTPException):
+                pass
+
+    def reaction_eid(self, payload: discord.raw_models.RawReactionActionEvent) -> str:
+        emoji = payload.emoji
+        if emoji.is_custom_emoji():
+            return str(emoji.id)
+        return self.strip_variations(str(emoji))
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(
         self, payload: discord.raw_models.RawReactionActionEvent
     ):
+        await self.debounce_reaction(payload, added=True)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(
+        self, payload: discord.raw_models.RawReactionActionEvent
+    ):
+        await self.debounce_reaction(payload, added=False)
+
+    async def debounce_reaction(
+        self, payload: discord.raw_models.RawReactionActionEvent, added: bool
+    ):
+        """
+        Bursts of toggling the same reaction are handled once, for the net result
+        """
         await self.wait_for_ready()
         if not payload.guild_id:
             return
 
-        emoji = payload.emoji
-        if emoji.is_custom_emoji():
-            eid = str(emoji.id)
-        else:
-            eid = self.strip_variations(str(emoji))
+        eid = self.reaction_eid(payload)
+        binding = self.get_reaction_binding(payload.message_id, eid)
+        # Also drops the half of add-only and remove-only bindings which does nothing
+        if binding is None:
+            return
+        if added and payload.member is not None:
+            self._kaizo.observe(payload.member)
+        if (binding.action_type, added) not in REACTION_HANDLERS:
+            return
+        if binding.action_type in KAIZO_ACTIONS:
+            # Never debounced, reacting and unreacting quickly mustn't get anyone off
+            await self.handle_reaction(payload, added)
+            return
+
+        window = await self.config.guild_from_id(payload.guild_id).reaction_debounce()
+        if window <= 0:
+            await self.handle_reaction(payload, added)
+            return
+        key = (payload.guild_id, payload.user_id, payload.message_id, eid)
+        self._reactions.push(key, payload, added, window)
 
-        cfg = self.config.custom("REACTROLE", str(payload.message_id), eid)
-        rid = await cfg.roleid()
-        if rid is None:
+    async def handle_reaction(
+        self, payload: discord.raw_models.RawReactionActionEvent, added: bool
+    ):
+        # Looked up again, the binding may have changed while debouncing
+        binding = self.get_reaction_binding(payload.message_id, self.reaction_eid(payload))
+        if binding is None:
             return
+        handler = REACTION_HANDLERS.get((binding.action_type, added))
+        if handler is not None:
+            await getattr(self, handler)(payload, binding.role_id)
 
+    async def reaction_give(
+        self, payload: discord.raw_models.RawReactionActionEvent, rid: int
+    ):
+        if payload.guild_id is None:
+            return
         guild = self.bot.get_guild(payload.guild_id)
         if guild:
             await self.maybe_update_guilds(guild)
         else:
             return
 
-        if await self.bot.cog_disabled_in_guild(self, guild):
+        if await self.bot.cog_disabled_in_guild(cast(commands.Cog, self), guild):
             return
         member = guild.get_member(payload.user_id)
 
@@ -156,60 +296,177 @@ class EventMixin(MixinMeta):
         role = guild.get_role(rid)
         if role is None or role in member.roles:
             return
+        await self.grant_reaction_role(member, role)
 
-        if not await self.verify_age(role, member=member):
-            try:
-                await member.send(
-                    f"You do not meet the minimum age requiremnt for `{role}`, if you think this is an error please contact a staff member."
-                )
-            except:
-                pass
+    async def reaction_honeypot(
+        self, payload: discord.raw_models.RawReactionActionEvent, rid: int
+    ):
+        if payload.member is None or payload.member.bot:
+            return
+        if await self.bot.cog_disabled_in_guild(cast(commands.Cog, self), payload.member.guild):
+            return
+        binding = self.get_reaction_binding(payload.message_id, self.reaction_eid(payload))
+        if binding is None:
             return
+        action = binding.action_type
+        self._kaizo.flag(
+            payload.member.guild.id,
+            payload.user_id,
+            action,
+            f"reacted to a honeypot on message {payload.message_id}",
+            # Kicking and banning don't use the bound role
+            lock_role=rid if action == ActionType.KAIZO_LOCK else None,
+        )
 
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.component:
+            return
+        data = cast(Dict[str, Any], interaction.data or {})
+        custom_id = str(data.get("custom_id", ""))
+        parsed = parse_custom_id(custom_id)
+        if parsed is None or interaction.guild is None or interaction.message is None:
+            return
+        # Only components we put on our own messages, so nobody can name their own role
+        message = interaction.message
+        me = self.bot.user
+        if me is None or message.author.id != me.id or not has_component(message, custom_id):
+            return
+        member = interaction.user
+        if not isinstance(member, discord.Member):
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        # Once deferred they're left looking at "thinking..." until we reply, whatever happens
+        msg = "Something went wrong, your roles may not have changed."
         try:
-            remove = await self.is_self_assign_eligible(member, role)
-        except (RoleManagementException, PermissionOrHierarchyException):
-            pass
-        else:
+            await self.wait_for_ready()
+            if await self.bot.cog_disabled_in_guild(cast(commands.Cog, self), interaction.guild):
+                msg = "Roles can't be picked here right now."
+            elif self.verification_level_issue(member):
+                msg = "You need to have been here a little longer before picking roles."
+            else:
+                kind, value = parsed
+                if kind == BUTTON:
+                    offered = {value}
+                    wanted = set() if member._roles.has(value) else {value}
+                else:
+                    offered = select_role_ids(message, custom_id)
+                    values = data.get("values", ())
+                    wanted = {int(v) for v in values if v.isdigit()} & offered
+                msg = await self.apply_component_roles(member, offered, wanted)
+        except Exception:
+            log.exception("Error handling role component %s in %d", custom_id, interaction.guild.id)
+        finally:
+            try:
+                await interaction.followup.send(msg, ephemeral=True)
+            except discord.HTTPException:
+                pass
+
+    async def apply_component_roles(
+        self, member: discord.Member, offered: Set[int], wanted: Set[int]
+    ) -> str:
+        """
+        Makes a member's roles among ``offered`` match ``wanted``, in one edit.
+
+        Roles being added are held to the same rules as self roles;
+        returns what happened, for telling them.
+        """
+        guild = member.guild
+        top = guild.me.top_role
+        # Offered roles out of our reach are left alone rather than failing the edit
+        remove = [
+            r for r in map(guild.get_role, offered - wanted) if r and r in member.roles and r < top
+        ]
+        give: List[discord.Role] = []
+        lines: List[str] = []
+        for role in sorted(filter(None, map(guild.get_role, wanted)), reverse=True):
+            if role in member.roles:
+                continue
+            # If we need their birthday, this is finished once they reply
+            if not await self.age_check_passed(role, member, "react"):
+                lines.append(f"**{role.name}** has an age requirement, check your DMs.")
+                continue
+            try:
+                conflicts = await self.is_self_assign_eligible(member, role)
+            except (RoleManagementException, PermissionOrHierarchyException) as exc:
+                lines.append(refusal(role, exc))
+                continue
+            stuck = [r for r in conflicts if r >= top]
+            if stuck:
+                lines.append(refusal(role, ConflictingRoleException(conflicts=stuck)))
+                continue
+            exclusive = await self.get_exclusive_role_ids(role.id)
+            picked = [r for r in give if r.id in exclusive]
+            if picked:
+                lines.append(refusal(role, ConflictingRoleException(conflicts=picked)))
+                continue
+            give.append(role)
+            remove.extend(r for r in conflicts if r not in remove)
+
+        if give or remove:
+            try:
+                await self.update_roles_atomically(who=member, give=give, remove=remove)
+            except (PermissionOrHierarchyException, discord.HTTPException):
+                return "I couldn't change your roles, a moderator may need to check my permissions."
+
+        if give:
+            lines.insert(0, f"Added: {', '.join(r.name for r in give)}")
+        if remove:
+            lines.insert(0, f"Removed: {', '.join(r.name for r in remove)}")
+        for role in give:
             dm_msg = await self.config.role(role).dm_msg()
             if dm_msg:
-                try:
-                    await member.send(dm_msg)
-                except:
-                    pass
-            await self.update_roles_atomically(who=member, give=[role], remove=remove)
+                lines.append(f"**{role.name}**: {dm_msg}")
+        return "\n".join(lines) or "Nothing changed."
 
-    @commands.Cog.listener()
-    async def on_raw_reaction_remove(
-        self, payload: discord.raw_models.RawReactionActionEvent
-    ):
-        await self.wait_for_ready()
-        if not payload.guild_id:
-            return
+    async def grant_reaction_role(
+        self, member: discord.Member, role: discord.Role, *, quiet: bool = False
+    ) -> bool:
+        """
+        Gives a role for a reaction, returning whether it was given.
 
-        emoji = payload.emoji
+        With ``quiet``, nobody is messaged: roles needing an age check
+        are only given to those already known to be old enough.
+        """
+        if role in member.roles:
+            return False
 
-        if emoji.is_custom_emoji():
-            eid = str(emoji.id)
-        else:
-            eid = self.strip_variations(str(emoji))
+        if quiet:
+            if not await self.check_age(role, member):
+                return False
+        # If we need their birthday, this is finished once they reply
+        elif not await self.age_check_passed(role, member, "react"):
+            return False
 
-        cfg = self.config.custom("REACTROLE", str(payload.message_id), eid)
-        rid = await cfg.roleid()
+        try:
+            remove = await self.is_self_assign_eligible(member, role)
+        except (RoleManagementException, PermissionOrHierarchyException):
+            return False
+        dm_msg = None if quiet else await self.config.role(role).dm_msg()
+        if dm_msg:
+            try:
+                await member.send(dm_msg)
+            except:
+                pass
+        await self.update_roles_atomically(who=member, give=[role], remove=remove)
+        return True
 
-        if rid is None:
+    async def reaction_take(
+        self, payload: discord.raw_models.RawReactionActionEvent, rid: int
+    ):
+        if payload.guild_id is None:
             return
-
         guild = self.bot.get_guild(payload.guild_id)
         if not guild:
             # Where's it go?
             return
-        if await self.bot.cog_disabled_in_guild(self, guild):
+        if await self.bot.cog_disabled_in_guild(cast(commands.Cog, self), guild):
             return
         member = guild.get_member(payload.user_id)
         if not member or member.bot:
             return
-        role = discord.utils.get(guild.roles, id=rid)
+        role = guild.get_role(rid)
         if not role or role not in member.roles:
             return
         if guild.me.guild_permissions.manage_roles and guild.me.top_role > role:
@@ -20,3 +20,9 @@ class ConflictingRoleException(RoleManagementException):
     def __init__(self, *, conflicts=None):
         self.conflicts = conflicts or []
         super().__init__()
+
+
+class RuleImportError(RoleManagementException):
+    def __init__(self, problems=None):
+        self.problems = problems or []
+        super().__init__("\n".join(self.problems))
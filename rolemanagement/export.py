@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import json
+import tempfile
+import zipfile
+from typing import IO, Iterable, Optional, Union
+
+import discord
+
+# Room left under the upload limit for the rest of the multipart request
+UPLOAD_HEADROOM = 64 * 1024
+# Upper bound on how much a compressor may be holding on to and not yet
+# have written out, used so compressed parts can't run over the budget.
+COMPRESSOR_SLACK = 1024 * 1024
+
+DATE_FMT = "%Y-%m-%d"
+
+CSV_FIELDS = [
+    "ID",
+    "Display Name",
+    "Username#Discrim",
+    "Joined Server",
+    "Joined Discord",
+]
+
+
+def _csv_row(member: discord.Member) -> list:
+    return [
+        member.id,
+        member.display_name,
+        str(member),
+        member.joined_at.strftime(DATE_FMT) if member.joined_at else None,
+        member.created_at.strftime(DATE_FMT),
+    ]
+
+
+def _jsonl_row(member: discord.Member) -> dict:
+    top_role = member.top_role
+    return {
+        "id": member.id,
+        "display_name": member.display_name,
+        "username": str(member),
+        "bot": member.bot,
+        "joined_server": member.joined_at.isoformat() if member.joined_at else None,
+        "joined_discord": member.created_at.isoformat(),
+        "top_role": {"id": top_role.id, "name": top_role.name},
+        "role_ids": list(member._roles),
+    }
+
+
+class _Part:
+    """
+    A single output file, written as rows come in
+    """
+
+    def __init__(self, *, entry_name: str, compression: Optional[str]):
+        # A real file, discord.File treats anything not an io.IOBase as a path
+        # and SpooledTemporaryFile only became one in Python 3.11
+        self.raw = tempfile.TemporaryFile()
+        self.compression = compression
+        self.written = 0
+        self._zip: Optional[zipfile.ZipFile] = None
+        self.stream: Union[IO[bytes], gzip.GzipFile]
+        if compression == "gzip":
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        elif compression == "zip":
+            self._zip = zipfile.ZipFile(self.raw, mode="w", compression=zipfile.ZIP_DEFLATED)
+            self.stream = self._zip.open(entry_name, mode="w", force_zip64=True)
+        else:
+            self.stream = self.raw
+
+    def estimated_size(self) -> int:
+        if self.compression is None:
+            return self.raw.tell()
+        return self.raw.tell() + min(self.written, COMPRESSOR_SLACK)
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+        self.written += len(data)
+
+    def finish(self) -> io.BufferedRandom:
+        if self.compression is not None:
+            self.stream.close()
+        if self._zip is not None:
+            self._zip.close()
+        self.raw.seek(0)
+        return self.raw
+
+
+class MemberExportWriter:
+    """
+    Streams members into one or more files, each kept under ``budget`` bytes.
+
+    Only the part being written is held on to, and it's written to a
+    temporary file, so memory use doesn't depend on the number of members.
+    """
+
+    def __init__(
+        self,
+        ctx,
+        *,
+        fmt: str = "csv",
+        compression: Optional[str] = None,
+        budget: Optional[int] = None,
+    ):
+        self.ctx = ctx
+        self.fmt = fmt
+        self.compression = compression
+        if budget is None:
+            budget = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
+        self.budget = max(budget - UPLOAD_HEADROOM, 1024)
+        self.part_number = 0
+        self.rows = 0
+        self._part: Optional[_Part] = None
+        self._header = b""
+        if fmt == "csv":
+            self._line = io.StringIO()
+            self._csv = csv.writer(self._line)
+            self._csv.writerow(CSV_FIELDS)
+            self._header = self._take_line()
+
+    def _take_line(self) -> bytes:
+        data = self._line.getvalue().encode()
+        self._line.seek(0)
+        self._line.truncate()
+        return data
+
+    def _encode(self, member: discord.Member) -> bytes:
+        if self.fmt == "jsonl":
+            return (json.dumps(_jsonl_row(member)) + "\n").encode()
+        self._csv.writerow(_csv_row(member))
+        return self._take_line()
+
+    @property
+    def extension(self) -> str:
+        ext = self.fmt
+        if self.compression == "gzip":
+            ext += ".gz"
+        elif self.compression == "zip":
+            ext = "zip"
+        return ext
+
+    def _new_part(self) -> _Part:
+        self.part_number += 1
+        part = _Part(entry_name=f"{self.ctx.message.id}.{self.fmt}", compression=self.compression)
+        if self._header:
+            part.write(self._header)
+        return part
+
+    async def _send(self, part: _Part, *, last: bool):
+        filename = f"{self.ctx.message.id}"
+        if not (last and self.part_number == 1):
+            filename += f"-part{self.part_number}"
+        filename += f".{self.extension}"
+        fp = part.finish()
+        try:
+            await self.ctx.send(
+                content=f"Data for {self.ctx.author.mention}",
+                files=[discord.File(fp, filename=filename)],
+                allowed_mentions=discord.AllowedMentions.all(),
+            )
+        finally:
+            fp.close()
+
+    async def write(self, members: Iterable[discord.Member]):
+        for member in members:
+            data = self._encode(member)
+            if self._part is None:
+                self._part = self._new_part()
+            elif self._part.estimated_size() + len(data) > self.budget:
+                await self._send(self._part, last=False)
+                self._part = self._new_part()
+            self._part.write(data)
+            self.rows += 1
+
+    async def close(self):
+        if self._part is None:
+            self._part = self._new_part()
+        await self._send(self._part, last=True)
+        self._part = None
+
+
+async def send_member_export(
+    ctx,
+    members: Iterable[discord.Member],
+    *,
+    fmt: str = "csv",
+    compression: Optional[str] = None,
+):
+    writer = MemberExportWriter(ctx, fmt=fmt, compression=compression)
+    await writer.write(members)
+    await writer.close()
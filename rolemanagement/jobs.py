@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set
+
+import discord
+
+from .exceptions import RoleManagementException, PermissionOrHierarchyException
+from .utils import parse_seconds
+
+if TYPE_CHECKING:
+    from .core import RoleManagement
+
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.jobs")
+
+# Member edits share a per-guild route bucket which discord.py already paces
+# for us, this only needs to be large enough to keep that bucket saturated.
+JOB_WORKERS = 4
+CHECKPOINT_INTERVAL = 15
+# jobs at or under this size are waited on by the command instead of reported on
+SMALL_JOB = 25
+
+
+class MassRoleJob:
+    """
+    A massrole modification running in the background.
+
+    Persisted to ``config.guild(guild).mrole_jobs[job_id]`` as::
+
+        {
+            "channel": int, "author": int,
+            "add": [role ids], "remove": [role ids],
+            "members": [member ids], "position": int,
+        }
+
+    Members are handed out in order, and only ``position`` (how many from
+    the start are finished) is written on checkpoints; the member list is
+    written once. A reload may redo up to ``CHECKPOINT_INTERVAL`` seconds of
+    work. This is harmless as ``update_roles_atomically`` skips members
+    which already match.
+    """
+
+    def __init__(
+        self,
+        *,
+        job_id: str,
+        guild_id: int,
+        channel_id: int,
+        author_id: int,
+        add: List[int],
+        remove: List[int],
+        members: List[int],
+        position: int = 0,
+    ):
+        self.job_id = job_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.add = add
+        self.remove = remove
+        self.members = members
+        self.position = position
+        self.processed = position
+        self.failed = 0
+        self.resumed = bool(position)
+        self.started = time.monotonic()
+        self._done_at_start = position
+        self._next = position
+        self._in_flight: Set[int] = set()
+        self.cancelled = False
+        self.quiet = False
+        self.finished = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_data(cls, job_id: str, guild_id: int, data: dict) -> MassRoleJob:
+        return cls(
+            job_id=job_id,
+            guild_id=guild_id,
+            channel_id=data["channel"],
+            author_id=data["author"],
+            add=data["add"],
+            remove=data["remove"],
+            members=data["members"],
+            position=data.get("position", 0),
+        )
+
+    def to_data(self) -> dict:
+        return {
+            "channel": self.channel_id,
+            "author": self.author_id,
+            "add": self.add,
+            "remove": self.remove,
+            "members": self.members,
+            "position": self.position,
+        }
+
+    @property
+    def total(self) -> int:
+        return len(self.members)
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.processed
+
+    def take(self) -> Optional[int]:
+        """
+        The index of the next member to process, if any are left
+        """
+        if self._next >= self.total:
+            return None
+        index = self._next
+        self._next += 1
+        self._in_flight.add(index)
+        return index
+
+    def finish(self, index: int):
+        self._in_flight.discard(index)
+        self.processed += 1
+        # Everything before the earliest member still being worked on is done
+        self.position = min(self._in_flight, default=self._next)
+
+    def eta(self) -> Optional[float]:
+        processed = self.processed - self._done_at_start
+        elapsed = time.monotonic() - self.started
+        if processed <= 0 or elapsed <= 0:
+            return None
+        return self.remaining / (processed / elapsed)
+
+    def progress(self) -> str:
+        pct = (self.processed / self.total * 100) if self.total else 100
+        msg = f"`{self.job_id}`: {self.processed}/{self.total} ({pct:.1f}%)"
+        if self.failed:
+            msg += f", {self.failed} failed"
+        eta = self.eta()
+        if eta is not None:
+            msg += f", about {parse_seconds(int(eta)) or 'a few seconds'} left"
+        if self.resumed:
+            msg += " (resumed)"
+        return msg
+
+
+class JobManager:
+    """
+    Runs massrole jobs with a bounded worker pool and checkpoints progress.
+    """
+
+    def __init__(self, cog: RoleManagement):
+        self.cog = cog
+        self.jobs: Dict[str, MassRoleJob] = {}
+        # Persisted jobs for guilds which weren't available to resume them in
+        self._waiting: Dict[int, List[MassRoleJob]] = {}
+
+    def for_guild(self, guild: discord.Guild) -> List[MassRoleJob]:
+        return [j for j in self.jobs.values() if j.guild_id == guild.id]
+
+    async def resume_all(self):
+        """
+        Restarts any jobs which were interrupted by an unload or restart
+        """
+        for guild_id, guild_data in (await self.cog.config.all_guilds()).items():
+            for job_id, data in guild_data.get("mrole_jobs", {}).items():
+                if job_id in self.jobs:
+                    continue
+                job = MassRoleJob.from_data(job_id, guild_id, data)
+                guild = self.cog.bot.get_guild(guild_id)
+                if guild is None or guild.unavailable:
+                    self._waiting.setdefault(guild_id, []).append(job)
+                    continue
+                log.info("Resuming massrole job %s in guild %d", job_id, guild_id)
+                self._start(job)
+
+    def guild_available(self, guild: discord.Guild):
+        """
+        Resumes jobs which were waiting on this guild
+        """
+        for job in self._waiting.pop(guild.id, ()):
+            if job.job_id not in self.jobs:
+                log.info("Resuming massrole job %s in guild %d", job.job_id, guild.id)
+                self._start(job)
+
+    async def submit(
+        self,
+        ctx,
+        members: Iterable[discord.Member],
+        *,
+        add: List[discord.Role],
+        remove: List[discord.Role],
+        job_id: Optional[str] = None,
+    ) -> MassRoleJob:
+        job = MassRoleJob(
+            job_id=job_id or str(ctx.message.id),
+            guild_id=ctx.guild.id,
+            channel_id=ctx.channel.id,
+            author_id=ctx.author.id,
+            add=[r.id for r in add],
+            remove=[r.id for r in remove],
+            members=[m.id for m in members],
+        )
+        job.quiet = job.total <= SMALL_JOB
+        await self.cog.config.guild(ctx.guild).set_raw("mrole_jobs", job.job_id, value=job.to_data())
+        self._start(job)
+        return job
+
+    def _start(self, job: MassRoleJob):
+        self.jobs[job.job_id] = job
+        job._task = asyncio.create_task(self._run(job))
+
+    async def cancel(self, guild: discord.Guild, job_id: str) -> Optional[MassRoleJob]:
+        job = self.jobs.get(job_id)
+        if job is None or job.guild_id != guild.id:
+            return None
+        job.cancelled = True
+        if job._task:
+            job._task.cancel()
+        await self.cog.config.guild(guild).clear_raw("mrole_jobs", job_id)
+        return job
+
+    def unload(self):
+        # Intentionally leaves persisted data alone so the jobs resume on load
+        for job in self.jobs.values():
+            if job._task:
+                job._task.cancel()
+        self._waiting.clear()
+
+    async def _checkpoint(self, job: MassRoleJob):
+        await self.cog.config.guild_from_id(job.guild_id).set_raw(
+            "mrole_jobs", job.job_id, "position", value=job.position
+        )
+
+    async def _run(self, job: MassRoleJob):
+        guild = self.cog.bot.get_guild(job.guild_id)
+        if guild is None or guild.unavailable:
+            # leave it persisted, and pick it up when the guild comes back
+            self.jobs.pop(job.job_id, None)
+            self._waiting.setdefault(job.guild_id, []).append(job)
+            return
+
+        give = [r for r in map(guild.get_role, job.add) if r]
+        remove = [r for r in map(guild.get_role, job.remove) if r]
+
+        async def worker():
+            while True:
+                index = job.take()
+                if index is None:
+                    return
+                member_id = job.members[index]
+                member = guild.get_member(member_id)
+                if member is not None:
+                    try:
+                        await self.cog.update_roles_atomically(who=member, give=give, remove=remove)
+                    except (RoleManagementException, PermissionOrHierarchyException):
+                        job.failed += 1
+                        log.debug(
+                            "Internal filter failure on member id %d guild id %d job %s",
+                            member_id,
+                            job.guild_id,
+                            job.job_id,
+                        )
+                    except discord.HTTPException:
+                        job.failed += 1
+                        log.debug(
+                            "Unpredicted failure for member id %d in guild id %d job %s",
+                            member_id,
+                            job.guild_id,
+                            job.job_id,
+                        )
+                job.finish(index)
+
+        workers = [asyncio.create_task(worker()) for _ in range(JOB_WORKERS)]
+        try:
+            pending = set(workers)
+            while pending:
+                _done, pending = await asyncio.wait(pending, timeout=CHECKPOINT_INTERVAL)
+                if pending:
+                    await self._checkpoint(job)
+            for w in workers:
+                # surface anything unexpected
+                w.result()
+        except asyncio.CancelledError:
+            for w in workers:
+                w.cancel()
+            if not job.cancelled:
+                # unloading, save what we have for the resume
+                await self._checkpoint(job)
+            raise
+        except Exception:
+            log.exception("Massrole job %s in guild %d failed", job.job_id, job.guild_id)
+            for w in workers:
+                w.cancel()
+            # Not kept for a resume, it would only fail the same way on every load
+            await self.cog.config.guild(guild).clear_raw("mrole_jobs", job.job_id)
+            if not job.quiet:
+                await self._notify_finished(guild, job, errored=True)
+        else:
+            await self.cog.config.guild(guild).clear_raw("mrole_jobs", job.job_id)
+            if not job.quiet:
+                await self._notify_finished(guild, job)
+        finally:
+            self.jobs.pop(job.job_id, None)
+            job.finished.set()
+
+    async def _notify_finished(
+        self, guild: discord.Guild, job: MassRoleJob, *, errored: bool = False
+    ):
+        channel = guild.get_channel_or_thread(job.channel_id)
+        if not isinstance(channel, (discord.TextChannel, discord.Thread, discord.VoiceChannel)):
+            return
+        if not channel.permissions_for(guild.me).send_messages:
+            return
+        elapsed = int(time.monotonic() - job.started)
+        if errored:
+            msg = (
+                f"<@{job.author_id}> massrole job `{job.job_id}` stopped after an error, "
+                f"with {job.processed}/{job.total} members done"
+            )
+        else:
+            msg = f"<@{job.author_id}> massrole job `{job.job_id}` finished: {job.total - job.failed}/{job.total} members"
+        if job.failed:
+            msg += f" ({job.failed} failed)"
+        msg += f" in {parse_seconds(elapsed) or 'under a second'}."
+        try:
+            await channel.send(msg, allowed_mentions=discord.AllowedMentions(users=True))
+        except discord.HTTPException:
+            pass
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import discord
+
+from .exceptions import PermissionOrHierarchyException
+from .future_sql import ActionType
+
+if TYPE_CHECKING:
+    from .core import RoleManagement
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.kaizo")
+
+KAIZO_ACTIONS = frozenset({ActionType.KAIZO_LOCK, ActionType.KAIZO_KICK, ActionType.KAIZO_BAN})
+BURST_ACTIONS: Dict[str, ActionType] = {
+    "lock": ActionType.KAIZO_LOCK,
+    "kick": ActionType.KAIZO_KICK,
+    "ban": ActionType.KAIZO_BAN,
+}
+
+# The burst detector looks at the last BURST_WINDOW seconds, in one second buckets
+BURST_WINDOW = 10
+# Reacting this soon after joining, or from an account this new, looks automated
+JOIN_REACT_LATENCY = 10
+NEW_ACCOUNT_AGE = 3 * 86400
+# Recently suspicious members per guild, the most a single burst can flag at once
+RECENT_SUSPECTS = 100
+# Flagged members are collected for this long and then actioned together
+ACTION_BATCH_WINDOW = 2.0
+
+
+class RingCounter:
+    """
+    Events over the last ``size`` seconds, in fixed memory.
+
+    Each bucket is one second; buckets which have fallen out of the window
+    are zeroed as time moves on, at most ``size`` of them per call.
+    """
+
+    __slots__ = ("buckets", "total", "head", "head_time")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.total = 0
+        self.head = 0
+        self.head_time = 0
+
+    def _advance(self, now: int):
+        steps = now - self.head_time
+        if steps <= 0:
+            return
+        size = len(self.buckets)
+        if steps >= size:
+            self.buckets = [0] * size
+            self.total = 0
+            self.head = now % size
+        else:
+            for _ in range(steps):
+                self.head = (self.head + 1) % size
+                self.total -= self.buckets[self.head]
+                self.buckets[self.head] = 0
+        self.head_time = now
+
+    def add(self, now: float, n: int = 1) -> int:
+        self._advance(int(now))
+        self.buckets[self.head] += n
+        self.total += n
+        return self.total
+
+
+class BurstSettings(NamedTuple):
+    action: ActionType
+    threshold: int
+    lock_role: Optional[int]
+
+
+class _GuildWindow:
+    __slots__ = ("reactions", "suspicious", "suspects")
+
+    def __init__(self):
+        self.reactions = RingCounter(BURST_WINDOW)
+        self.suspicious = RingCounter(BURST_WINDOW)
+        # (when, member id), only those within the window belong to a burst
+        self.suspects: Deque[Tuple[float, int]] = deque(maxlen=RECENT_SUSPECTS)
+
+    def prune(self, now: float):
+        while self.suspects and now - self.suspects[0][0] >= BURST_WINDOW:
+            self.suspects.popleft()
+
+
+class _Flag(NamedTuple):
+    action: ActionType
+    reason: str
+    # Only for locking, the role given
+    lock_role: Optional[int] = None
+
+
+class KaizoGuard:
+    """
+    Deals with accounts which auto react to anything that looks like verification.
+
+    Members are flagged either by reacting to a honeypot binding, or by the
+    burst detector: reactions to bound messages from members who joined
+    moments ago or whose accounts are days old are counted per guild over a
+    sliding window, and once there are too many, every recent one is flagged.
+    Watching a reaction is a few counter updates, whatever the guild's size.
+
+    Flagged members are held for a moment and actioned together, so a raid
+    is one bulk ban rather than one request per account where possible.
+    """
+
+    def __init__(self, cog: RoleManagement):
+        self.cog = cog
+        self._settings: Dict[int, BurstSettings] = {}
+        self._windows: Dict[int, _GuildWindow] = {}
+        self._pending: Dict[int, Dict[int, _Flag]] = {}
+        self._flushes: Dict[int, asyncio.Task] = {}
+
+    async def load(self):
+        for guild_id, data in (await self.cog.config.all_guilds()).items():
+            if data.get("kaizo_action"):
+                self.configure(
+                    guild_id,
+                    ActionType(data["kaizo_action"]),
+                    data.get("kaizo_threshold", 5),
+                    data.get("kaizo_lock_role"),
+                )
+
+    def configure(
+        self,
+        guild_id: int,
+        action: Optional[ActionType],
+        threshold: int = 5,
+        lock_role: Optional[int] = None,
+    ):
+        if action is None:
+            self._settings.pop(guild_id, None)
+            self._windows.pop(guild_id, None)
+        else:
+            self._settings[guild_id] = BurstSettings(action, threshold, lock_role)
+
+    def stop(self):
+        for task in self._flushes.values():
+            task.cancel()
+        self._flushes.clear()
+        self._pending.clear()
+
+    def observe(self, member: discord.Member, now: Optional[float] = None):
+        """
+        Called for every reaction added to a bound message
+        """
+        settings = self._settings.get(member.guild.id)
+        if settings is None or member.bot:
+            return
+        now = time.time() if now is None else now
+        window = self._windows.get(member.guild.id)
+        if window is None:
+            window = self._windows[member.guild.id] = _GuildWindow()
+        window.reactions.add(now)
+
+        if not self.looks_automated(member, now):
+            return
+        window.prune(now)
+        window.suspects.append((now, member.id))
+        if window.suspicious.add(now) < settings.threshold:
+            return
+
+        reason = (
+            f"{window.suspicious.total} reactions from new accounts in "
+            f"{BURST_WINDOW} seconds (of {window.reactions.total} in total)"
+        )
+        # This burst is dealt with, whoever comes next has to make another
+        window.suspicious = RingCounter(BURST_WINDOW)
+        lock_role = settings.lock_role if settings.action == ActionType.KAIZO_LOCK else None
+        while window.suspects:
+            _when, suspect_id = window.suspects.popleft()
+            self.flag(member.guild.id, suspect_id, settings.action, reason, lock_role=lock_role)
+
+    @staticmethod
+    def looks_automated(member: discord.Member, now: float) -> bool:
+        if member.joined_at and now - _timestamp(member.joined_at) < JOIN_REACT_LATENCY:
+            return True
+        return now - _timestamp(member.created_at) < NEW_ACCOUNT_AGE
+
+    def flag(
+        self,
+        guild_id: int,
+        member_id: int,
+        action: ActionType,
+        reason: str,
+        *,
+        lock_role: Optional[int] = None,
+    ):
+        pending = self._pending.setdefault(guild_id, {})
+        # Something already flagged for the harshest action keeps it
+        current = pending.get(member_id)
+        if current is None or action > current.action:
+            pending[member_id] = _Flag(action, reason, lock_role)
+        if guild_id not in self._flushes:
+            self._flushes[guild_id] = asyncio.create_task(self._flush_later(guild_id))
+
+    async def _flush_later(self, guild_id: int):
+        try:
+            await asyncio.sleep(ACTION_BATCH_WINDOW)
+        finally:
+            self._flushes.pop(guild_id, None)
+        flagged = self._pending.pop(guild_id, {})
+        guild = self.cog.bot.get_guild(guild_id)
+        if guild is None or not flagged:
+            return
+        try:
+            await self._apply(guild, flagged)
+        except Exception:
+            log.exception("Error actioning %d flagged members in %d", len(flagged), guild_id)
+
+    async def _apply(self, guild: discord.Guild, flagged: Dict[int, _Flag]):
+        me = guild.me
+        perms = me.guild_permissions
+        bans: List[discord.Member] = []
+        for member_id, flag in flagged.items():
+            member = guild.get_member(member_id)
+            if member is None or member.bot or member.top_role >= me.top_role:
+                continue
+            # Staff testing a honeypot shouldn't get themselves banned
+            if member.guild_permissions.manage_roles:
+                continue
+            reason = f"Automated reaction detected: {flag.reason}"
+            try:
+                if flag.action == ActionType.KAIZO_BAN and perms.ban_members:
+                    bans.append(member)
+                elif flag.action == ActionType.KAIZO_KICK and perms.kick_members:
+                    await member.kick(reason=reason)
+                elif flag.action == ActionType.KAIZO_LOCK:
+                    role = flag.lock_role and guild.get_role(flag.lock_role)
+                    if not role:
+                        log.warning("Can't lock %d in %d, the lock role is unset or deleted", member_id, guild.id)
+                    elif role not in member.roles:
+                        await self.cog.update_roles_atomically(who=member, give=[role])
+                else:
+                    log.warning("Missing permissions to %s %d in %d", flag.action.name, member_id, guild.id)
+            except (PermissionOrHierarchyException, discord.HTTPException):
+                log.warning("Couldn't %s %d in %d", flag.action.name, member_id, guild.id)
+
+        if not bans:
+            return
+        reason = f"Automated reactions ({len(bans)} accounts)"
+        # DEP-WARN: Guild.bulk_ban is discord.py 2.4+
+        if hasattr(guild, "bulk_ban"):
+            for start in range(0, len(bans), 200):
+                try:
+                    await guild.bulk_ban(bans[start : start + 200], reason=reason)
+                except discord.HTTPException:
+                    log.warning("Couldn't bulk ban %d members in %d", len(bans[start : start + 200]), guild.id)
+        else:
+            for member in bans:
+                try:
+                    await member.ban(reason=reason)
+                except discord.HTTPException:
+                    log.warning("Couldn't ban %d in %d", member.id, guild.id)
+        log.info("Banned %d accounts for automated reactions in %d", len(bans), guild.id)
+
+
+def _timestamp(dt: datetime) -> float:
+    # discord.py 2 datetimes are aware, 1.x ones are naive UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
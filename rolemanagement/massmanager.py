@@ -1,10 +1,10 @@
-import csv
-import io
 import logging
-from typing import Optional, cast, Set
+import time
+from typing import Optional, cast, Set, Tuple
 
 import discord
 from redbot.core import checks, commands
+from redbot.core.utils.chat_formatting import box, pagify
 
 from .abc import MixinMeta
 from .converters import (
@@ -12,7 +12,9 @@ from .converters import (
     ComplexActionConverter,
     ComplexSearchConverter,
 )
-from .exceptions import RoleManagementException
+from .export import send_member_export
+from .jobs import MassRoleJob
+from .planner import QueryPlan
 
 try:
     from redbot.core.commands import GuildContext
@@ -42,85 +44,26 @@ class MassManagementMixin(MixinMeta):
         """
         Reusable
         """
+        return QueryPlan.compile(members, query).execute(members)
 
-        if query["everyone"]:
-            return members
-
-        all_set: Set[discord.Member] = set()
-        if query["all"]:
-            first, *rest = query["all"]
-            all_set = set(first.members)
-            for other_role in rest:
-                all_set &= set(other_role.members)
-
-        none_set: Set[discord.Member] = set()
-        if query["none"]:
-            for role in query["none"]:
-                none_set.update(role.members)
-
-        any_set: Set[discord.Member] = set()
-        if query["any"]:
-            for role in query["any"]:
-                any_set.update(role.members)
-
-        minimum_perms: Optional[discord.Permissions] = None
-        if query["hasperm"]:
-            minimum_perms = discord.Permissions()
-            minimum_perms.update(**{x: True for x in query["hasperm"]})
-
-        def mfilter(m: discord.Member) -> bool:
-            if query["bots"] and not m.bot:
-                return False
-
-            if query["humans"] and m.bot:
-                return False
-
-            if query["any"] and m not in any_set:
-                return False
-
-            if query["all"] and m not in all_set:
-                return False
-
-            if query["none"] and m in none_set:
-                return False
-
-            if query["hasperm"] and not m.guild_permissions.is_superset(minimum_perms):
-                return False
-
-            if query["anyperm"] and not any(
-                bool(value and perm in query["anyperm"]) for perm, value in iter(m.guild_permissions)
-            ):
-                return False
-
-            if query["notperm"] and any(
-                bool(value and perm in query["notperm"]) for perm, value in iter(m.guild_permissions)
-            ):
-                return False
-
-            if query["noroles"] and len(m.roles) != 1:
-                return False
-
-            # 0 is a valid option for these, everyone role not counted
-            if query["quantity"] is not None and len(m.roles) - 1 != query["quantity"]:
-                return False
-
-            if query["lt"] is not None and len(m.roles) - 1 >= query["lt"]:
-                return False
-
-            if query["gt"] is not None and len(m.roles) - 1 <= query["gt"]:
-                return False
-
-            if query["above"] and m.top_role <= query["above"]:
-                return False
-
-            if query["below"] and m.top_role >= query["below"]:
-                return False
-
-            return True
-
-        members = {m for m in members if mfilter(m)}
+    def run_search(self, guild: discord.Guild, query: dict) -> Tuple[Optional[QueryPlan], Set[discord.Member]]:
+        """
+        Returns the plan used (None when served from cache) and the matching members
+        """
+        members = self._search_cache.get(guild, query)
+        if members is not None:
+            return None, members
+        plan = QueryPlan.compile(guild.members, query)
+        members = plan.execute(guild.members)
+        self._search_cache.put(guild, query, plan, members)
+        return plan, members
 
-        return members
+    @staticmethod
+    async def send_plan_explanation(ctx: GuildContext, plan: Optional[QueryPlan]):
+        if plan is None:
+            return await ctx.send(box("served from cached results"))
+        for page in pagify(plan.explain()):
+            await ctx.send(box(page))
 
     @mrole.command(name="user")
     async def mrole_user(
@@ -142,6 +85,10 @@ class MassManagementMixin(MixinMeta):
 
         [p]massrole user LoudMouthedUser ProfaneUser --add muted
 
+        [p]massrole user LoudMouthedUser --add muted --duration 1 hour
+
+        Roles added with --duration are removed again after that long
+
         For role operations based on role membership, permissions had, or whether someone is a bot
         (or even just add to/remove from all) see `[p]massrole search` and `[p]massrole modify`
         """
@@ -151,10 +98,9 @@ class MassManagementMixin(MixinMeta):
             await ctx.send("Either you or I don't have the required permissions " "or position in the hierarchy.")
             return
 
-        for user in users:
-            await self.update_roles_atomically(who=user, give=query["add"], remove=query["remove"])
-
-        await ctx.tick()
+        await self.schedule_role_expiry(ctx, query, users)
+        job = await self._jobs.submit(ctx, users, add=query["add"], remove=query["remove"])
+        await self.wait_or_report_job(ctx, job)
 
     @mrole.command(name="search")
     async def mrole_search(self, ctx: GuildContext, *, _query: ComplexSearchConverter):
@@ -182,15 +128,25 @@ class MassManagementMixin(MixinMeta):
         --everyone
 
         --csv
+        --jsonl
+        --gzip
+        --zip
+
+        --explain
 
         csv output will be used if output would exceed embed limits, or if flag is provided
+        jsonl output includes role ids and top role, --gzip or --zip compress the file(s)
+        files are split to stay under the server's upload limit
+
+        explain will show how the search was run and how long it took
         """
 
-        members = set(ctx.guild.members)
         query = _query.parsed
-        members = self.search_filter(members, query)
+        plan, members = self.run_search(ctx.guild, query)
+        if query["explain"]:
+            await self.send_plan_explanation(ctx, plan)
 
-        if len(members) < 50 and not query["csv"]:
+        if len(members) < 50 and not (query["csv"] or query["jsonl"]):
 
             def chunker(memberset, size=3):
                 ret_str = ""
@@ -213,54 +169,16 @@ class MassManagementMixin(MixinMeta):
             )
 
         else:
-            await self.send_maybe_chunked_csv(ctx, list(members))
+            await self.send_maybe_chunked_csv(
+                ctx,
+                members,
+                fmt="jsonl" if query["jsonl"] else "csv",
+                compression=query["compression"],
+            )
 
     @staticmethod
-    async def send_maybe_chunked_csv(ctx: GuildContext, members):
-        chunk_size = 75000
-        chunks = [members[i : (i + chunk_size)] for i in range(0, len(members), chunk_size)]
-
-        for part, chunk in enumerate(chunks, 1):
-
-            csvf = io.StringIO()
-            fieldnames = [
-                "ID",
-                "Display Name",
-                "Username#Discrim",
-                "Joined Server",
-                "Joined Discord",
-            ]
-            fmt = "%Y-%m-%d"
-            writer = csv.DictWriter(csvf, fieldnames=fieldnames)
-            writer.writeheader()
-            for member in chunk:
-                writer.writerow(
-                    {
-                        "ID": member.id,
-                        "Display Name": member.display_name,
-                        "Username#Discrim": str(member),
-                        "Joined Server": member.joined_at.strftime(fmt) if member.joined_at else None,
-                        "Joined Discord": member.created_at.strftime(fmt),
-                    }
-                )
-
-            csvf.seek(0)
-            b_data = csvf.read().encode()
-            data = io.BytesIO(b_data)
-            data.seek(0)
-            filename = f"{ctx.message.id}"
-            if len(chunks) > 1:
-                filename += f"-part{part}"
-            filename += ".csv"
-            await ctx.send(
-                content=f"Data for {ctx.author.mention}",
-                files=[discord.File(data, filename=filename)],
-                allowed_mentions=discord.AllowedMentions.all(),
-            )
-            csvf.close()
-            data.close()
-            del csvf
-            del data
+    async def send_maybe_chunked_csv(ctx: GuildContext, members, *, fmt: str = "csv", compression=None):
+        await send_member_export(ctx, members, fmt=fmt, compression=compression)
 
     @mrole.command(name="modify")
     async def mrole_complex(self, ctx: GuildContext, *, _query: ComplexActionConverter):
@@ -289,6 +207,11 @@ class MassManagementMixin(MixinMeta):
 
         --add roles
         --remove roles
+        --duration time
+
+        --explain
+
+        roles added with --duration are removed again after that long
         """
         query = _query.parsed
         apply = query["add"] + query["remove"]
@@ -297,29 +220,60 @@ class MassManagementMixin(MixinMeta):
                 "Either you or I don't have the required permissions " "or position in the hierarchy."
             )
 
-        members = set(ctx.guild.members)
-        members = self.search_filter(members, query)
-
-        if len(members) > 100:
-            await ctx.send("This may take a while given the number of members to update.")
-
-        async with ctx.typing():
-            for member in members:
-                try:
-                    await self.update_roles_atomically(who=member, give=query["add"], remove=query["remove"])
-                except RoleManagementException:
-                    log.debug(
-                        "Internal filter failure on member id %d guild id %d query %s",
-                        member.id,
-                        ctx.guild.id,
-                        query,
-                    )
-                except discord.HTTPException:
-                    log.debug(
-                        "Unpredicted failure for member id %d in guild id %d query %s",
-                        member.id,
-                        ctx.guild.id,
-                        query,
-                    )
-
-        await ctx.tick()
+        plan, members = self.run_search(ctx.guild, query)
+        if query["explain"]:
+            await self.send_plan_explanation(ctx, plan)
+
+        await self.schedule_role_expiry(ctx, query, members)
+        job = await self._jobs.submit(ctx, members, add=query["add"], remove=query["remove"])
+        await self.wait_or_report_job(ctx, job)
+
+    async def schedule_role_expiry(self, ctx: GuildContext, query: dict, members):
+        """
+        For --duration, scheduled before the roles go on so none are missed
+        """
+        if query["duration"] is None:
+            return
+        expires = time.time() + query["duration"].total_seconds()
+        for role in query["add"]:
+            # Only those the job gives it to, a role someone already had stays
+            self._timed.add(ctx.guild, [role.id], [m.id for m in members if role not in m.roles], expires)
+        # Stored now, a restart before the next flush would otherwise leave the roles on
+        await self._timed.flush()
+
+    async def wait_or_report_job(self, ctx: GuildContext, job: MassRoleJob):
+        """
+        Small jobs are waited on, anything else reports back when done
+        """
+        if job.quiet:
+            await job.finished.wait()
+            await ctx.tick()
+        else:
+            await ctx.send(
+                f"Started job `{job.job_id}` for {job.total} members. "
+                f"Use `{ctx.clean_prefix}massrole jobs` to check on it "
+                f"or `{ctx.clean_prefix}massrole cancel {job.job_id}` to stop it."
+            )
+
+    @mrole.command(name="jobs")
+    async def mrole_jobs(self, ctx: GuildContext):
+        """
+        Shows the progress of running massrole jobs
+        """
+        jobs = self._jobs.for_guild(ctx.guild)
+        if not jobs:
+            return await ctx.send("There aren't any massrole jobs running here.")
+        for page in pagify("\n".join(job.progress() for job in jobs)):
+            await ctx.send(page)
+
+    @mrole.command(name="cancel")
+    async def mrole_cancel(self, ctx: GuildContext, job_id: str):
+        """
+        Cancels a running massrole job
+
+        Members which were already updated keep their changes.
+        """
+        job = await self._jobs.cancel(ctx.guild, job_id)
+        if job is None:
+            return await ctx.send("No such job.")
+        await ctx.send(f"Cancelled job `{job.job_id}` after {job.processed}/{job.total} members.")
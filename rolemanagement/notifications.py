@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional
+
+import discord
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.notifications")
+
+DM_WORKERS = 8
+
+
+def fallback_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
+    """
+    Where to tell someone something if they can't be DMed.
+
+    The system channel if we can speak there, otherwise the first channel we can.
+    """
+    channel = guild.system_channel
+    if channel and channel.permissions_for(guild.me).send_messages:
+        return channel
+    for channel in guild.text_channels:
+        if channel.permissions_for(guild.me).send_messages:
+            return channel
+    return None
+
+
+class _Notification(NamedTuple):
+    member: discord.Member
+    content: str
+    fallback: Optional[discord.TextChannel]
+    fallback_suffix: str
+
+
+class DMQueue:
+    """
+    Sends DMs from a bounded pool of workers so callers don't wait on them.
+    """
+
+    def __init__(self, workers: int = DM_WORKERS):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._count = workers
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._count)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+
+    def send(
+        self,
+        member: discord.Member,
+        content: str,
+        *,
+        fallback: Optional[discord.TextChannel] = None,
+        fallback_suffix: str = "",
+    ):
+        self._queue.put_nowait(_Notification(member, content, fallback, fallback_suffix))
+
+    async def join(self):
+        await self._queue.join()
+
+    async def _worker(self):
+        while True:
+            note = await self._queue.get()
+            try:
+                await self._deliver(note)
+            except Exception:
+                log.exception("Unexpected error sending a notification to %d", note.member.id)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    async def _deliver(note: _Notification):
+        try:
+            await note.member.send(note.content)
+        except discord.HTTPException:
+            if note.fallback is None:
+                return
+            try:
+                await note.fallback.send(note.content + note.fallback_suffix)
+            except discord.HTTPException:
+                pass
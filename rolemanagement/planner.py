@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import time
+from collections import Counter
+from typing import Callable, Collection, Iterable, List, NamedTuple, Optional, Set
+
+import discord
+
+# Relative cost of evaluating a clause against a single member.
+# These only need to be right relative to each other.
+COST_FLAG = 1.0  # attribute lookup
+COST_ROLE = 2.0  # per role id, binary search on member._roles
+COST_COUNT = 3.0  # building member.roles
+COST_TOP_ROLE = 10.0  # member.top_role walks and compares roles
+COST_PERMS = 25.0  # member.guild_permissions folds every role + owner checks
+
+# Selectivity guesses used when nothing better is known.
+# (fraction of members expected to pass the clause)
+DEFAULT_SELECTIVITY = 0.5
+BOT_SELECTIVITY = 0.05
+
+
+def _perms_from_names(names: List[str]) -> discord.Permissions:
+    # update() quietly ignores anything which isn't a permission flag
+    perms = discord.Permissions()
+    perms.update(**{x: True for x in names})
+    return perms
+
+
+class Clause(NamedTuple):
+    label: str
+    cost: float
+    selectivity: float
+    check: Callable[[discord.Member], bool]
+
+    @property
+    def rank(self) -> float:
+        """
+        Classic predicate ordering rank, cheapest and most selective first
+        """
+        if self.selectivity >= 1:
+            return float("inf")
+        return self.cost / (1 - self.selectivity)
+
+
+class Stage(NamedTuple):
+    label: str
+    rows_in: int
+    rows_out: int
+    seconds: float
+
+
+class QueryPlan:
+    """
+    A compiled massrole query.
+
+    Only the clauses which are active in the query are kept, the most selective
+    one is used to build the starting candidate set, and the rest are applied
+    to the (hopefully much smaller) candidate set in order of estimated rank.
+
+    DEP-WARN
+    Role membership clauses assume member._roles remains
+    a SnowflakeList with ``.has()``
+    """
+
+    def __init__(
+        self,
+        clauses: List[Clause],
+        *,
+        everyone: bool = False,
+        counted_roles: int = 0,
+        compile_time: float = 0.0,
+        role_ids: Optional[Set[int]] = None,
+        any_role_change: bool = False,
+    ):
+        self.clauses = clauses
+        self.everyone = everyone
+        self.counted_roles = counted_roles
+        self.compile_time = compile_time
+        # Which role changes can alter the result of this plan,
+        # either gaining/losing one of role_ids, or any role change at all
+        # for clauses on role counts, hierarchy, or permissions.
+        self.role_ids: Set[int] = role_ids or set()
+        self.any_role_change = any_role_change
+        self.stages: List[Stage] = []
+
+    @classmethod
+    def compile(cls, members: Collection[discord.Member], query: dict) -> QueryPlan:
+        start = time.perf_counter()
+
+        if query["everyone"]:
+            return cls([], everyone=True, compile_time=time.perf_counter() - start)
+
+        # Role sizes are only worth counting if there is a choice to make.
+        role_ids = {r.id for attr in ("all", "any", "none") for r in query[attr]}
+        sizes: Optional[Counter] = None
+        if len(role_ids) > 1:
+            sizes = Counter()
+            for m in members:
+                for rid in m._roles:
+                    if rid in role_ids:
+                        sizes[rid] += 1
+
+        total = max(len(members), 1)
+
+        def frac(role: discord.Role) -> float:
+            if sizes is None:
+                return DEFAULT_SELECTIVITY
+            return min(sizes[role.id] / total, 1.0)
+
+        clauses: List[Clause] = []
+
+        if query["bots"]:
+            clauses.append(Clause("only bots", COST_FLAG, BOT_SELECTIVITY, lambda m: m.bot))
+
+        if query["humans"]:
+            clauses.append(Clause("only humans", COST_FLAG, 1 - BOT_SELECTIVITY, lambda m: not m.bot))
+
+        # each role in --has-all is its own clause so the smallest can lead
+        for role in query["all"]:
+            clauses.append(
+                Clause(
+                    f"has role {role.name}",
+                    COST_ROLE,
+                    frac(role),
+                    (lambda rid: lambda m: m._roles.has(rid))(role.id),
+                )
+            )
+
+        if query["any"]:
+            any_ids = [r.id for r in query["any"]]
+            clauses.append(
+                Clause(
+                    f"has any of {len(any_ids)} roles",
+                    COST_ROLE * len(any_ids),
+                    min(sum(frac(r) for r in query["any"]), 1.0),
+                    lambda m: any(m._roles.has(rid) for rid in any_ids),
+                )
+            )
+
+        if query["none"]:
+            none_ids = [r.id for r in query["none"]]
+            clauses.append(
+                Clause(
+                    f"has none of {len(none_ids)} roles",
+                    COST_ROLE * len(none_ids),
+                    max(1 - sum(frac(r) for r in query["none"]), 0.0),
+                    lambda m: not any(m._roles.has(rid) for rid in none_ids),
+                )
+            )
+
+        if query["noroles"]:
+            clauses.append(Clause("has no roles", COST_COUNT, DEFAULT_SELECTIVITY, lambda m: len(m.roles) == 1))
+
+        # 0 is a valid option for these, everyone role not counted
+        if query["quantity"] is not None:
+            quantity = query["quantity"]
+            clauses.append(
+                Clause(
+                    f"has exactly {quantity} roles",
+                    COST_COUNT,
+                    DEFAULT_SELECTIVITY,
+                    lambda m: len(m.roles) - 1 == quantity,
+                )
+            )
+
+        if query["lt"] is not None:
+            lt = query["lt"]
+            clauses.append(
+                Clause(f"has less than {lt} roles", COST_COUNT, DEFAULT_SELECTIVITY, lambda m: len(m.roles) - 1 < lt)
+            )
+
+        if query["gt"] is not None:
+            gt = query["gt"]
+            clauses.append(
+                Clause(f"has more than {gt} roles", COST_COUNT, DEFAULT_SELECTIVITY, lambda m: len(m.roles) - 1 > gt)
+            )
+
+        if query["above"]:
+            above = query["above"]
+            clauses.append(
+                Clause(f"above {above.name}", COST_TOP_ROLE, DEFAULT_SELECTIVITY, lambda m: m.top_role > above)
+            )
+
+        if query["below"]:
+            below = query["below"]
+            clauses.append(
+                Clause(f"below {below.name}", COST_TOP_ROLE, DEFAULT_SELECTIVITY, lambda m: m.top_role < below)
+            )
+
+        # guild_permissions already expands administrator to every permission,
+        # so comparing bitmasks is equivalent to checking each flag by name.
+        if query["hasperm"]:
+            minimum_perms = _perms_from_names(query["hasperm"])
+            clauses.append(
+                Clause(
+                    f"has perms {', '.join(query['hasperm'])}",
+                    COST_PERMS,
+                    DEFAULT_SELECTIVITY,
+                    lambda m: m.guild_permissions.is_superset(minimum_perms),
+                )
+            )
+
+        if query["anyperm"]:
+            any_mask = _perms_from_names(query["anyperm"]).value
+            clauses.append(
+                Clause(
+                    f"has any perm of {', '.join(query['anyperm'])}",
+                    COST_PERMS,
+                    DEFAULT_SELECTIVITY,
+                    lambda m: bool(m.guild_permissions.value & any_mask),
+                )
+            )
+
+        if query["notperm"]:
+            not_mask = _perms_from_names(query["notperm"]).value
+            clauses.append(
+                Clause(
+                    f"lacks perms {', '.join(query['notperm'])}",
+                    COST_PERMS,
+                    DEFAULT_SELECTIVITY,
+                    lambda m: not (m.guild_permissions.value & not_mask),
+                )
+            )
+
+        clauses.sort(key=lambda c: c.rank)
+
+        counted_roles = len(role_ids) if sizes is not None else 0
+        if query["above"]:
+            role_ids.add(query["above"].id)
+        if query["below"]:
+            role_ids.add(query["below"].id)
+
+        any_role_change = any(
+            (
+                query["noroles"],
+                query["quantity"] is not None,
+                query["lt"] is not None,
+                query["gt"] is not None,
+                query["above"],
+                query["below"],
+                query["hasperm"],
+                query["anyperm"],
+                query["notperm"],
+            )
+        )
+
+        return cls(
+            clauses,
+            counted_roles=counted_roles,
+            compile_time=time.perf_counter() - start,
+            role_ids=role_ids,
+            any_role_change=any_role_change,
+        )
+
+    def affected_by(self, role_ids: Set[int]) -> bool:
+        """
+        If gaining or losing any of these roles could change the result
+        """
+        if self.everyone:
+            return False
+        return self.any_role_change or not self.role_ids.isdisjoint(role_ids)
+
+    def matches(self, member: discord.Member) -> bool:
+        """
+        Checks a single member against the plan
+        """
+        return all(c.check(member) for c in self.clauses)
+
+    def execute(self, members: Iterable[discord.Member]) -> Set[discord.Member]:
+        """
+        Runs the plan against the provided members
+        """
+        self.stages = []
+
+        if not self.clauses:
+            start = time.perf_counter()
+            ret = set(members)
+            self.stages.append(Stage("everyone", len(ret), len(ret), time.perf_counter() - start))
+            return ret
+
+        source, *rest = self.clauses
+
+        start = time.perf_counter()
+        rows_in = 0
+        candidates: List[discord.Member] = []
+        for m in members:
+            rows_in += 1
+            if source.check(m):
+                candidates.append(m)
+        self.stages.append(Stage(f"source: {source.label}", rows_in, len(candidates), time.perf_counter() - start))
+
+        for clause in rest:
+            if not candidates:
+                break
+            start = time.perf_counter()
+            rows_in = len(candidates)
+            candidates = [m for m in candidates if clause.check(m)]
+            self.stages.append(Stage(f"filter: {clause.label}", rows_in, len(candidates), time.perf_counter() - start))
+
+        return set(candidates)
+
+    @property
+    def total_time(self) -> float:
+        return self.compile_time + sum(s.seconds for s in self.stages)
+
+    def explain(self) -> str:
+        """
+        Human readable plan, including timing from the last execution
+        """
+        lines = []
+        if self.counted_roles:
+            lines.append(f"estimates from member counts of {self.counted_roles} roles")
+        lines.append(f"compile: {self.compile_time * 1000:.2f}ms")
+
+        if self.stages:
+            for idx, stage in enumerate(self.stages, 1):
+                lines.append(
+                    f"{idx}. {stage.label}: {stage.rows_in} -> {stage.rows_out} ({stage.seconds * 1000:.2f}ms)"
+                )
+            executed = len(self.stages)
+            if not self.everyone and executed < len(self.clauses):
+                lines.append(f"skipped {len(self.clauses) - executed} clauses (no candidates left)")
+        else:
+            for idx, clause in enumerate(self.clauses, 1):
+                lines.append(f"{idx}. {clause.label} (cost {clause.cost:g}, selectivity {clause.selectivity:.2f})")
+
+        lines.append(f"total: {self.total_time * 1000:.2f}ms")
+        return "\n".join(lines)
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Generic, TypeVar
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.queues")
+
+T = TypeVar("T")
+
+
+class PerGuildQueue(Generic[T]):
+    """
+    Work items processed one at a time per guild, in arrival order.
+
+    Role edits for a guild share a rate limit bucket, so running them one at
+    a time per guild means a burst (e.g. a join raid) is paced by discord.py's
+    handling of that bucket instead of piling concurrent requests onto it.
+    Callers only enqueue, and a worker only exists while its guild has work.
+    """
+
+    def __init__(self, handler: Callable[[T], Awaitable[None]], *, name: str = "queue"):
+        self.handler = handler
+        self.name = name
+        self._pending: Dict[int, Deque[T]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def put(self, guild_id: int, item: T):
+        self._pending.setdefault(guild_id, deque()).append(item)
+        if guild_id not in self._workers:
+            self._workers[guild_id] = asyncio.create_task(self._work(guild_id))
+
+    def backlog(self, guild_id: int) -> int:
+        return len(self._pending.get(guild_id, ()))
+
+    def stop(self):
+        for task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+        self._pending.clear()
+
+    async def _work(self, guild_id: int):
+        try:
+            pending = self._pending[guild_id]
+            while pending:
+                item = pending.popleft()
+                try:
+                    await self.handler(item)
+                except Exception:
+                    log.exception("Error in %s for guild %d", self.name, guild_id)
+        finally:
+            self._workers.pop(guild_id, None)
+            if not self._pending.get(guild_id):
+                self._pending.pop(guild_id, None)
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+import discord
+
+from .bindings import Binding
+from .exceptions import PermissionOrHierarchyException
+from .future_sql import ActionType
+
+if TYPE_CHECKING:
+    from .core import RoleManagement
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.reconcile")
+
+# Channels read at once. Fetching reaction users shares a per-channel route
+# bucket which discord.py paces, so more than this mostly queues up on it.
+RECONCILE_CONCURRENCY = 4
+CHECKPOINT_INTERVAL = 15
+# The most users discord gives back per page of a reaction
+PAGE_SIZE = 100
+
+# Only these say anything about who should have the role from who reacted
+GIVES_ON_REACT = (ActionType.TOGGLE, ActionType.ADD)
+# Where a bound message can be, threads and voice channel chats included
+MESSAGE_CHANNELS = (discord.TextChannel, discord.Thread, discord.VoiceChannel)
+
+
+class ReactionReconciler:
+    """
+    Catches up on reaction roles after time spent disconnected.
+
+    Walks every bound message, a channel at a time, paging through who
+    reacted and giving the role to anyone who should have it but doesn't.
+    With removals enabled for a guild, toggle roles are also taken from
+    anyone who has them without having reacted to any of the role's
+    bindings, once every one of them has been read in full. Roles go
+    through the same checks and coalesced edits as a live reaction would,
+    but without messaging anyone: roles needing an age check are only
+    given to those whose age is already known to be enough.
+
+    Progress is checkpointed to ``config.reconcile_state`` as::
+
+        {"done": [message ids], "cursors": {"<message id>-<emoji>": last user id paged}}
+
+    so a pass cut short by a restart picks up where it left off first,
+    then goes over what it had already done, since more may have been
+    missed while it was down.
+    """
+
+    def __init__(self, cog: RoleManagement):
+        self.cog = cog
+        self._task: Optional[asyncio.Task] = None
+        self._again = False
+        self._done: Set[int] = set()
+        self._cursors: Dict[str, int] = {}
+        self._dirty = False
+        self._last_checkpoint = 0.0
+        # Per role, who reacted to any of its bindings this pass, and how many were read in full
+        self._reacted: Dict[int, Set[int]] = {}
+        self._read: Dict[int, int] = {}
+        self.given = 0
+        self.removed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        """
+        Starts a pass, or asks for another once the current one is done
+        """
+        if self._task is not None and not self._task.done():
+            self._again = True
+            return self._task
+        self._again = False
+        self._task = task = asyncio.create_task(self._run())
+        return task
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        state = await self.cog.config.reconcile_state()
+        self._done = set(state.get("done", ()))
+        self._cursors = dict(state.get("cursors", {}))
+        # A pass cut short is finished first, then everything is gone over again.
+        # start() may have asked for another already, while this was loading.
+        self._again = self._again or bool(self._done or self._cursors)
+        while True:
+            start = time.perf_counter()
+            self.given = self.removed = 0
+            try:
+                await self._pass()
+            except asyncio.CancelledError:
+                await self._checkpoint(force=True)
+                raise
+            except Exception:
+                log.exception("Error reconciling reaction roles")
+                await self._checkpoint(force=True)
+                return
+            log.info(
+                "Reconciled reaction roles in %.1f seconds: %d missing roles given, %d removed",
+                time.perf_counter() - start,
+                self.given,
+                self.removed,
+            )
+            if not self._again:
+                break
+            self._again = False
+            self._done = set()
+            self._cursors = {}
+        await self.cog.config.reconcile_state.clear()
+
+    async def _pass(self):
+        by_channel: Dict[int, Dict[int, List[Binding]]] = {}
+        for guild in self.cog.bot.guilds:
+            if guild.unavailable:
+                continue
+            for binding in self.cog._bindings.for_guild(guild.id):
+                if binding.message_id in self._done or binding.channel_id is None:
+                    continue
+                by_channel.setdefault(binding.channel_id, {}).setdefault(
+                    binding.message_id, []
+                ).append(binding)
+
+        # Half done messages first, they're what a restart left stale longest
+        partial = {int(k.partition("-")[0]) for k in self._cursors}
+        channels = sorted(by_channel.items(), key=lambda kv: partial.isdisjoint(kv[1]))
+        sem = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+        self._reacted = {}
+        self._read = {}
+
+        async def run_channel(channel_id: int, messages: Dict[int, List[Binding]]):
+            async with sem:
+                await self._channel(channel_id, messages)
+
+        await asyncio.gather(*(run_channel(c, m) for c, m in channels))
+        await self._remove_unreacted()
+        self._reacted = {}
+        self._read = {}
+
+    async def _channel(self, channel_id: int, messages: Dict[int, List[Binding]]):
+        channel = self.cog.bot.get_channel(channel_id)
+        if channel is None:
+            # Archived threads aren't cached
+            try:
+                channel = await self.cog.bot.fetch_channel(channel_id)
+            except discord.HTTPException:
+                return
+        if not isinstance(channel, MESSAGE_CHANNELS):
+            return
+        guild = channel.guild
+        perms = channel.permissions_for(guild.me)
+        if not (perms.view_channel and perms.read_message_history):
+            return
+        if await self.cog.bot.cog_disabled_in_guild(self.cog, guild):
+            return
+        await self.cog.maybe_update_guilds(guild)
+
+        for message_id, bindings in messages.items():
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.HTTPException:
+                # Gone, or not readable right now; rrcleanup deals with dead ones
+                self._mark_done(message_id)
+                continue
+            for binding in bindings:
+                await self._binding(guild, message, binding)
+            self._mark_done(message_id)
+            await self._checkpoint()
+
+    async def _binding(self, guild: discord.Guild, message: discord.Message, binding: Binding):
+        if binding.action_type not in GIVES_ON_REACT:
+            return
+        role = guild.get_role(binding.role_id)
+        if role is None or role >= guild.me.top_role:
+            return
+
+        reaction = next(
+            (r for r in message.reactions if self._eid(r.emoji) == binding.eid), None
+        )
+        key = f"{message.id}-{binding.eid}"
+        cursor = self._cursors.get(key)
+        reacted: Set[int] = set()
+        if reaction is not None:
+            after = discord.Object(cursor) if cursor else None
+            async for user in reaction.users(limit=None, after=after):
+                reacted.add(user.id)
+                member = guild.get_member(user.id)
+                if member and not member.bot and role not in member.roles:
+                    if not self.cog.verification_level_issue(member):
+                        try:
+                            # Nobody is messaged for a reaction they made a while ago
+                            given = await self.cog.grant_reaction_role(member, role, quiet=True)
+                        except (PermissionOrHierarchyException, discord.HTTPException):
+                            pass
+                        else:
+                            self.given += given
+                if len(reacted) % PAGE_SIZE == 0:
+                    self._cursors[key] = user.id
+                    self._dirty = True
+                    await self._checkpoint()
+
+        # Who didn't react is only known having seen everyone who did
+        if cursor is None:
+            self._reacted.setdefault(role.id, set()).update(reacted)
+            self._read[role.id] = self._read.get(role.id, 0) + 1
+
+    async def _remove_unreacted(self):
+        """
+        Takes toggle roles from those who reacted to none of the role's bindings.
+
+        Only for roles bound solely as toggles, with every binding read in
+        full this pass; otherwise someone may rightly have the role without
+        a reaction we saw.
+        """
+        for guild in self.cog.bot.guilds:
+            if guild.unavailable or await self.cog.bot.cog_disabled_in_guild(self.cog, guild):
+                continue
+            if not await self.cog.config.guild(guild).reconcile_removals():
+                continue
+            by_role: Dict[int, List[Binding]] = {}
+            for binding in self.cog._bindings.for_guild(guild.id):
+                by_role.setdefault(binding.role_id, []).append(binding)
+            for role_id, bindings in by_role.items():
+                if self._read.get(role_id, 0) < len(bindings):
+                    continue
+                if any(b.action_type != ActionType.TOGGLE for b in bindings):
+                    continue
+                role = guild.get_role(role_id)
+                if role is None or role >= guild.me.top_role:
+                    continue
+                reacted = self._reacted.get(role_id, set())
+                for member in [m for m in role.members if m.id not in reacted and not m.bot]:
+                    try:
+                        await self.cog.update_roles_atomically(who=member, remove=[role])
+                    except (PermissionOrHierarchyException, discord.HTTPException):
+                        continue
+                    self.removed += 1
+
+    def _eid(self, emoji) -> str:
+        if getattr(emoji, "id", None):
+            return str(emoji.id)
+        return self.cog.strip_variations(str(emoji))
+
+    def _mark_done(self, message_id: int):
+        self._done.add(message_id)
+        prefix = f"{message_id}-"
+        for key in [k for k in self._cursors if k.startswith(prefix)]:
+            del self._cursors[key]
+        self._dirty = True
+
+    async def _checkpoint(self, *, force: bool = False):
+        now = time.monotonic()
+        if not self._dirty or (not force and now - self._last_checkpoint < CHECKPOINT_INTERVAL):
+            return
+        self._dirty = False
+        self._last_checkpoint = now
+        await self.cog.config.reconcile_state.set(
+            {"done": list(self._done), "cursors": self._cursors}
+        )
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import discord
+
+from .exceptions import RuleImportError
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+YAML_AVAILABLE = yaml is not None
+
+# Per role settings which describe how the role behaves, as opposed to who has it
+RULE_FIELDS = (
+    "exclusive_to",
+    "requires_any",
+    "requires_all",
+    "add_with",
+    "sticky",
+    "self_removable",
+    "self_role",
+    "protected",
+    "cost",
+    "subscription",
+    "timed",
+    "dm_msg",
+    "age_verification",
+)
+ROLE_LIST_FIELDS = ("requires_any", "requires_all", "add_with")
+BOOL_FIELDS = ("sticky", "self_removable", "self_role", "protected")
+
+# field: (old, new)
+RoleDiff = Dict[str, Tuple[Any, Any]]
+
+
+def export_rules(guild: discord.Guild, role_data: Dict[discord.Role, dict], fmt: str) -> str:
+    """
+    Dumps the rules for every role in a guild which has any set.
+    """
+    def live(ids: List[int]) -> List[int]:
+        # Deleted roles can linger in settings, they'd only fail an import
+        return [i for i in ids if guild.get_role(i)]
+
+    roles = {}
+    for role, data in sorted(role_data.items(), key=lambda kv: kv[0], reverse=True):
+        rules = {k: data[k] for k in RULE_FIELDS}
+        for field in ROLE_LIST_FIELDS:
+            rules[field] = live(rules[field])
+        rules["exclusive_to"] = {
+            g: ids for g, ids in ((g, live(v)) for g, v in rules["exclusive_to"].items()) if ids
+        }
+        if any(rules.values()):
+            roles[str(role.id)] = {"name": role.name, **rules}
+    payload = {"guild": guild.id, "roles": roles}
+    if fmt == "yaml":
+        return str(yaml.safe_dump(payload, sort_keys=False, allow_unicode=True))
+    return json.dumps(payload, indent=2, ensure_ascii=False)
+
+
+def load_rules(text: str) -> dict:
+    """
+    Parses a JSON or YAML rule set, JSON being valid YAML
+    """
+    try:
+        if yaml is not None:
+            payload = yaml.safe_load(text)
+        else:
+            payload = json.loads(text)
+    except Exception as exc:
+        raise RuleImportError([f"Couldn't read that file: {exc}"])
+    if not isinstance(payload, dict) or not isinstance(payload.get("roles"), dict):
+        raise RuleImportError(["Expected a mapping with a `roles` mapping in it."])
+    return payload
+
+
+class _Resolver:
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.by_name: Dict[str, List[discord.Role]] = {}
+        for role in guild.roles:
+            self.by_name.setdefault(role.name, []).append(role)
+
+    def __call__(self, ref: Any) -> Optional[discord.Role]:
+        """
+        Roles are referred to by id, falling back to a unique name,
+        so rules exported from one server can be loaded into another.
+        """
+        if isinstance(ref, int) or (isinstance(ref, str) and ref.isdigit()):
+            role = self.guild.get_role(int(ref))
+            if role:
+                return role
+        matches = self.by_name.get(str(ref), [])
+        return matches[0] if len(matches) == 1 else None
+
+
+def validate_rules(
+    guild: discord.Guild, payload: dict, *, min_sub_time: int
+) -> Dict[discord.Role, Dict[str, Any]]:
+    """
+    Resolves and checks a rule set, raising with every problem found at once.
+
+    Only fields present for a role are returned; the rest are left alone.
+    """
+    resolve = _Resolver(guild)
+    problems: List[str] = []
+    ret: Dict[discord.Role, Dict[str, Any]] = {}
+
+    for key, entry in payload["roles"].items():
+        if not isinstance(entry, dict):
+            problems.append(f"`{key}`: expected a mapping of settings.")
+            continue
+        role = resolve(key)
+        if role is None and "name" in entry:
+            role = resolve(entry["name"])
+        if role is None:
+            problems.append(f"`{key}`: no such role (or more than one with that name).")
+            continue
+
+        def role_ids(field: str, refs: Any) -> List[int]:
+            if not isinstance(refs, list):
+                problems.append(f"`{role}` {field}: expected a list of roles.")
+                return []
+            ids = []
+            for ref in refs:
+                r = resolve(ref)
+                if r is None:
+                    problems.append(f"`{role}` {field}: no such role `{ref}`.")
+                else:
+                    ids.append(r.id)
+            return ids
+
+        rules: Dict[str, Any] = {}
+        for field, value in entry.items():
+            if field == "name":
+                continue
+            if field not in RULE_FIELDS:
+                problems.append(f"`{role}`: unknown setting `{field}`.")
+            elif field in ROLE_LIST_FIELDS:
+                rules[field] = role_ids(field, value)
+            elif field == "exclusive_to":
+                if not isinstance(value, dict):
+                    problems.append(f"`{role}` exclusive_to: expected a mapping of group to roles.")
+                    continue
+                rules[field] = {str(g): role_ids(f"exclusive_to[{g}]", v) for g, v in value.items()}
+            elif field in BOOL_FIELDS:
+                if not isinstance(value, bool):
+                    problems.append(f"`{role}` {field}: expected true or false.")
+                rules[field] = bool(value)
+            elif field in ("cost", "subscription", "timed"):
+                if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                    problems.append(f"`{role}` {field}: expected a whole number, 0 or more.")
+                elif field == "subscription" and 0 < value < min_sub_time:
+                    problems.append(f"`{role}` subscription: must be 0 or at least {min_sub_time} seconds.")
+                rules[field] = value
+            elif field == "age_verification":
+                if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value <= 0):
+                    problems.append(f"`{role}` age_verification: expected an age, or null.")
+                rules[field] = value
+            elif field == "dm_msg":
+                if value is not None and not isinstance(value, str):
+                    problems.append(f"`{role}` dm_msg: expected text, or null.")
+                rules[field] = value
+        if role in ret:
+            problems.append(f"`{role}` is listed more than once.")
+        ret[role] = rules
+
+    if problems:
+        raise RuleImportError(problems)
+    return ret
+
+
+def diff_rules(
+    current: Dict[discord.Role, dict], incoming: Dict[discord.Role, Dict[str, Any]]
+) -> Dict[discord.Role, RoleDiff]:
+    ret: Dict[discord.Role, RoleDiff] = {}
+    for role, rules in incoming.items():
+        changes = {
+            field: (current[role][field], value)
+            for field, value in rules.items()
+            if current[role][field] != value
+        }
+        if changes:
+            ret[role] = changes
+    return ret
+
+
+def format_diff(diff: Dict[discord.Role, RoleDiff]) -> str:
+    lines = []
+    for role, changes in sorted(diff.items(), key=lambda kv: kv[0], reverse=True):
+        lines.append(f"{role.name} ({role.id})")
+        for field, (old, new) in changes.items():
+            lines.append(f"  {field}: {old!r} -> {new!r}")
+    return "\n".join(lines)
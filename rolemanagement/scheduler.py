@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.scheduler")
+
+K = TypeVar("K", bound=Hashable)
+
+# How long entries wait after their callback fails before it's tried again
+RETRY_DELAY = 60
+
+
+class Scheduler(Generic[K]):
+    """
+    A min-heap of (due time, key) which sleeps until the next entry is due.
+
+    Due entries are handed to ``callback`` in batches of everything due at once.
+    Rescheduling or cancelling a key is O(log n) / O(1); stale heap entries are
+    skipped when they reach the top rather than searched for and removed.
+    Nothing runs while idle. If ``callback`` raises, the batch is retried
+    after ``RETRY_DELAY``, so callbacks need to be safe to run twice.
+    """
+
+    def __init__(self, callback: Callable[[List[K]], Awaitable[None]], *, name: str = "scheduler"):
+        self.callback = callback
+        self.name = name
+        self._heap: List[Tuple[float, K]] = []
+        self._due: Dict[K, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._due
+
+    def when(self, key: K) -> Optional[float]:
+        return self._due.get(key)
+
+    def schedule(self, key: K, when: float):
+        wake = not self._heap or when < self._heap[0][0]
+        self._due[key] = when
+        heapq.heappush(self._heap, (when, key))
+        if wake:
+            self._wakeup.set()
+
+    def load(self, entries: Iterable[Tuple[K, float]]):
+        """
+        Bulk load, O(n) rather than O(n log n) for pushing one at a time
+        """
+        for key, when in entries:
+            self._due[key] = when
+        self._heap = [(when, key) for key, when in self._due.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def cancel(self, key: K):
+        self._due.pop(key, None)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def _pop_stale(self):
+        while self._heap:
+            when, key = self._heap[0]
+            if self._due.get(key) == when:
+                return
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._pop_stale()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            batch: List[K] = []
+            while self._heap and self._heap[0][0] <= now:
+                when, key = heapq.heappop(self._heap)
+                if self._due.get(key) == when:
+                    del self._due[key]
+                    batch.append(key)
+
+            if batch:
+                try:
+                    await self.callback(batch)
+                except Exception:
+                    log.exception("Error in %s while handling %d due entries", self.name, len(batch))
+                    # Try again later rather than losing them until a reload, leaving
+                    # alone anything the callback already put back on the schedule
+                    retry = time.time() + RETRY_DELAY
+                    for key in batch:
+                        if key not in self._due:
+                            self.schedule(key, retry)
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+import discord
+
+from .planner import QueryPlan
+
+# Result sets can be large, only the most recently used few are kept per guild
+MAX_ENTRIES_PER_GUILD = 4
+# Anything missed (while disconnected, or not covered by an event) is only stale this long
+ENTRY_TTL = 600
+
+# Keys which decide which members match.
+# Output and action flags (--csv, --add, ...) are intentionally left out
+# so that a search and a modify with the same filter share an entry.
+_ROLE_KEYS = ("all", "any", "none")
+_PERM_KEYS = ("hasperm", "anyperm", "notperm")
+_VALUE_KEYS = ("everyone", "bots", "humans", "noroles", "quantity", "lt", "gt")
+
+
+def fingerprint(query: dict) -> Tuple[Hashable, ...]:
+    """
+    Normalizes a parsed massrole query to something hashable
+    """
+    parts: list = []
+    for key in _ROLE_KEYS:
+        parts.append(frozenset(r.id for r in query[key]))
+    for key in _PERM_KEYS:
+        parts.append(frozenset(query[key]))
+    for key in ("above", "below"):
+        parts.append(query[key].id if query[key] else None)
+    for key in _VALUE_KEYS:
+        parts.append(query[key])
+    return tuple(parts)
+
+
+class _Entry:
+    __slots__ = ("plan", "member_ids", "created")
+
+    def __init__(self, plan: QueryPlan, member_ids: Set[int]):
+        self.plan = plan
+        self.member_ids = member_ids
+        self.created = time.monotonic()
+
+
+class SearchCache:
+    """
+    Per guild massrole search results.
+
+    Rather than throwing results away on every member event, entries are kept
+    exact by re-checking only the member which changed, and only for entries
+    whose plan could be affected by the roles involved.
+    Role edits which can change results for many members at once
+    (permissions, hierarchy, deletion) drop the affected entries instead,
+    as does an ownership change, and entries expire after ``ENTRY_TTL``.
+    """
+
+    def __init__(self):
+        self._guilds: Dict[int, OrderedDict] = {}
+
+    def get(self, guild: discord.Guild, query: dict) -> Optional[Set[discord.Member]]:
+        entries = self._guilds.get(guild.id)
+        if not entries:
+            return None
+        key = fingerprint(query)
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > ENTRY_TTL:
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return {m for m in map(guild.get_member, entry.member_ids) if m is not None}
+
+    def put(self, guild: discord.Guild, query: dict, plan: QueryPlan, members: Set[discord.Member]):
+        # A partial member cache would give partial results forever after
+        if not guild.chunked:
+            return
+        entries = self._guilds.setdefault(guild.id, OrderedDict())
+        entries[fingerprint(query)] = _Entry(plan, {m.id for m in members})
+        while len(entries) > MAX_ENTRIES_PER_GUILD:
+            entries.popitem(last=False)
+
+    def member_updated(self, member: discord.Member, changed: Set[int]):
+        for entry in self._guilds.get(member.guild.id, {}).values():
+            if entry.plan.affected_by(changed):
+                self._recheck(entry, member)
+
+    def member_joined(self, member: discord.Member):
+        for entry in self._guilds.get(member.guild.id, {}).values():
+            self._recheck(entry, member)
+
+    def member_left(self, member: discord.Member):
+        for entry in self._guilds.get(member.guild.id, {}).values():
+            entry.member_ids.discard(member.id)
+
+    def role_changed(self, role: discord.Role):
+        """
+        For role updates and deletions
+        """
+        entries = self._guilds.get(role.guild.id)
+        if not entries:
+            return
+        for key in [k for k, e in entries.items() if e.plan.affected_by({role.id})]:
+            del entries[key]
+
+    def clear(self, guild: Optional[discord.Guild] = None):
+        if guild is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild.id, None)
+
+    @staticmethod
+    def _recheck(entry: _Entry, member: discord.Member):
+        if entry.plan.matches(member):
+            entry.member_ids.add(member.id)
+        else:
+            entry.member_ids.discard(member.id)
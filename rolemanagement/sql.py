@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from .future_sql import ActionType
+
+T = TypeVar("T")
+
+# This is the schema sketched out in future_sql.py, made valid and indexed.
+# The few columns which are not there (guild_id on roles and sticky_roles,
+# group_name on exclusions, requires_all on requires) are needed to be able
+# to round trip what Config holds today. Its members table is left out,
+# nothing stores kaizo outcomes per member.
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS roles (
+    role_id INTEGER PRIMARY KEY NOT NULL,
+    guild_id INTEGER,
+    self_role BOOLEAN DEFAULT FALSE,
+    sticky BOOLEAN DEFAULT FALSE,
+    self_removable BOOLEAN DEFAULT FALSE,
+    -- useful for preventing pre 10 minute bypass
+    -- and just for keeping it to people who have been around a bit
+    minimum_join_time INTEGER DEFAULT 0,
+    cost INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS exclusions (
+    role_id INTEGER NOT NULL REFERENCES roles(role_id) ON DELETE CASCADE,
+    -- intentional no ref, blocked roles don't need settings of their own
+    blocks_role_id INTEGER NOT NULL,
+    group_name TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (role_id, group_name, blocks_role_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS requires (
+    role_id INTEGER NOT NULL REFERENCES roles(role_id) ON DELETE CASCADE,
+    requires_role_id INTEGER NOT NULL,
+    requires_all BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (role_id, requires_all, requires_role_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS actions (
+    message_id INTEGER NOT NULL,
+    reaction TEXT NOT NULL,  -- unicode emoji or str(discord.Emoji.id)
+    channel_id INTEGER,
+    guild_id INTEGER,
+    action_type INTEGER NOT NULL DEFAULT 1,  -- handle as enum from python
+    role_id INTEGER NOT NULL,
+    PRIMARY KEY (message_id, reaction)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS actions_role_id ON actions(role_id);
+CREATE INDEX IF NOT EXISTS actions_guild_id ON actions(guild_id);
+
+CREATE TABLE IF NOT EXISTS sticky_roles (
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,  -- intentional no ref
+    role_id INTEGER NOT NULL,  -- intentional no ref, Config never required role settings
+    PRIMARY KEY (guild_id, member_id, role_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS sticky_roles_member_id ON sticky_roles(member_id);
+"""
+
+# Statements are kept as module level constants so that sqlite3's statement
+# cache prepares each of them once per connection and reuses them after.
+UPSERT_ACTION = """
+INSERT INTO actions (message_id, reaction, channel_id, guild_id, action_type, role_id)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (message_id, reaction) DO UPDATE SET
+    channel_id = excluded.channel_id,
+    guild_id = excluded.guild_id,
+    action_type = excluded.action_type,
+    role_id = excluded.role_id
+"""
+DELETE_ACTION = "DELETE FROM actions WHERE message_id = ? AND reaction = ?"
+
+GET_STICKY = "SELECT role_id FROM sticky_roles WHERE guild_id = ? AND member_id = ?"
+GET_GUILD_STICKY = "SELECT member_id, role_id FROM sticky_roles WHERE guild_id = ?"
+ALL_STICKY = "SELECT guild_id, member_id, role_id FROM sticky_roles"
+DELETE_STICKY = "DELETE FROM sticky_roles WHERE guild_id = ? AND member_id = ?"
+INSERT_STICKY = "INSERT OR IGNORE INTO sticky_roles (guild_id, member_id, role_id) VALUES (?, ?, ?)"
+
+DELETE_ROLE = "DELETE FROM roles WHERE role_id = ?"
+GET_EXCLUSIONS = "SELECT blocks_role_id FROM exclusions WHERE role_id = ?"
+GET_SELF_REMOVABLE = "SELECT self_removable FROM roles WHERE role_id = ?"
+
+UPSERT_ROLE = """
+INSERT INTO roles (role_id, guild_id, self_role, sticky, self_removable, cost)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (role_id) DO UPDATE SET
+    guild_id = excluded.guild_id,
+    self_role = excluded.self_role,
+    sticky = excluded.sticky,
+    self_removable = excluded.self_removable,
+    cost = excluded.cost
+"""
+DELETE_ROLE_EXCLUSIONS = "DELETE FROM exclusions WHERE role_id = ?"
+INSERT_EXCLUSION = "INSERT OR IGNORE INTO exclusions (role_id, group_name, blocks_role_id) VALUES (?, ?, ?)"
+DELETE_ROLE_REQUIRES = "DELETE FROM requires WHERE role_id = ?"
+INSERT_REQUIRES = "INSERT OR IGNORE INTO requires (role_id, requires_all, requires_role_id) VALUES (?, ?, ?)"
+
+
+class SQLiteStore:
+    """
+    Optional SQLite storage for the hot paths of rolemanagement.
+
+    When enabled:
+      - sticky role membership lives here instead of in Config
+      - role rules are mirrored here from Config so that lookups are
+        single indexed queries instead of deserializing nested Config data
+      - reaction role bindings are mirrored too, so the database holds
+        everything needed to switch back; lookups use the binding index
+
+    Lookups are point queries or small batches on an index, so these are
+    run directly. Bulk work (migrating, writing many members' sticky roles)
+    is sent off to a thread with its own connection instead; WAL lets
+    lookups carry on meanwhile.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), isolation_level=None, cached_statements=64)
+        conn.executescript(SCHEMA)
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    async def in_thread(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Runs ``func(conn, *args)`` in a thread, on a connection of its own
+        """
+
+        def run() -> T:
+            conn = self._connect()
+            try:
+                return func(conn, *args)
+            finally:
+                conn.close()
+
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # reaction roles
+
+    def set_action(
+        self,
+        *,
+        message_id: int,
+        reaction: str,
+        channel_id: Optional[int],
+        guild_id: Optional[int],
+        role_id: int,
+        action_type: ActionType = ActionType.TOGGLE,
+    ):
+        self.conn.execute(
+            UPSERT_ACTION,
+            (message_id, reaction, channel_id, guild_id, int(action_type), role_id),
+        )
+
+    def delete_actions(self, keys: Iterable[Tuple[int, str]]):
+        with self.transaction() as conn:
+            conn.executemany(DELETE_ACTION, keys)
+
+    # sticky roles
+
+    def get_sticky(self, guild_id: int, member_id: int) -> List[int]:
+        return [r for (r,) in self.conn.execute(GET_STICKY, (guild_id, member_id))]
+
+    def get_guild_sticky(self, guild_id: int) -> Dict[int, List[int]]:
+        ret: Dict[int, List[int]] = {}
+        for member_id, role_id in self.conn.execute(GET_GUILD_STICKY, (guild_id,)):
+            ret.setdefault(member_id, []).append(role_id)
+        return ret
+
+    async def all_sticky(self) -> Dict[int, Dict[int, List[int]]]:
+        return await self.in_thread(self._all_sticky)
+
+    @staticmethod
+    def _all_sticky(conn: sqlite3.Connection) -> Dict[int, Dict[int, List[int]]]:
+        ret: Dict[int, Dict[int, List[int]]] = {}
+        for guild_id, member_id, role_id in conn.execute(ALL_STICKY):
+            ret.setdefault(guild_id, {}).setdefault(member_id, []).append(role_id)
+        return ret
+
+    async def write_sticky(self, guild_id: int, updates: Dict[int, List[int]]):
+        await self.in_thread(self._write_sticky, guild_id, updates)
+
+    @staticmethod
+    def _write_sticky(conn: sqlite3.Connection, guild_id: int, updates: Dict[int, List[int]]):
+        with _Transaction(conn):
+            conn.executemany(DELETE_STICKY, ((guild_id, m) for m in updates))
+            conn.executemany(
+                INSERT_STICKY,
+                ((guild_id, m, r) for m, rids in updates.items() for r in rids),
+            )
+
+    # role rules
+
+    def get_exclusions(self, role_id: int) -> Set[int]:
+        return {r for (r,) in self.conn.execute(GET_EXCLUSIONS, (role_id,))}
+
+    def is_self_removable(self, role_id: int) -> bool:
+        row = self.conn.execute(GET_SELF_REMOVABLE, (role_id,)).fetchone()
+        return bool(row and row[0])
+
+    def sync_roles(self, roles: Dict[int, Tuple[Optional[int], Dict[str, Any]]]):
+        """
+        Replaces the stored rules for the given roles with Config's
+
+        roles maps role id -> (guild id, config.role(...).all())
+        """
+        with self.transaction() as conn:
+            for role_id, (guild_id, data) in roles.items():
+                self._sync_role(conn, role_id, guild_id, data)
+
+    def delete_roles(self, role_ids: Iterable[int]):
+        with self.transaction() as conn:
+            conn.executemany(DELETE_ROLE, ((r,) for r in role_ids))
+
+    @staticmethod
+    def _sync_role(conn: sqlite3.Connection, role_id: int, guild_id: Optional[int], data: Dict[str, Any]):
+        conn.execute(
+            UPSERT_ROLE,
+            (
+                role_id,
+                guild_id,
+                data.get("self_role", False),
+                data.get("sticky", False),
+                data.get("self_removable", False),
+                data.get("cost", 0),
+            ),
+        )
+        conn.execute(DELETE_ROLE_EXCLUSIONS, (role_id,))
+        conn.executemany(
+            INSERT_EXCLUSION,
+            (
+                (role_id, group, blocked)
+                for group, blocked_ids in data.get("exclusive_to", {}).items()
+                for blocked in blocked_ids
+            ),
+        )
+        conn.execute(DELETE_ROLE_REQUIRES, (role_id,))
+        conn.executemany(INSERT_REQUIRES, ((role_id, False, r) for r in data.get("requires_any", [])))
+        conn.executemany(INSERT_REQUIRES, ((role_id, True, r) for r in data.get("requires_all", [])))
+
+    # migration
+
+    async def import_config(
+        self,
+        *,
+        roles: Dict[int, Tuple[Optional[int], Dict[str, Any]]],
+        reactroles: Dict[str, Dict[str, Dict[str, Any]]],
+        sticky: Dict[int, Dict[int, List[int]]],
+    ):
+        """
+        Replaces everything with what Config has, in one transaction
+        so a failed migration leaves the previous data alone
+        """
+        await self.in_thread(self._import_config, roles, reactroles, sticky)
+
+    @classmethod
+    def _import_config(
+        cls,
+        conn: sqlite3.Connection,
+        roles: Dict[int, Tuple[Optional[int], Dict[str, Any]]],
+        reactroles: Dict[str, Dict[str, Dict[str, Any]]],
+        sticky: Dict[int, Dict[int, List[int]]],
+    ):
+        with _Transaction(conn):
+            for table in ("exclusions", "requires", "roles", "actions", "sticky_roles"):
+                conn.execute(f"DELETE FROM {table}")  # nosec
+            for role_id, (guild_id, data) in roles.items():
+                cls._sync_role(conn, role_id, guild_id, data)
+
+            conn.executemany(
+                UPSERT_ACTION,
+                (
+                    (
+                        int(message_id),
+                        reaction,
+                        data.get("channelid"),
+                        data.get("guildid"),
+                        int(data.get("action_type", ActionType.TOGGLE)),
+                        data["roleid"],
+                    )
+                    for message_id, reactions in reactroles.items()
+                    if message_id.isdigit() and isinstance(reactions, dict)
+                    for reaction, data in reactions.items()
+                    if data and data.get("roleid") is not None
+                ),
+            )
+
+            conn.executemany(
+                INSERT_STICKY,
+                (
+                    (guild_id, member_id, role_id)
+                    for guild_id, members in sticky.items()
+                    for member_id, rids in members.items()
+                    for role_id in rids
+                ),
+            )
+
+    def transaction(self) -> _Transaction:
+        return _Transaction(self.conn)
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from array import array
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from redbot.core import Config
+
+from .utils import update_raw_entries
+
+if TYPE_CHECKING:
+    from .sql import SQLiteStore
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.sticky")
+
+FLUSH_INTERVAL = 10
+
+MemberKey = Tuple[int, int]  # guild id, member id
+
+
+class StickyRoleStore:
+    """
+    Write-behind store for ``config.member(...).roles``.
+
+    Role ids are kept in memory as compact arrays, changes are marked dirty
+    and written out in one batch per guild on a timer and on unload,
+    instead of a full read-modify-write of the member data per role change.
+
+    Also keeps the set of sticky role ids so that callers can skip
+    the store entirely for changes which don't involve a sticky role.
+
+    If ``sql`` is set, member data is read from and written to SQLite instead.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.sticky_roles: Set[int] = set()
+        self._members: Dict[MemberKey, array] = {}
+        self._dirty: Set[MemberKey] = set()
+        self._preloaded: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.sql: Optional[SQLiteStore] = None
+
+    async def load(self):
+        self.sticky_roles = {
+            role_id for role_id, data in (await self.config.all_roles()).items() if data.get("sticky", False)
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+    async def set_backend(self, sql: Optional[SQLiteStore]):
+        """
+        Switches storage, pending changes are written out to the old storage first
+        """
+        await self.flush()
+        self.sql = sql
+        self._members.clear()
+        self._preloaded.clear()
+
+    def set_sticky(self, role_id: int, sticky: bool):
+        if sticky:
+            self.sticky_roles.add(role_id)
+        else:
+            self.sticky_roles.discard(role_id)
+
+    def filter_sticky(self, role_ids: Iterable[int]) -> Set[int]:
+        return self.sticky_roles.intersection(role_ids)
+
+    async def preload(self, guild_id: int):
+        """
+        Loads every member of a guild in one read, for bulk operations
+        """
+        if guild_id in self._preloaded:
+            return
+        if self.sql is not None:
+            for member_id, rids in self.sql.get_guild_sticky(guild_id).items():
+                self._members.setdefault((guild_id, member_id), array("Q", rids))
+        else:
+            data = await self._member_group(guild_id).get_raw(default={})
+            for member_id, mdata in data.items():
+                self._members.setdefault((guild_id, int(member_id)), array("Q", mdata.get("roles", [])))
+        self._preloaded.add(guild_id)
+
+    async def get(self, guild_id: int, member_id: int) -> array:
+        key = (guild_id, member_id)
+        rids = self._members.get(key)
+        if rids is None:
+            if guild_id in self._preloaded:
+                rids = array("Q")
+            elif self.sql is not None:
+                rids = array("Q", self.sql.get_sticky(guild_id, member_id))
+            else:
+                rids = array("Q", await self.config.member_from_ids(guild_id, member_id).roles())
+            # something else may have loaded it while we were waiting
+            rids = self._members.setdefault(key, rids)
+        return rids
+
+    async def update(
+        self,
+        guild_id: int,
+        member_id: int,
+        *,
+        add: Iterable[int] = (),
+        remove: Iterable[int] = (),
+    ):
+        rids = await self.get(guild_id, member_id)
+        changed = False
+        for r in remove:
+            while r in rids:
+                rids.remove(r)
+                changed = True
+        for r in add:
+            if r not in rids:
+                rids.append(r)
+                changed = True
+        if changed:
+            self._dirty.add((guild_id, member_id))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        """
+        Writes out pending changes, then holds off further writes while
+        the caller works on stored data directly.
+
+        Anything cached is re-read afterwards, so callers' changes are seen.
+        """
+        async with self._lock:
+            await self._flush()
+            try:
+                yield
+            finally:
+                for key in [k for k in self._members if k not in self._dirty]:
+                    del self._members[key]
+                self._preloaded.clear()
+
+    async def flush(self, guild_id: Optional[int] = None):
+        """
+        Writes out pending changes, for one guild if given
+        """
+        async with self._lock:
+            await self._flush(guild_id)
+
+    async def _flush(self, guild_id: Optional[int] = None):
+        if guild_id is None:
+            dirty, self._dirty = self._dirty, set()
+        else:
+            dirty = {key for key in self._dirty if key[0] == guild_id}
+            self._dirty -= dirty
+        if not dirty:
+            return
+        by_guild: Dict[int, Dict[int, List[int]]] = {}
+        for guild_id, member_id in dirty:
+            rids = self._members.get((guild_id, member_id))
+            if rids is not None:
+                by_guild.setdefault(guild_id, {})[member_id] = rids.tolist()
+
+        for guild_id, updates in by_guild.items():
+            try:
+                await self.write_guild(guild_id, updates)
+            except Exception:
+                log.exception("Failed to write sticky roles for guild %d, will retry", guild_id)
+                # put them back so the next flush picks them up
+                self._dirty.update((guild_id, m) for m in updates)
+
+    def _member_group(self, guild_id: int):
+        """
+        DEP-WARN
+        See update_raw_entries
+        """
+        return self.config._get_base_group(Config.MEMBER, str(guild_id))
+
+    async def write_guild(self, guild_id: int, updates: Dict[int, List[int]]):
+        """
+        One write for every changed member of a guild
+        """
+        if self.sql is not None:
+            await self.sql.write_sticky(guild_id, updates)
+            return
+        await update_raw_entries(
+            self._member_group(guild_id),
+            {member_id: {"roles": rids} for member_id, rids in updates.items()},
+        )
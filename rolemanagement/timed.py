@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+from .exceptions import PermissionOrHierarchyException
+from .queues import PerGuildQueue
+from .scheduler import Scheduler
+
+if TYPE_CHECKING:
+    from .core import RoleManagement
+
+log = logging.getLogger("red.sinbadcogs.rolemanagement.timed")
+
+TimedKey = Tuple[int, int, int]  # guild id, role id, member id
+
+# If a guild is unavailable when a role is due to come off, try again after this long
+RETRY_UNAVAILABLE = 300
+# Stored expiries are written out at most this often
+FLUSH_INTERVAL = 10
+
+
+def _config_key(role_id: int, member_id: int) -> str:
+    return f"{member_id}-{role_id}"
+
+
+class TimedRoles:
+    """
+    Roles which are taken away again after a while.
+
+    Expiry times are stored per guild and put on a Scheduler once at startup,
+    so nothing runs until one is due. Due removals go through a per-guild
+    queue, so a lot of roles expiring at once is paced like any other
+    batch of role edits rather than sent all at once.
+
+    Changes to stored expiries are written behind, one write per guild
+    on a timer and on unload, rather than a read-modify-write of the
+    guild's expiries per member. Each role's duration is kept in memory
+    so role changes don't need to read it.
+    """
+
+    def __init__(self, cog: RoleManagement):
+        self.cog = cog
+        self._schedule: Scheduler[TimedKey] = Scheduler(self._due, name="timed roles")
+        self._removals: PerGuildQueue[TimedKey] = PerGuildQueue(
+            self._remove, name="timed role removals"
+        )
+        self._durations: Dict[int, int] = {}
+        # guild id -> config key -> expiry, or None to remove it
+        self._pending: Dict[int, Dict[str, Optional[float]]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._schedule)
+
+    def __contains__(self, key: TimedKey) -> bool:
+        return key in self._schedule
+
+    def expires(self, key: TimedKey):
+        return self._schedule.when(key)
+
+    def duration(self, role_id: int) -> int:
+        return self._durations.get(role_id, 0)
+
+    def set_duration(self, role_id: int, seconds: int):
+        if seconds:
+            self._durations[role_id] = seconds
+        else:
+            self._durations.pop(role_id, None)
+
+    async def load(self):
+        self._durations = {
+            role_id: data["timed"]
+            for role_id, data in (await self.cog.config.all_roles()).items()
+            if data.get("timed")
+        }
+        entries = []
+        for guild_id, guild_data in (await self.cog.config.all_guilds()).items():
+            for key, when in guild_data.get("timed_roles", {}).items():
+                member_id, _, role_id = key.partition("-")
+                entries.append(((guild_id, int(role_id), int(member_id)), when))
+        self._schedule.load(entries)
+        self._schedule.start()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        self._schedule.stop()
+        self._removals.stop()
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+    def _store(self, key: TimedKey, expires: Optional[float]):
+        guild_id, role_id, member_id = key
+        self._pending.setdefault(guild_id, {})[_config_key(role_id, member_id)] = expires
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            for guild_id, changes in pending.items():
+                try:
+                    async with self.cog.config.guild_from_id(guild_id).timed_roles() as timed:
+                        for key, expires in changes.items():
+                            if expires is None:
+                                timed.pop(key, None)
+                            else:
+                                timed[key] = expires
+                except Exception:
+                    log.exception("Failed to write timed roles for guild %d, will retry", guild_id)
+                    # put them back under anything changed since, for the next flush
+                    changes.update(self._pending.get(guild_id, {}))
+                    self._pending[guild_id] = changes
+
+    def add(
+        self, guild: discord.Guild, role_ids: Iterable[int], member_ids: Iterable[int], expires: float
+    ):
+        """
+        Stores and schedules expiries for every pairing
+        """
+        for key in [(guild.id, r, m) for r in role_ids for m in member_ids]:
+            self._store(key, expires)
+            self._schedule.schedule(key, expires)
+
+    def cancel(self, key: TimedKey):
+        if key not in self._schedule:
+            return
+        self._schedule.cancel(key)
+        self._store(key, None)
+
+    async def _due(self, keys: List[TimedKey]):
+        for key in keys:
+            self._removals.put(key[0], key)
+
+    async def _remove(self, key: TimedKey):
+        guild_id, role_id, member_id = key
+        guild = self.cog.bot.get_guild(guild_id)
+        if guild is not None and guild.unavailable:
+            self._schedule.schedule(key, time.time() + RETRY_UNAVAILABLE)
+            return
+
+        member = guild and guild.get_member(member_id)
+        role = guild and guild.get_role(role_id)
+        if member and role and role in member.roles:
+            try:
+                await self.cog.update_roles_atomically(who=member, remove=[role])
+            except (PermissionOrHierarchyException, discord.HTTPException):
+                log.warning("Couldn't remove timed role %d from %d in %d", role_id, member_id, guild_id)
+        self._store(key, None)
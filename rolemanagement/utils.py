@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import asyncio
 import re
-from typing import List
-from datetime import timedelta
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import date, datetime, timedelta
 import discord
 
 from .abc import MixinMeta
+from .bindings import Binding
 from .exceptions import (
     ConflictingRoleException,
     MissingRequirementsException,
@@ -26,6 +29,9 @@ TIME_RE_STRING = r"\s?".join(
 
 TIME_RE = re.compile(TIME_RE_STRING, re.I)
 
+CHUNK_NOTICE_AFTER = 2
+CHUNK_PROGRESS_INTERVAL = 5
+
 
 def parse_timedelta(argument: str) -> timedelta:
     """
@@ -39,6 +45,18 @@ def parse_timedelta(argument: str) -> timedelta:
     return None
 
 
+def age_from_dob(dob: date) -> int:
+    """
+    Age in whole years as of today (UTC)
+    """
+    today = datetime.utcnow().date()
+    age = today.year - dob.year
+    # birthday hasn't passed this year, compared this way so Feb 29th works
+    if (dob.month, dob.day) > (today.month, today.day):
+        age -= 1
+    return age
+
+
 def parse_seconds(seconds) -> str:
     """
     Take seconds and converts it to larger units
@@ -67,6 +85,26 @@ def parse_seconds(seconds) -> str:
     return ", ".join(msg)
 
 
+async def update_raw_entries(group, updates: Dict[int, Dict[str, Any]]):
+    """
+    Updates fields for many entries of a Config base group
+    (e.g. every member of a guild) without a scope object per entry.
+
+    The changes are merged into a fresh read of the group under its lock
+    and written back with a single set, so this is one write however
+    many entries change, and fields not given are left as they were.
+
+    DEP-WARN
+    group should come from Config._get_base_group, which has no public
+    equivalent for writing many members/users/roles at once.
+    """
+    async with group.get_lock():
+        data = await group.get_raw(default={})
+        for key, fields in updates.items():
+            data.setdefault(str(key), {}).update(fields)
+        await group.set(data)
+
+
 class UtilMixin(MixinMeta):
     """
     Mixin for utils, some of which need things stored in the class
@@ -93,13 +131,56 @@ class UtilMixin(MixinMeta):
         give = give or []
         remove = remove or []
         heirarchy_testing = give + remove
-        roles = [r for r in who.roles if r not in remove]
-        roles.extend([r for r in give if r not in roles])
-        if sorted(roles) == sorted(who.roles):
-            return
+        give, remove = await self.implied_roles(who, give, remove)
+        # With an edit pending, "no change" may not hold anymore by the time it's sent
+        if not self._edits.has_pending(who):
+            current = self._edits.current_role_ids(who)
+            if all(r.id in current for r in give) and not any(r.id in current for r in remove):
+                return
         if any(r >= me.top_role for r in heirarchy_testing) or not me.guild_permissions.manage_roles:
             raise PermissionOrHierarchyException("Can't do that.")
-        await who.edit(roles=roles)
+        await self._edits.edit(who, give=give, remove=remove)
+
+    async def implied_roles(
+        self, who: discord.Member, give: List[discord.Role], remove: List[discord.Role]
+    ) -> Tuple[List[discord.Role], List[discord.Role]]:
+        """
+        Extends an edit with what on_member_update would otherwise do
+        after it in a second edit: add_with roles of roles being given,
+        and removal of held roles exclusive to them.
+
+        Implied roles the bot can't manage are left out rather than
+        failing the edit.
+        """
+        guild = who.guild
+        top = guild.me.top_role
+        give, remove = list(give), list(remove)
+        current = self._edits.current_role_ids(who)
+        pending = [r for r in give if r.id not in current]
+        if not pending:
+            return give, remove
+
+        data = await self.config.all_roles()
+        seen = {r.id for r in give}
+        ex: Set[int] = set()
+        while pending:
+            settings = data.get(pending.pop().id, {})
+            for ex_roles in settings.get("exclusive_to", {}).values():
+                ex.update(ex_roles)
+            for rid in settings.get("add_with", []):
+                implied = guild.get_role(rid)
+                if implied is None or rid in seen or implied >= top or implied in remove:
+                    continue
+                seen.add(rid)
+                give.append(implied)
+                if rid not in current:
+                    pending.append(implied)
+        remove.extend(
+            r
+            for r in map(guild.get_role, current & ex)
+            if r is not None and r < top and r not in give and r not in remove
+        )
+        return give, remove
 
     async def all_are_valid_roles(self, ctx, *roles: discord.Role) -> bool:
         """
@@ -173,19 +254,82 @@ class UtilMixin(MixinMeta):
         Returns a list of roles to remove, or raises an error
         """
 
+        if self._sql is not None:
+            ex_ids = self._sql.get_exclusions(role.id)
+            conflicts: List[discord.Role] = [r for r in who.roles if r.id in ex_ids]
+            for r in conflicts:
+                if not self._sql.is_self_removable(r.id):
+                    raise ConflictingRoleException(conflicts=conflicts)
+            return conflicts
+
         data = await self.config.all_roles()
         ex_data = data.get(role.id, {}).get("exclusive_to", {}).values()
         ex = []
         for ex_roles in ex_data:
             ex.extend(ex_roles)
-        conflicts: List[discord.Role] = [r for r in who.roles if r.id in ex]
+        conflicts = [r for r in who.roles if r.id in ex]
 
         for r in conflicts:
             if not data.get(r.id, {}).get("self_removable", False):
                 raise ConflictingRoleException(conflicts=conflicts)
         return conflicts
 
+    async def get_exclusive_role_ids(self, role_id: int) -> Set[int]:
+        """
+        Every role id which is exclusive to this one, from any group
+        """
+        if self._sql is not None:
+            return self._sql.get_exclusions(role_id)
+        ex: Set[int] = set()
+        for ex_roles in (await self.config.role_from_id(role_id).exclusive_to()).values():
+            ex.update(ex_roles)
+        return ex
+
+    def get_reaction_binding(self, message_id: int, eid: str) -> Optional[Binding]:
+        """
+        The binding for a reaction on a message, if any
+        """
+        return self._bindings.get(message_id, eid)
+
     async def maybe_update_guilds(self, *guilds: discord.Guild):
-        _guilds = [g for g in guilds if not g.unavailable and g.large and not g.chunked]
-        if _guilds:
-            await self.bot.request_offline_members(*_guilds)
+        await self._chunker.ensure(*guilds)
+
+    async def wait_for_members(self, ctx):
+        """
+        Like maybe_update_guilds, but tells the user what's taking so long
+        """
+        task = self._chunker.start(ctx.guild)
+        if task is None:
+            return
+        started = time.perf_counter() - self._chunker.elapsed(ctx.guild)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=CHUNK_NOTICE_AFTER)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        def status() -> str:
+            have, total = self._chunker.progress(ctx.guild)
+            return (
+                f"Fetching this server's member list before continuing, "
+                f"{have}/{total or '?'} members so far."
+            )
+
+        msg = await ctx.send(status())
+        while not task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout=CHUNK_PROGRESS_INTERVAL)
+            except asyncio.TimeoutError:
+                try:
+                    await msg.edit(content=status())
+                except discord.HTTPException:
+                    pass
+        # Raises if fetching failed, rather than continuing with a partial member list
+        task.result()
+        try:
+            await msg.edit(
+                content=f"Fetched {len(ctx.guild.members)} members "
+                f"in {time.perf_counter() - started:.1f} seconds."
+            )
+        except discord.HTTPException:
+            pass